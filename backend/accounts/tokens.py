@@ -1,8 +1,15 @@
 """
 Custom JWT tokens for Core API compatibility
 """
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework_simplejwt.tokens import AccessToken as BaseAccessToken, RefreshToken as BaseRefreshToken
 
+logger = logging.getLogger(__name__)
+
 
 class CustomAccessToken(BaseAccessToken):
     """
@@ -91,3 +98,55 @@ class CustomRefreshToken(BaseRefreshToken):
             token['type'] = 'refresh'
         
         return token
+
+
+# ==================== Core service token ====================
+
+CORE_TOKEN_CACHE_KEY = 'core_access_token:{user_id}'
+
+
+def get_core_access_token(user):
+    """
+    دریافت access token کوتاه‌مدت برای فراخوانی Core API
+    
+    توکن برای هر کاربر در Redis کش می‌شود و پیش از انقضا (RAG_CORE_TOKEN_RENEW_BEFORE)
+    تجدید می‌شود؛ برخلاف RefreshToken.for_user رکورد OutstandingToken ایجاد نمی‌کند.
+    
+    Args:
+        user: User instance
+        
+    Returns:
+        str: JWT access token
+    """
+    key = CORE_TOKEN_CACHE_KEY.format(user_id=user.pk)
+    try:
+        cached = cache.get(key)
+        if cached:
+            return cached
+    except Exception as e:
+        logger.warning(f"Core token cache unavailable: {e}")
+    
+    lifetime = settings.RAG_CORE_TOKEN_LIFETIME
+    token = CustomAccessToken.for_user(user)
+    token.set_exp(lifetime=timedelta(seconds=lifetime))
+    token_str = str(token)
+    
+    ttl = lifetime - settings.RAG_CORE_TOKEN_RENEW_BEFORE
+    if ttl > 0:
+        try:
+            cache.set(key, token_str, ttl)
+        except Exception as e:
+            logger.warning(f"Core token cache unavailable: {e}")
+    
+    return token_str
+
+
+def invalidate_core_access_token(*user_ids):
+    """حذف توکن کش شده (مثلاً پس از تغییر اشتراک که tier را تغییر می‌دهد)"""
+    keys = [CORE_TOKEN_CACHE_KEY.format(user_id=user_id) for user_id in user_ids]
+    if not keys:
+        return
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logger.warning(f"Core token cache invalidation failed: {e}")
@@ -0,0 +1,210 @@
+"""
+کش پاسخ برای سوالات تکراری (exact-match)
+فقط برای اولین سوال یک گفتگوی جدید (بدون context) و بدون فایل ضمیمه استفاده می‌شود.
+
+ساختار در Redis:
+- answer_cache:entry:<sha256>  پاسخ JSON با TTL
+- answer_cache:lru             sorted set با زمان آخرین دسترسی (برای محدودیت تعداد)
+- answer_cache:hits / misses   شمارنده‌های نرخ hit
+"""
+import hashlib
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from core.utils import normalize_persian_text
+from .core_service import core_service
+
+logger = logging.getLogger(__name__)
+
+ENTRY_PREFIX = 'answer_cache:entry:'
+LRU_KEY = 'answer_cache:lru'
+HITS_KEY = 'answer_cache:hits'
+MISSES_KEY = 'answer_cache:misses'
+
+# فیلدهای پاسخ Core که ذخیره می‌شوند (شناسه‌های conversation/message مخصوص کاربر اصلی هستند)
+CACHED_FIELDS = ('answer', 'sources', 'model_used')
+
+
+def is_cacheable(new_conversation=False, file_attachments=None):
+    """
+    آیا این سوال قابل پاسخ از کش است؟
+
+    معیار، نبود conversation در درخواست (start_turn: new_conversation) است و نه
+    خالی بودن rag_conversation_id؛ گفتگویی که پاسخ اولش از کش آمده شناسه Core
+    ندارد ولی سوالات بعدی آن به سوال قبلی وابسته‌اند.
+    """
+    return settings.ANSWER_CACHE_ENABLED and bool(new_conversation) and not file_attachments
+
+
+def make_key(query, language='fa', enable_web_search=None):
+    """
+    کلید کش بر اساس متن نرمال شده، زبان و وضعیت جستجوی وب
+
+    enable_web_search مقدار resolve شده (پس از preferences کاربر) است؛ None
+    یعنی پیش‌فرض سرور و با False صریح متفاوت است.
+    """
+    web_search = {True: '1', False: '0'}.get(enable_web_search, 'default')
+    raw = '\x1f'.join([
+        normalize_persian_text(query),
+        language or 'fa',
+        web_search,
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def lookup(key):
+    """
+    خواندن پاسخ از کش
+
+    Returns:
+        dict پاسخ (با cached=True) یا None
+    """
+    try:
+        redis = _redis()
+        payload = redis.get(ENTRY_PREFIX + key)
+        if payload is None:
+            redis.incr(MISSES_KEY)
+            return None
+        pipe = redis.pipeline()
+        pipe.incr(HITS_KEY)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Answer cache unavailable: {e}")
+        return None
+
+    response = json.loads(payload)
+    response['cached'] = True
+    response['cache_key'] = key
+    return response
+
+
+def store(key, response):
+    """ذخیره پاسخ موفق Core و حذف قدیمی‌ترین ورودی‌ها در صورت عبور از سقف"""
+    if not response or not response.get('answer'):
+        return
+
+    payload = json.dumps(
+        {field: response[field] for field in CACHED_FIELDS if field in response},
+        ensure_ascii=False,
+        default=str
+    )
+    ttl = settings.ANSWER_CACHE_TTL
+    max_entries = settings.ANSWER_CACHE_MAX_ENTRIES
+    now = time.time()
+
+    try:
+        redis = _redis()
+        pipe = redis.pipeline()
+        pipe.set(ENTRY_PREFIX + key, payload, ex=ttl)
+        pipe.zadd(LRU_KEY, {key: now})
+        # ورودی‌های منقضی شده از index
+        pipe.zremrangebyscore(LRU_KEY, '-inf', now - ttl)
+        pipe.zcard(LRU_KEY)
+        size = pipe.execute()[-1]
+
+        if size > max_entries:
+            evicted = [member for member, _ in redis.zpopmin(LRU_KEY, size - max_entries)]
+            if evicted:
+                redis.delete(*[ENTRY_PREFIX + (m.decode() if isinstance(m, bytes) else m) for m in evicted])
+    except Exception as e:
+        logger.warning(f"Answer cache write failed: {e}")
+
+
+async def send_query(query, token, conversation_id=None, language='fa',
+                     file_attachments=None, enable_web_search=None, priority=None,
+                     new_conversation=False):
+    """
+    core_service.send_query با کش پاسخ برای اولین سوال گفتگوهای جدید
+
+    در صورت hit پاسخ بدون فراخوانی Core برمی‌گردد (cached=True، بدون conversation_id)
+    """
+    if not is_cacheable(new_conversation, file_attachments):
+        return await core_service.send_query(
+            query=query,
+            token=token,
+            conversation_id=conversation_id,
+            language=language,
+            file_attachments=file_attachments,
+            enable_web_search=enable_web_search,
+            priority=priority,
+            coalesce=new_conversation
+        )
+
+    started = time.monotonic()
+    key = make_key(query, language, enable_web_search)
+    # Redis sync است؛ نیازی به thread اصلی (ORM) ندارد
+    cached = await sync_to_async(lookup, thread_sensitive=False)(key)
+    if cached is not None:
+        cached['processing_time_ms'] = int((time.monotonic() - started) * 1000)
+        return cached
+
+    response = await core_service.send_query(
+        query=query,
+        token=token,
+        conversation_id=conversation_id,
+        language=language,
+        enable_web_search=enable_web_search,
+        priority=priority,
+        coalesce=True
+    )
+    await sync_to_async(store, thread_sensitive=False)(key, response)
+    return response
+
+
+def purge():
+    """
+    حذف همه پاسخ‌های کش شده (مثلاً پس از به‌روزرسانی پایگاه دانش Core)
+
+    Returns:
+        int: تعداد ورودی‌های حذف شده
+    """
+    redis = _redis()
+    deleted = 0
+    batch = []
+    for entry_key in redis.scan_iter(match=ENTRY_PREFIX + '*', count=1000):
+        batch.append(entry_key)
+        if len(batch) >= 1000:
+            deleted += redis.delete(*batch)
+            batch = []
+    if batch:
+        deleted += redis.delete(*batch)
+    redis.delete(LRU_KEY)
+    return deleted
+
+
+def stats():
+    """آمار کش: تعداد ورودی‌ها، hit، miss و نرخ hit"""
+    try:
+        redis = _redis()
+        pipe = redis.pipeline()
+        pipe.zcard(LRU_KEY)
+        pipe.get(HITS_KEY)
+        pipe.get(MISSES_KEY)
+        entries, hits, misses = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Answer cache unavailable: {e}")
+        return {'enabled': settings.ANSWER_CACHE_ENABLED, 'available': False}
+
+    hits = int(hits or 0)
+    misses = int(misses or 0)
+    total = hits + misses
+    return {
+        'enabled': settings.ANSWER_CACHE_ENABLED,
+        'available': True,
+        'entries': entries,
+        'max_entries': settings.ANSWER_CACHE_MAX_ENTRIES,
+        'ttl': settings.ANSWER_CACHE_TTL,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0.0,
+    }
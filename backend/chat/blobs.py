@@ -0,0 +1,234 @@
+"""
+ذخیره پیوست‌ها بر اساس محتوا (content addressing)
+
+- هر فایل آپلود شده با SHA-256 شناسایی می‌شود و برای هر کاربر یا سازمان (scope)
+  فقط یک بار در MinIO ذخیره می‌شود (blobs/<scope>/<sha256>)
+- آپلود مستقیم (presigned) پس از تایید از temp_uploads/ به همین کلید منتقل می‌شود
+  (promote_upload)
+- کلاینت می‌تواند قبل از آپلود با hash بپرسد فایل موجود است یا نه (find_blob)؛ این
+  پرسش فقط فایل‌هایی را برمی‌گرداند که همین کاربر قبلاً آپلود کرده است (uploaders)
+- پیوست پیام فقط با کلیدهای همین کاربر/سازمان پذیرفته می‌شود (owns_object_key)
+- ref_count با ایجاد/حذف MessageAttachment به‌روز می‌شود و cleanup_unreferenced
+  فقط فایل‌های بدون ارجاع را پس از مهلت نگهداری حذف می‌کند
+"""
+import logging
+import re
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.storage import s3_service
+from .models import AttachmentBlob
+
+logger = logging.getLogger(__name__)
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# فایل بدون ارجاع (آپلود شده ولی هنوز پیوست نشده) تا این مدت نگه داشته می‌شود
+RETENTION = timedelta(hours=24)
+
+
+def blob_scope(user):
+    """محتوای یکسان بین اعضای یک سازمان مشترک است"""
+    if user.organization_id:
+        return f'orgs/{user.organization_id}'
+    return f'users/{user.id}'
+
+
+def owns_object_key(user, object_key):
+    """کلید در فضای فایل‌های کاربر است (blobs/<scope>/ یا temp_uploads/<user_id>/)"""
+    if '..' in object_key.split('/'):
+        return False
+    return object_key.startswith((
+        f'{s3_service.content_prefix}{blob_scope(user)}/',
+        f'{s3_service.temp_prefix}{user.id}/',
+    ))
+
+
+def blob_payload(blob, filename, content_type, deduplicated):
+    """خروجی آپلود (هم‌شکل با S3Service.upload_file)"""
+    return {
+        'object_key': blob.object_key,
+        'filename': filename,
+        'size_bytes': blob.size_bytes,
+        'content_type': content_type,
+        'expires_at': (blob.last_used_at + RETENTION).replace(tzinfo=None).isoformat(),
+        'bucket_name': s3_service.bucket_name,
+        'sha256': blob.sha256,
+        'deduplicated': deduplicated,
+    }
+
+
+def _touch(blob, user=None):
+    """
+    تمدید مهلت نگهداری فایل موجود
+
+    Returns:
+        False اگر فایل همزمان توسط cleanup_unreferenced حذف شده باشد
+    """
+    blob.last_used_at = timezone.now()
+    if not AttachmentBlob.objects.filter(id=blob.id).update(last_used_at=blob.last_used_at):
+        return False
+    if user is not None:
+        blob.uploaders.add(user)
+    return True
+
+
+def _create_blob(user, scope, sha256, object_key, size_bytes, content_type):
+    """
+    ثبت فایل ذخیره شده
+
+    Returns:
+        (AttachmentBlob، created)؛ created=False اگر همان محتوا همزمان ثبت شده باشد
+    """
+    try:
+        with transaction.atomic():
+            blob = AttachmentBlob.objects.create(
+                scope=scope,
+                sha256=sha256,
+                object_key=object_key,
+                size_bytes=size_bytes,
+                content_type=content_type
+            )
+            blob.uploaders.add(user)
+            return blob, True
+    except IntegrityError:
+        # آپلود همزمان همان محتوا؛ کلید و محتوا یکسان است
+        blob = AttachmentBlob.objects.get(scope=scope, sha256=sha256)
+        _touch(blob, user)
+        return blob, False
+
+
+def find_blob(user, sha256, size_bytes=None):
+    """
+    فایل موجود با همین محتوا که همین کاربر قبلاً آپلود کرده است
+
+    hash و اندازه اثبات داشتن محتوا نیستند؛ فایل سایر اعضای سازمان فقط با آپلود
+    واقعی (store_upload یا promote_upload) به اشتراک گذاشته می‌شود.
+
+    Returns:
+        AttachmentBlob (مهلت نگهداری تمدید می‌شود) یا None
+    """
+    sha256 = (sha256 or '').lower()
+    if not SHA256_PATTERN.match(sha256):
+        return None
+    blob = AttachmentBlob.objects.filter(scope=blob_scope(user), sha256=sha256, uploaders=user).first()
+    if blob is None or (size_bytes is not None and blob.size_bytes != size_bytes):
+        return None
+    if not _touch(blob):
+        return None
+    return blob
+
+
+def store_upload(file, user, callback=None):
+    """
+    ذخیره فایل آپلود شده؛ اگر همین محتوا قبلاً ذخیره شده باشد آپلود انجام نمی‌شود
+
+    Returns:
+        خروجی blob_payload
+    """
+    sha256 = s3_service.content_hash(file)
+    scope = blob_scope(user)
+
+    blob = AttachmentBlob.objects.filter(scope=scope, sha256=sha256).first()
+    # فایلی که همزمان پاکسازی شده دوباره آپلود می‌شود
+    if blob is not None and _touch(blob, user):
+        if callback:
+            callback(file.size)
+        return blob_payload(blob, file.name, file.content_type, deduplicated=True)
+
+    object_key = s3_service.content_object_key(scope, sha256)
+    result = s3_service.upload_stream(
+        fileobj=file,
+        filename=file.name,
+        user_id=str(user.id),
+        content_type=file.content_type,
+        callback=callback,
+        object_key=object_key
+    )
+    blob, _ = _create_blob(user, scope, sha256, object_key, result['size_bytes'], file.content_type)
+    return blob_payload(blob, file.name, file.content_type, deduplicated=False)
+
+
+def promote_upload(object_key, user, sha256, filename, size_bytes, content_type):
+    """
+    انتقال فایل آپلود مستقیم (temp_uploads/) به کلید محتوا
+
+    sha256 در policy آپلود امضا شده و MinIO محتوا را با آن بررسی کرده است
+    (finalize_upload آن را با HEAD تطبیق می‌دهد)؛ محتوای فایل از این سرور عبور
+    نمی‌کند. اگر همین محتوا قبلاً ذخیره شده باشد فقط فایل موقت حذف می‌شود، در
+    غیر این صورت فایل سمت سرور MinIO کپی و سپس فایل موقت حذف می‌شود.
+
+    Returns:
+        خروجی blob_payload
+    """
+    scope = blob_scope(user)
+
+    blob = AttachmentBlob.objects.filter(scope=scope, sha256=sha256).first()
+    if blob is not None and _touch(blob, user):
+        deduplicated = True
+    else:
+        content_key = s3_service.content_object_key(scope, sha256)
+        s3_service.copy_file(object_key, content_key)
+        blob, created = _create_blob(user, scope, sha256, content_key, size_bytes, content_type)
+        deduplicated = not created
+
+    # فایل موقت باقی‌مانده توسط پاکسازی temp_uploads/ حذف می‌شود
+    s3_service.delete_file(object_key)
+    return blob_payload(blob, filename, content_type, deduplicated=deduplicated)
+
+
+def _update_references(object_keys, delta):
+    """تغییر ref_count (کلیدهای غیر blob، مثل فایل‌های موقت قدیمی، نادیده گرفته می‌شوند)"""
+    by_count = {}
+    for key, count in Counter(k for k in object_keys if k.startswith(s3_service.content_prefix)).items():
+        by_count.setdefault(count, []).append(key)
+    now = timezone.now()
+    for count, keys in by_count.items():
+        AttachmentBlob.objects.filter(object_key__in=keys).update(
+            ref_count=F('ref_count') + delta * count,
+            last_used_at=now
+        )
+
+
+def add_references(object_keys):
+    _update_references(object_keys, 1)
+
+
+def release_references(object_keys):
+    _update_references(object_keys, -1)
+
+
+def cleanup_unreferenced(retention=RETENTION, batch_size=1000):
+    """
+    حذف فایل‌های بدون ارجاع قدیمی‌تر از retention از MinIO و دیتابیس
+
+    Returns:
+        تعداد فایل‌های حذف شده
+    """
+    cutoff = timezone.now() - retention
+    deleted = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(
+                AttachmentBlob.objects.select_for_update(skip_locked=True)
+                .filter(id__gt=last_id, ref_count__lte=0, last_used_at__lt=cutoff)
+                .order_by('id')[:batch_size]
+            )
+            if not blobs:
+                break
+            last_id = blobs[-1].id
+
+            # یک delete_objects برای کل دسته
+            removed_keys = set(s3_service.delete_files([blob.object_key for blob in blobs])['deleted'])
+            removed = [blob.id for blob in blobs if blob.object_key in removed_keys]
+            AttachmentBlob.objects.filter(id__in=removed).delete()
+            deleted += len(removed)
+
+    if deleted:
+        logger.info(f"Deleted {deleted} unreferenced attachment blobs")
+    return deleted
@@ -10,27 +10,47 @@ import logging
 
 from .models import Conversation, Message
 from .core_service import core_service
-from accounts.models import AuditLog
-from accounts.tokens import CustomAccessToken
+from .core_admission import CoreOverloadedError
+from . import answer_cache, idempotency
+from .turns import start_turn, finish_turn, log_turn
+from accounts.tokens import get_core_access_token
 
 logger = logging.getLogger('app')
 
 
+class SlowConsumerError(Exception):
+    """کلاینت در مهلت STREAM_ACK_TIMEOUT دریافت frame های streaming را تایید نکرد"""
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     """WebSocket Consumer برای چت real-time"""
     
+    # حالت streaming: تجمیع تکه‌های کوچک در یک frame بر اساس زمان/اندازه
+    STREAM_FLUSH_INTERVAL = 0.05  # seconds
+    STREAM_FLUSH_SIZE = 1024  # characters
+    # حداکثر رویدادهای بافر شده از Core؛ پس از آن خواندن از Core متوقف می‌شود
+    STREAM_QUEUE_SIZE = 64
+    # حداکثر frame های تایید نشده؛ کلاینت streaming باید frame ها را با ack تایید کند
+    # (ack_window اختیاری، پیش‌فرض STREAM_DEFAULT_ACK_WINDOW)
+    STREAM_DEFAULT_ACK_WINDOW = 16
+    STREAM_MAX_ACK_WINDOW = 64
+    STREAM_ACK_TIMEOUT = 30.0  # seconds
+    
     async def connect(self):
         """اتصال WebSocket"""
         self.user = self.scope["user"]
+        self.query_task = None
+        self.background_tasks = set()
+        self.acked_seq = 0
+        self.ack_event = asyncio.Event()
         
         # بررسی احراز هویت
         if not self.user.is_authenticated:
             await self.close(code=4001)
             return
         
-        # دریافت JWT token برای Core API
-        self.jwt_token = await self.get_jwt_token()
-        if not self.jwt_token:
+        # بررسی امکان صدور JWT token برای Core API (توکن کوتاه‌مدت برای هر درخواست تازه‌سازی می‌شود)
+        if not await self.get_jwt_token():
             await self.close(code=4002)
             return
         
@@ -68,6 +88,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         """قطع اتصال WebSocket"""
+        # لغو query در حال اجرا (درخواست Core هم بسته می‌شود)
+        if getattr(self, 'query_task', None) and not self.query_task.done():
+            self.query_task.cancel()
+        
         # خروج از گروه‌ها
         if hasattr(self, 'conversation_group_name'):
             await self.channel_layer.group_discard(
@@ -88,7 +112,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message_type = data.get('type')
             
             if message_type == 'query':
-                await self.handle_query(data)
+                if self.query_task and not self.query_task.done():
+                    await self.send(text_data=json.dumps({
+                        'type': 'error',
+                        'message': 'A query is already in progress',
+                        'code': 'query_in_progress'
+                    }))
+                else:
+                    # اجرا در پس‌زمینه تا پیام‌های cancel/ack در حین پردازش دریافت شوند
+                    self.query_task = asyncio.create_task(self.run_query(data))
+            elif message_type == 'cancel':
+                await self.handle_cancel(data)
+            elif message_type == 'ack':
+                self.handle_ack(data)
             elif message_type == 'typing':
                 await self.handle_typing(data)
             elif message_type == 'feedback':
@@ -112,11 +148,130 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': 'Internal server error'
             }))
     
+    async def run_query(self, data):
+        """اجرای handle_query در پس‌زمینه با مدیریت خطا"""
+        try:
+            if data.get('idempotency_key'):
+                await self.run_idempotent_query(data, str(data['idempotency_key']))
+            else:
+                await self.handle_query(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error in WebSocket query: {str(e)}")
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Internal server error'
+            }))
+    
+    async def run_idempotent_query(self, data, key):
+        """
+        اجرای query با idempotency_key
+        
+        ارسال مجدد همان کلید (مثلاً پس از قطع و وصل شدن اتصال) سوال را دوباره
+        اجرا نمی‌کند و نتیجه قبلی دوباره ارسال می‌شود.
+        """
+        if not idempotency.is_valid_key(key):
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Invalid idempotency_key',
+                'code': 'invalid_idempotency_key'
+            }))
+            return
+        
+        # فضای کلید جدا از API چون قالب نتیجه ذخیره شده متفاوت است
+        scoped_key = f'ws:{key}'
+        request_fingerprint = idempotency.fingerprint(
+            data.get('query', '').strip(),
+            data.get('conversation_id'),
+            bool(data.get('stream'))
+        )
+        try:
+            outcome, record = await idempotency.acquire(self.user.id, scoped_key, request_fingerprint)
+        except idempotency.IdempotencyKeyReused:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'idempotency_key was already used for a different query',
+                'code': 'idempotency_key_reused'
+            }))
+            return
+        
+        if outcome == idempotency.REPLAY:
+            await self.replay_result(record['body'])
+            return
+        if outcome == idempotency.IN_PROGRESS:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'A query with this idempotency_key is still in progress',
+                'code': 'idempotency_in_progress',
+                'retryable': True
+            }))
+            return
+        
+        result = None
+        try:
+            result = await self.handle_query(data)
+        finally:
+            if result is not None:
+                await asyncio.shield(idempotency.finish(self.user.id, scoped_key, request_fingerprint, 200, result))
+            else:
+                await asyncio.shield(idempotency.finish(self.user.id, scoped_key, request_fingerprint))
+    
+    async def replay_result(self, result):
+        """ارسال مجدد نتیجه ذخیره شده یک query (بدون پیام جدید و فراخوانی Core)"""
+        await self.send(text_data=json.dumps({
+            'type': 'message_received',
+            'message_id': result['user_message_id'],
+            'conversation_id': result['conversation_id'],
+            'replayed': True
+        }))
+        await self.send(text_data=json.dumps({
+            'type': 'message',
+            'content': result['content'],
+            'message_id': result['message_id']
+        }))
+        if result['sources']:
+            await self.send(text_data=json.dumps({
+                'type': 'sources',
+                'sources': result['sources'],
+                'message_id': result['message_id']
+            }, default=str))
+        await self.send(text_data=json.dumps({
+            'type': 'processing_completed',
+            'message_id': result['message_id'],
+            'metadata': result['metadata'],
+            'replayed': True
+        }, default=str))
+    
+    async def handle_cancel(self, data):
+        """لغو query در حال اجرا"""
+        if self.query_task and not self.query_task.done():
+            self.query_task.cancel()
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'No query in progress',
+                'code': 'no_active_query'
+            }))
+    
+    def handle_ack(self, data):
+        """ثبت تایید دریافت frame ها توسط کلاینت (برای backpressure)"""
+        try:
+            seq = int(data.get('seq', 0))
+        except (TypeError, ValueError):
+            return
+        if seq > self.acked_seq:
+            self.acked_seq = seq
+            self.ack_event.set()
+    
     async def handle_query(self, data):
-        """پردازش سوال کاربر"""
+        """
+        پردازش سوال کاربر
+        
+        Returns:
+            dict نتیجه (برای idempotency) در صورت موفقیت، در غیر این صورت None
+        """
         query = data.get('query', '').strip()
-        conversation_id = data.get('conversation_id')
-        response_mode = data.get('response_mode', 'simple_explanation')
         
         if not query:
             await self.send(text_data=json.dumps({
@@ -125,16 +280,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             }))
             return
         
-        # دریافت یا ایجاد conversation
-        conversation = await self.get_or_create_conversation(conversation_id)
-        
-        # ایجاد پیام کاربر
-        user_message = await self.create_message(
-            conversation=conversation,
-            role='user',
-            content=query,
-            response_mode=response_mode
-        )
+        # ایجاد conversation (در صورت نیاز)، پیام کاربر و پیام assistant در یک transaction
+        turn = await self.begin_turn(query, data)
+        conversation = turn['conversation']
+        user_message = turn['user_message']
+        assistant_message = turn['assistant_message']
+        meta = {
+            'action': 'chat_query_ws',
+            'query_length': len(query),
+            'ip_address': self.scope.get('client', ['', ''])[0],
+            'user_agent': dict(self.scope.get('headers', {})).get(b'user-agent', b'').decode(),
+        }
         
         # ارسال تایید دریافت پیام
         await self.send(text_data=json.dumps({
@@ -143,14 +299,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'conversation_id': str(conversation.id)
         }))
         
-        # ایجاد پیام assistant
-        assistant_message = await self.create_message(
-            conversation=conversation,
-            role='assistant',
-            content='',
-            status='processing'
-        )
-        
         # ارسال شروع پردازش
         await self.send(text_data=json.dumps({
             'type': 'processing_started',
@@ -158,23 +306,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
         
         try:
-            # دریافت تنظیم enable_web_search از preferences کاربر
-            enable_web_search = None
-            if self.user.preferences:
-                enable_web_search = self.user.preferences.get('enable_web_search')
+            # صف اولویت Core بر اساس پلن کاربر (موقعیت صف به کلاینت ارسال می‌شود)
+            priority = self.get_priority(turn['priority'], str(assistant_message.id))
             
-            # ارسال به Core RAG (non-streaming)
-            response = await core_service.send_query(
+            if data.get('stream'):
+                result = await self.stream_query(
+                    data,
+                    query,
+                    turn,
+                    meta,
+                    priority
+                )
+                return {
+                    'conversation_id': str(conversation.id),
+                    'user_message_id': str(user_message.id),
+                    'message_id': str(assistant_message.id),
+                    **result
+                }
+            
+            # ارسال به Core RAG (non-streaming؛ اولین سوال گفتگوی جدید از کش پاسخ)
+            response = await answer_cache.send_query(
                 query=query,
-                token=self.jwt_token,
+                token=turn['token'],
                 conversation_id=conversation.rag_conversation_id,
                 language='fa',
-                enable_web_search=enable_web_search
+                enable_web_search=turn['enable_web_search'],
+                priority=priority,
+                new_conversation=turn['new_conversation']
             )
             
             full_content = response.get('answer', response.get('response', ''))
             sources = response.get('sources', [])
-            metadata = response.get('metadata', {})
+            metadata = dict(response.get('metadata') or {})
+            if response.get('cached'):
+                metadata['cached'] = True
             
             # ارسال پاسخ کامل به کاربر
             await self.send(text_data=json.dumps({
@@ -190,14 +355,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'message_id': str(assistant_message.id)
                 }))
             
-            # به‌روزرسانی پیام assistant
-            await self.update_assistant_message(
-                assistant_message,
-                full_content,
-                sources,
-                [],  # chunks - Core API returns sources directly
-                metadata
-            )
+            # ذخیره پاسخ، rag_conversation_id و آمار conversation در یک transaction
+            await database_sync_to_async(finish_turn)(turn, response, meta, full_content, audit=False)
             
             # ارسال پایان پردازش
             await self.send(text_data=json.dumps({
@@ -205,24 +364,63 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message_id': str(assistant_message.id),
                 'metadata': metadata
             }))
+            self.log_turn_later(turn, meta)
             
-            # به‌روزرسانی conversation
-            if not conversation.rag_conversation_id and metadata.get('conversation_id'):
-                await self.update_conversation_rag_id(
-                    conversation,
-                    metadata['conversation_id']
-                )
+            return {
+                'conversation_id': str(conversation.id),
+                'user_message_id': str(user_message.id),
+                'message_id': str(assistant_message.id),
+                'content': full_content,
+                'sources': sources,
+                'metadata': metadata
+            }
             
-            # ثبت در audit log
-            await self.create_audit_log(
-                action='chat_query_ws',
-                details={
-                    'conversation_id': str(conversation.id),
-                    'query_length': len(query),
-                    'tokens_used': metadata.get('total_tokens', 0)
-                }
+        except asyncio.CancelledError:
+            await self.update_message_status(
+                assistant_message,
+                'failed',
+                'cancelled'
+            )
+            try:
+                await self.send(text_data=json.dumps({
+                    'type': 'cancelled',
+                    'message_id': str(assistant_message.id)
+                }))
+            except Exception:
+                pass  # اتصال ممکن است بسته شده باشد
+            raise
+        except CoreOverloadedError as e:
+            logger.warning(f"Query rejected by Core admission control: {e.reason}")
+            await self.update_message_status(
+                assistant_message,
+                'failed',
+                str(e)
+            )
+            
+            # خطای قابل تلاش مجدد (Core مشغول یا در دسترس نیست)
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'سرور پردازش در حال حاضر مشغول است. لطفاً چند لحظه دیگر دوباره تلاش کنید.',
+                'code': 'core_overloaded',
+                'retryable': True,
+                'retry_after': e.retry_after,
+                'message_id': str(assistant_message.id)
+            }))
+        except SlowConsumerError as e:
+            logger.warning(f"Stream aborted for slow consumer: {e}")
+            await self.update_message_status(
+                assistant_message,
+                'failed',
+                str(e)
             )
             
+            # درخواست Core بسته شده است؛ کلاینت می‌تواند پاسخ ذخیره شده را دریافت کند
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'دریافت پاسخ توسط کلاینت تایید نشد',
+                'code': 'slow_consumer',
+                'message_id': str(assistant_message.id)
+            }))
         except Exception as e:
             logger.error(f"Error in query processing: {str(e)}")
             
@@ -241,6 +439,159 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message_id': str(assistant_message.id)
             }))
     
+    async def stream_query(self, data, query, turn, meta, priority=None):
+        """
+        ارسال تدریجی پاسخ Core به صورت frame های chunk.
+        
+        تکه‌های کوچک بر اساس STREAM_FLUSH_INTERVAL/STREAM_FLUSH_SIZE تجمیع می‌شوند.
+        رویدادهای Core در صفی محدود نگه داشته می‌شوند. کلاینت هر frame را با
+        {'type': 'ack', 'seq': n} تایید می‌کند؛ با بیش از ack_window frame تایید نشده
+        ارسال و در نتیجه خواندن از Core متوقف می‌شود (backpressure). self.send()
+        منتظر خالی شدن بافر daphne نمی‌ماند؛ سرعت دریافت کلاینت فقط با ack مشخص می‌شود.
+        
+        Raises:
+            SlowConsumerError: تاییدی در مهلت STREAM_ACK_TIMEOUT دریافت نشد
+        
+        Returns:
+            dict شامل content، sources و metadata پاسخ نهایی
+        """
+        loop = asyncio.get_running_loop()
+        conversation = turn['conversation']
+        assistant_message = turn['assistant_message']
+        message_id = str(assistant_message.id)
+        
+        try:
+            ack_window = int(data.get('ack_window') or self.STREAM_DEFAULT_ACK_WINDOW)
+        except (TypeError, ValueError):
+            ack_window = self.STREAM_DEFAULT_ACK_WINDOW
+        ack_window = min(max(ack_window, 1), self.STREAM_MAX_ACK_WINDOW)
+        self.acked_seq = 0
+        self.ack_event.clear()
+        
+        parts = []
+        pending = []
+        pending_size = 0
+        flush_deadline = None
+        seq = 0
+        final = {}
+        
+        async def flush():
+            nonlocal pending, pending_size, flush_deadline, seq
+            if not pending:
+                return
+            seq += 1
+            while seq - self.acked_seq > ack_window:
+                self.ack_event.clear()
+                try:
+                    await asyncio.wait_for(self.ack_event.wait(), self.STREAM_ACK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise SlowConsumerError(
+                        f"No ack for {seq - 1 - self.acked_seq} frames in {self.STREAM_ACK_TIMEOUT}s"
+                    ) from None
+            await self.send(text_data=json.dumps({
+                'type': 'chunk',
+                'content': ''.join(pending),
+                'message_id': message_id,
+                'seq': seq
+            }))
+            pending = []
+            pending_size = 0
+            flush_deadline = None
+        
+        stream = core_service.stream_query(
+            query=query,
+            token=turn['token'],
+            conversation_id=conversation.rag_conversation_id,
+            language='fa',
+            enable_web_search=turn['enable_web_search'],
+            priority=priority
+        )
+        queue = asyncio.Queue(maxsize=self.STREAM_QUEUE_SIZE)
+        
+        async def pump():
+            try:
+                async for event in stream:
+                    await queue.put(('event', event))
+                await queue.put(('end', None))
+            except Exception as e:
+                await queue.put(('end', e))
+        
+        pump_task = asyncio.create_task(pump())
+        try:
+            while True:
+                timeout = None
+                if flush_deadline is not None:
+                    timeout = max(0.0, flush_deadline - loop.time())
+                try:
+                    kind, payload = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    await flush()
+                    continue
+                
+                if kind == 'end':
+                    await flush()
+                    if payload is not None:
+                        raise payload
+                    break
+                
+                event = payload
+                if event['type'] == 'chunk':
+                    if not event['content']:
+                        continue
+                    parts.append(event['content'])
+                    pending.append(event['content'])
+                    pending_size += len(event['content'])
+                    if flush_deadline is None:
+                        flush_deadline = loop.time() + self.STREAM_FLUSH_INTERVAL
+                    if pending_size >= self.STREAM_FLUSH_SIZE:
+                        await flush()
+                elif event['type'] == 'done':
+                    final = event['data']
+                elif event['type'] == 'error':
+                    raise Exception(event['message'] or 'Core stream error')
+                else:
+                    await flush()
+                    await self.send(text_data=json.dumps({
+                        'type': event['type'],
+                        **event.get('data', {}),
+                        'message_id': message_id
+                    }))
+        except BaseException:
+            if parts:
+                assistant_message.content = ''.join(parts)
+            raise
+        finally:
+            pump_task.cancel()
+            await asyncio.gather(pump_task, return_exceptions=True)
+            await stream.aclose()
+        
+        full_content = ''.join(parts) or final.get('answer', '')
+        sources = final.get('sources', [])
+        metadata = dict(final.get('metadata') or {})
+        metadata.setdefault('conversation_id', final.get('conversation_id'))
+        metadata.setdefault('message_id', final.get('message_id', ''))
+        metadata.setdefault('total_tokens', final.get('tokens_used', 0))
+        metadata.setdefault('processing_time_ms', final.get('processing_time_ms', 0))
+        
+        if sources:
+            await self.send(text_data=json.dumps({
+                'type': 'sources',
+                'sources': sources,
+                'message_id': message_id
+            }))
+        
+        meta = {**meta, 'details': {'stream': True}}
+        await database_sync_to_async(finish_turn)(turn, final, meta, full_content, audit=False)
+        
+        await self.send(text_data=json.dumps({
+            'type': 'processing_completed',
+            'message_id': message_id,
+            'metadata': metadata
+        }, default=str))
+        self.log_turn_later(turn, meta)
+        
+        return {'content': full_content, 'sources': sources, 'metadata': metadata}
+    
     async def handle_typing(self, data):
         """مدیریت وضعیت تایپ کردن"""
         is_typing = data.get('is_typing', False)
@@ -272,23 +623,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
         
         # به‌روزرسانی پیام
-        success = await self.update_message_feedback(
+        message = await self.update_message_feedback(
             message_id,
             rating,
             feedback_type,
             feedback_text
         )
+        success = message is not None
         
         # ارسال به Core API
-        if success:
-            message = await self.get_message(message_id)
-            if message and message.rag_message_id:
-                await core_service.submit_feedback(
-                    message_id=message.rag_message_id,
-                    rating=rating if rating else 3,
-                    token=self.jwt_token,
-                    feedback_text=feedback_text
-                )
+        if success and message.rag_message_id:
+            await core_service.submit_feedback(
+                message_id=message.rag_message_id,
+                rating=rating if rating else 3,
+                token=await self.get_jwt_token(),
+                feedback_text=feedback_text
+            )
         
         await self.send(text_data=json.dumps({
             'type': 'feedback_received',
@@ -311,125 +661,95 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """ارسال پیام چت به کاربر"""
         await self.send(text_data=json.dumps(event['message']))
     
-    # Database helper methods
-    @database_sync_to_async
-    def check_conversation_access(self):
-        """بررسی دسترسی کاربر به conversation"""
-        try:
-            conversation = Conversation.objects.get(
-                id=self.conversation_id,
-                user=self.user
-            )
-            return True
-        except Conversation.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def get_or_create_conversation(self, conversation_id):
-        """دریافت یا ایجاد conversation"""
-        if conversation_id:
+    def log_turn_later(self, turn, meta):
+        """ثبت audit log پس از ارسال پاسخ، خارج از مسیر query (قطع اتصال آن را لغو نمی‌کند)"""
+        
+        async def log():
             try:
-                return Conversation.objects.get(
-                    id=conversation_id,
-                    user=self.user
-                )
-            except Conversation.DoesNotExist:
-                pass
-        
-        # ایجاد conversation جدید
-        return Conversation.objects.create(
-            user=self.user,
-            organization=self.user.organization,
-            title='گفتگوی جدید',
-            default_response_mode='simple_explanation'
-        )
+                await database_sync_to_async(log_turn)(turn, meta)
+            except Exception as e:
+                logger.error(f"Error dispatching audit log: {str(e)}")
+        
+        task = asyncio.create_task(log())
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
     
-    @database_sync_to_async
-    def create_message(self, conversation, role, content, response_mode=None, status='completed'):
-        """ایجاد پیام جدید"""
-        return Message.objects.create(
-            conversation=conversation,
-            role=role,
-            content=content,
-            response_mode=response_mode,
-            status=status
-        )
+    # Database helper methods (ORM async؛ عملیات چند مرحله‌ای در یک transaction و یک فراخوانی sync)
+    async def check_conversation_access(self):
+        """بررسی دسترسی کاربر به conversation"""
+        return await Conversation.objects.filter(
+            id=self.conversation_id,
+            user=self.user
+        ).aexists()
     
     @database_sync_to_async
-    def update_assistant_message(self, message, content, sources, chunks, metadata):
-        """به‌روزرسانی پیام assistant"""
-        message.content = content
-        message.sources = sources
-        message.chunks = chunks
-        message.status = 'completed'
-        message.tokens = metadata.get('total_tokens', 0)
-        message.processing_time_ms = metadata.get('processing_time_ms', 0)
-        message.model_used = metadata.get('model_used', '')
-        message.cached = metadata.get('cached', False)
-        message.rag_message_id = metadata.get('message_id', '')
-        message.save()
-        return message
+    def begin_turn(self, query, data):
+        """ایجاد conversation (در صورت نیاز)، پیام کاربر و پیام assistant در حالت processing"""
+        turn_data = {
+            'query': query,
+            'conversation_id': data.get('conversation_id'),
+            'response_mode': data.get('response_mode', 'simple_explanation'),
+        }
+        turn = start_turn(self.user, turn_data)
+        if turn is None:
+            # conversation یافت نشد: گفتگوی جدید ایجاد می‌شود
+            turn_data['conversation_id'] = None
+            turn = start_turn(self.user, turn_data)
+        return turn
     
-    @database_sync_to_async
-    def update_message_status(self, message, status, error_message=''):
-        """به‌روزرسانی وضعیت پیام"""
+    async def update_message_status(self, message, status, error_message=''):
+        """به‌روزرسانی وضعیت پیام (همراه با محتوای دریافت شده تا این لحظه)"""
         message.status = status
         message.error_message = error_message
-        message.save()
-    
-    @database_sync_to_async
-    def update_message_feedback(self, message_id, rating, feedback_type, feedback_text):
-        """به‌روزرسانی بازخورد پیام"""
-        try:
-            message = Message.objects.get(
-                id=message_id,
-                conversation__user=self.user
-            )
-            if rating:
-                message.rating = rating
-            if feedback_type:
-                message.feedback_type = feedback_type
-            if feedback_text:
-                message.feedback_text = feedback_text
-            message.save()
-            return True
-        except Message.DoesNotExist:
-            return False
+        await Message.objects.filter(id=message.id).aupdate(
+            status=status,
+            error_message=error_message,
+            content=message.content,
+            updated_at=timezone.now()
+        )
     
-    @database_sync_to_async
-    def get_message(self, message_id):
-        """دریافت پیام"""
-        try:
-            return Message.objects.get(
-                id=message_id,
-                conversation__user=self.user
-            )
-        except Message.DoesNotExist:
+    async def update_message_feedback(self, message_id, rating, feedback_type, feedback_text):
+        """
+        به‌روزرسانی بازخورد پیام
+        
+        Returns:
+            پیام (فقط id و rag_message_id) یا None اگر پیام متعلق به کاربر نباشد
+        """
+        message = await Message.objects.filter(
+            id=message_id,
+            conversation__user=self.user,
+            conversation__deleted_at__isnull=True
+        ).only('id', 'rag_message_id').afirst()
+        if message is None:
             return None
+        
+        updates = {'updated_at': timezone.now()}
+        if rating:
+            updates['rating'] = rating
+        if feedback_type:
+            updates['feedback_type'] = feedback_type
+        if feedback_text:
+            updates['feedback_text'] = feedback_text
+        await Message.objects.filter(id=message.id).aupdate(**updates)
+        return message
     
-    @database_sync_to_async
-    def update_conversation_rag_id(self, conversation, rag_conversation_id):
-        """به‌روزرسانی RAG conversation ID"""
-        conversation.rag_conversation_id = rag_conversation_id
-        conversation.save()
-    
-    @database_sync_to_async
-    def create_audit_log(self, action, details):
-        """ایجاد audit log"""
-        AuditLog.objects.create(
-            user=self.user,
-            action=action,
-            details=details,
-            ip_address=self.scope.get('client', ['', ''])[0],
-            user_agent=dict(self.scope.get('headers', {})).get(b'user-agent', b'').decode()
-        )
+    def get_priority(self, priority, message_id):
+        """پارامترهای صف اولویت Core (از start_turn) با ارسال موقعیت صف به کلاینت"""
+        
+        async def on_position(position):
+            await self.send(text_data=json.dumps({
+                'type': 'queue_position',
+                'position': position,
+                'message_id': message_id
+            }))
+        
+        return {**priority, 'on_position': on_position}
     
     @database_sync_to_async
     def get_jwt_token(self):
-        """دریافت JWT token برای کاربر"""
+        """دریافت JWT token کوتاه‌مدت (کش شده) برای کاربر"""
         try:
-            token = CustomAccessToken.for_user(self.user)
-            return str(token)
+            return get_core_access_token(self.user)
         except Exception as e:
             logger.error(f"Error generating JWT token: {str(e)}")
             return None
@@ -0,0 +1,284 @@
+"""
+کنترل پذیرش درخواست‌ها به RAG Core
+- محدودیت تعداد درخواست‌های همزمان که با تأخیر مشاهده شده تطبیق می‌یابد (AIMD)
+- circuit breaker: پس از خطاهای پیاپی درخواست‌ها فوراً رد می‌شوند و پس از
+  cooldown با health_check (half-open) وضعیت Core بررسی می‌شود
+
+وضعیت در سطح process است (هر worker daphne محدودیت خود را دارد).
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CoreOverloadedError(Exception):
+    """
+    درخواست به دلیل اشباع یا در دسترس نبودن Core پذیرفته نشد (قابل تلاش مجدد)
+    """
+
+    def __init__(self, reason, retry_after):
+        self.reason = reason  # 'queue_full' | 'queue_timeout' | 'circuit_open'
+        self.retry_after = retry_after
+        super().__init__(f"RAG Core is overloaded ({reason}), retry after {retry_after}s")
+
+
+class _Permit:
+    """
+    مجوز یک درخواست؛ فقط زمان رسیدن اولین بایت پاسخ streaming ملاک تأخیر است
+
+    زمان پاسخ کامل (non-streaming) به طول پاسخ وابسته است و تا RAG_CORE_TIMEOUT
+    طول می‌کشد؛ برای تشخیص اشباع Core معیار مناسبی نیست.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_byte = None
+
+    def mark_first_byte(self):
+        if self.first_byte is None:
+            self.first_byte = time.monotonic()
+
+    @property
+    def latency(self):
+        """تأخیر تا اولین بایت؛ None اگر اندازه‌گیری نشده باشد (درخواست non-streaming)"""
+        if self.first_byte is None:
+            return None
+        return self.first_byte - self.started
+
+
+class CoreAdmissionController:
+    """
+    محدودکننده تطبیقی + circuit breaker برای فراخوانی‌های Core
+
+    - موفقیت با تأخیر کمتر از هدف: limit += 1/limit (افزایش جمعی)
+    - timeout، خطای 5xx/اتصال یا تأخیر بیش از هدف: limit *= backoff (کاهش ضربی)
+    - تأخیر فقط برای streaming (زمان اولین بایت) اندازه‌گیری می‌شود؛ موفقیت
+      non-streaming فقط افزایش جمعی دارد
+    - صف انتظار محدود؛ در صورت پر بودن صف یا طولانی شدن انتظار CoreOverloadedError
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, health_check=None):
+        self.min_limit = settings.RAG_CORE_MIN_CONCURRENCY
+        self.max_limit = settings.RAG_CORE_MAX_CONCURRENCY
+        self.latency_target = float(settings.RAG_CORE_LATENCY_TARGET)
+        self.backoff = float(settings.RAG_CORE_LIMIT_BACKOFF)
+        self.max_queue = settings.RAG_CORE_MAX_QUEUE
+        self.queue_timeout = float(settings.RAG_CORE_QUEUE_TIMEOUT)
+        self.failure_threshold = settings.RAG_CORE_BREAKER_FAILURES
+        self.cooldown = float(settings.RAG_CORE_BREAKER_COOLDOWN)
+        self.health_check = health_check
+
+        self._lock = threading.Lock()
+        self._limit = float(settings.RAG_CORE_INITIAL_CONCURRENCY)
+        self._in_flight = 0
+        self._waiters = deque()  # (loop, future)
+        self._last_decrease = 0.0
+        self._latency_ewma = None
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_task = None
+
+        self._counters = {'admitted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0}
+
+    # ==================== Admission ====================
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        گرفتن یک slot برای فراخوانی Core
+
+        Usage:
+            async with admission.admit() as permit:
+                ...
+
+        Raises:
+            CoreOverloadedError: circuit باز است یا صف پر/منقضی شد
+        """
+        await self._check_breaker()
+        await self._acquire()
+        permit = _Permit()
+        try:
+            yield permit
+        except Exception as e:
+            self._release()
+            if self._is_core_failure(e):
+                self._on_failure()
+            else:
+                self._on_success(permit.latency)
+            raise
+        except BaseException:
+            # لغو توسط کلاینت (CancelledError / بستن generator) نشانه سلامت Core نیست
+            self._release()
+            raise
+        else:
+            self._release()
+            self._on_success(permit.latency)
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < int(self._limit) and not self._waiters:
+                self._in_flight += 1
+                self._counters['admitted'] += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                self._counters['rejected'] += 1
+                raise CoreOverloadedError('queue_full', self._retry_after())
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    granted = False
+                except ValueError:
+                    # slot همزمان با timeout واگذار شده است
+                    granted = True
+            if granted:
+                self._release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise CoreOverloadedError('queue_timeout', self._retry_after())
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._grant_waiters()
+
+    def _grant_waiters(self):
+        """واگذاری slot های آزاد به منتظرها (با lock فراخوانی می‌شود)"""
+        while self._waiters and self._in_flight < int(self._limit):
+            loop, future = self._waiters.popleft()
+            self._in_flight += 1
+            self._counters['admitted'] += 1
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _retry_after(self):
+        if self._state == self.OPEN:
+            return max(1, int(self.cooldown - (time.monotonic() - self._opened_at)))
+        return max(1, int(self._latency_ewma or 1))
+
+    # ==================== Limit adaptation ====================
+
+    @staticmethod
+    def _is_core_failure(exc):
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500
+        return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+    def _on_success(self, latency):
+        with self._lock:
+            self._counters['succeeded'] += 1
+            self._consecutive_failures = 0
+            if latency is not None:
+                self._latency_ewma = latency if self._latency_ewma is None else (
+                    0.8 * self._latency_ewma + 0.2 * latency
+                )
+            if latency is not None and latency > self.latency_target:
+                self._decrease()
+            else:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._grant_waiters()
+
+    def _on_failure(self):
+        with self._lock:
+            self._counters['failed'] += 1
+            self._consecutive_failures += 1
+            self._decrease()
+            if self._state == self.CLOSED and self._consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def _decrease(self):
+        # حداکثر یک کاهش در هر بازه تأخیر هدف (پاسخ‌های همزمان یک رویداد را چندبار حساب نکنند)
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+
+    # ==================== Circuit breaker ====================
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        logger.warning(
+            f"RAG Core circuit opened after {self._consecutive_failures} consecutive failures"
+        )
+
+    async def _check_breaker(self):
+        if self._state == self.CLOSED:
+            return
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._start_probe()
+        with self._lock:
+            self._counters['rejected'] += 1
+        raise CoreOverloadedError('circuit_open', self._retry_after())
+
+    def _start_probe(self):
+        """بررسی half-open با health_check در پس‌زمینه؛ درخواست‌ها تا نتیجه رد می‌شوند"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return
+            self._state = self.HALF_OPEN
+        self._probe_task = asyncio.ensure_future(self._probe())
+
+    async def _probe(self):
+        healthy = False
+        try:
+            if self.health_check is not None:
+                result = await self.health_check()
+                healthy = result.get('status') == 'connected'
+        except Exception as e:
+            logger.warning(f"RAG Core half-open probe failed: {e}")
+
+        with self._lock:
+            if healthy:
+                self._state = self.CLOSED
+                self._consecutive_failures = 0
+                self._limit = float(self.min_limit)
+                logger.info("RAG Core circuit closed (health check passed)")
+            else:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    # ==================== Metrics ====================
+
+    def stats(self):
+        """آمار محدودکننده و circuit breaker"""
+        with self._lock:
+            return {
+                'state': self._state,
+                'limit': int(self._limit),
+                'in_flight': self._in_flight,
+                'queued': len(self._waiters),
+                'max_queue': self.max_queue,
+                'consecutive_failures': self._consecutive_failures,
+                'latency_ewma_s': round(self._latency_ewma, 3) if self._latency_ewma is not None else None,
+                'latency_target_s': self.latency_target,
+                **self._counters,
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
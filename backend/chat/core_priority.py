@@ -0,0 +1,336 @@
+"""
+صف اولویت‌دار پذیرش درخواست‌ها به RAG Core بر اساس پلن اشتراک
+هماهنگی بین همه process ها/replica های daphne از طریق Redis انجام می‌شود.
+
+- سهم‌بندی وزنی منصفانه بین tier ها (stride scheduling)
+- سقف تعداد درخواست همزمان برای هر کاربر
+- موقعیت تقریبی در صف برای نمایش به کاربر
+
+ساختار در Redis (پیشوند core_pq:):
+- inflight           sorted set: ticket -> زمان انقضای lease (برای بازیابی process های از کار افتاده)؛
+                     زمان از TIME خود Redis است و lease تا آزاد شدن slot مرتب تمدید می‌شود
+- lease_user         hash: ticket -> user
+- user_inflight      hash: user -> تعداد درخواست در حال اجرا
+- queue:<tier>       sorted set: ticket -> ترتیب ورود
+- ticket:<ticket>    heartbeat منتظر (TTL)؛ ticket بدون heartbeat از صف حذف می‌شود
+- pass               hash: tier -> pass (stride scheduling)
+"""
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+
+from .core_admission import CoreOverloadedError
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'core_pq:'
+
+# خروجی: {1, 0} در صورت پذیرش، {0, position} در غیر این صورت
+_ADMIT_SCRIPT = """
+local p = KEYS[1]
+local ticket, user, tier = ARGV[1], ARGV[2], ARGV[3]
+local limit = tonumber(ARGV[4])
+local user_cap = tonumber(ARGV[5])
+local lease_ttl = tonumber(ARGV[6])
+local hb_ttl = tonumber(ARGV[7])
+local scan = tonumber(ARGV[8])
+
+-- ساعت Redis (مستقل از اختلاف ساعت replica ها)
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local tiers, weights = {}, {}
+for i = 9, #ARGV, 2 do
+    tiers[#tiers + 1] = ARGV[i]
+    weights[ARGV[i]] = tonumber(ARGV[i + 1])
+end
+
+-- lease های منقضی شده (process از کار افتاده)
+for _, t in ipairs(redis.call('ZRANGEBYSCORE', p .. 'inflight', '-inf', now)) do
+    local u = redis.call('HGET', p .. 'lease_user', t)
+    if u then
+        redis.call('HINCRBY', p .. 'user_inflight', u, -1)
+        redis.call('HDEL', p .. 'lease_user', t)
+    end
+    redis.call('ZREM', p .. 'inflight', t)
+end
+
+redis.call('SET', p .. 'ticket:' .. ticket, user, 'EX', hb_ttl)
+local own_queue = p .. 'queue:' .. tier
+if not redis.call('ZSCORE', own_queue, ticket) then
+    redis.call('ZADD', own_queue, redis.call('INCR', p .. 'seq'), ticket)
+end
+
+-- کاندیداهای واجد شرایط هر tier (منتظر زنده و کاربر زیر سقف)
+local user_used = {}
+local function used(u)
+    if user_used[u] == nil then
+        user_used[u] = tonumber(redis.call('HGET', p .. 'user_inflight', u) or '0')
+    end
+    return user_used[u]
+end
+
+local candidates, pass = {}, {}
+local vtime = tonumber(redis.call('HGET', p .. 'pass', '_vtime') or '0')
+for _, t in ipairs(tiers) do
+    local list = {}
+    for _, c in ipairs(redis.call('ZRANGE', p .. 'queue:' .. t, 0, scan - 1)) do
+        local u = redis.call('GET', p .. 'ticket:' .. c)
+        if not u then
+            redis.call('ZREM', p .. 'queue:' .. t, c)
+        else
+            list[#list + 1] = {c, u}
+        end
+    end
+    candidates[t] = list
+    pass[t] = math.max(tonumber(redis.call('HGET', p .. 'pass', t) or '0'), vtime)
+end
+
+-- شبیه‌سازی واگذاری slot های آزاد به ترتیب stride
+local free = limit - redis.call('ZCARD', p .. 'inflight')
+local index = {}
+for _, t in ipairs(tiers) do index[t] = 1 end
+while free > 0 do
+    local best, best_pass, best_item = nil, nil, nil
+    for _, t in ipairs(tiers) do
+        local list = candidates[t]
+        while index[t] <= #list and used(list[index[t]][2]) >= user_cap do
+            index[t] = index[t] + 1
+        end
+        if index[t] <= #list and (best == nil or pass[t] < best_pass) then
+            best, best_pass, best_item = t, pass[t], list[index[t]]
+        end
+    end
+    if best == nil then break end
+
+    index[best] = index[best] + 1
+    user_used[best_item[2]] = used(best_item[2]) + 1
+    pass[best] = best_pass + 1 / weights[best]
+    free = free - 1
+
+    if best_item[1] == ticket then
+        redis.call('ZREM', own_queue, ticket)
+        redis.call('DEL', p .. 'ticket:' .. ticket)
+        redis.call('ZADD', p .. 'inflight', now + lease_ttl, ticket)
+        redis.call('HSET', p .. 'lease_user', ticket, user)
+        redis.call('HINCRBY', p .. 'user_inflight', user, 1)
+        redis.call('HSET', p .. 'pass', tier, pass[best])
+        redis.call('HSET', p .. 'pass', '_vtime', best_pass)
+        return {1, 0}
+    end
+end
+
+-- موقعیت تقریبی: جایگاه در tier خود + سهم وزنی tier های دیگر تا آن زمان
+local rank = (redis.call('ZRANK', own_queue, ticket) or 0) + 1
+local position = rank
+for _, t in ipairs(tiers) do
+    if t ~= tier then
+        local share = math.floor(rank * weights[t] / weights[tier])
+        position = position + math.min(redis.call('ZCARD', p .. 'queue:' .. t), share)
+    end
+end
+return {0, position}
+"""
+
+_RELEASE_SCRIPT = """
+local p = KEYS[1]
+local ticket = ARGV[1]
+if redis.call('ZREM', p .. 'inflight', ticket) == 1 then
+    local u = redis.call('HGET', p .. 'lease_user', ticket)
+    if u then
+        redis.call('HINCRBY', p .. 'user_inflight', u, -1)
+        redis.call('HDEL', p .. 'lease_user', ticket)
+    end
+end
+return 1
+"""
+
+# تمدید lease؛ 0 اگر lease دیگر وجود ندارد (منقضی و بازیابی شده)
+_RENEW_SCRIPT = """
+local p = KEYS[1]
+local ticket = ARGV[1]
+local lease_ttl = tonumber(ARGV[2])
+if not redis.call('ZSCORE', p .. 'inflight', ticket) then
+    return 0
+end
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('ZADD', p .. 'inflight', 'XX', now + lease_ttl, ticket)
+return 1
+"""
+
+_ABANDON_SCRIPT = """
+local p = KEYS[1]
+local ticket, tier = ARGV[1], ARGV[2]
+redis.call('ZREM', p .. 'queue:' .. tier, ticket)
+redis.call('DEL', p .. 'ticket:' .. ticket)
+return 1
+"""
+
+
+def resolve_tier(subscription):
+    """
+    تعیین tier اولویت از روی اشتراک فعال
+
+    - features['priority_tier'] در پلن (در صورت تعریف) اولویت دارد
+    - پلن‌های حقوقی (business) -> enterprise
+    - پلن‌های پولی -> premium
+    - پلن رایگان یا بدون اشتراک -> free
+    """
+    if subscription is None:
+        return 'free'
+    plan = subscription.plan
+    tier = (plan.features or {}).get('priority_tier')
+    if tier in settings.RAG_CORE_TIER_WEIGHTS:
+        return tier
+    if plan.plan_type == 'business':
+        return 'enterprise'
+    if plan.price and plan.price > 0:
+        return 'premium'
+    return 'free'
+
+
+class CorePriorityQueue:
+    """
+    دروازه اولویت‌دار سراسری (بین همه replica ها) قبل از فراخوانی Core
+
+    Usage:
+        async with priority.slot(user_id, tier, on_position):
+            ...
+    """
+
+    def __init__(self, get_redis):
+        self.get_redis = get_redis
+        self.enabled = settings.RAG_CORE_PRIORITY_ENABLED
+        self.global_limit = settings.RAG_CORE_GLOBAL_CONCURRENCY
+        self.weights = settings.RAG_CORE_TIER_WEIGHTS
+        self.user_cap = settings.RAG_CORE_USER_MAX_IN_FLIGHT
+        self.queue_timeout = float(settings.RAG_CORE_PRIORITY_QUEUE_TIMEOUT)
+        self.poll_interval = float(settings.RAG_CORE_PRIORITY_POLL_INTERVAL)
+        # lease کوتاه که تا پایان درخواست (حتی stream های طولانی) هر lease_ttl/3 تمدید می‌شود
+        self.lease_ttl = float(settings.RAG_CORE_PRIORITY_LEASE_TTL)
+        self.renew_interval = self.lease_ttl / 3
+        self.heartbeat_ttl = max(5, int(self.poll_interval * 20))
+        self.scan_depth = 50
+        self._tier_args = [str(v) for item in self.weights.items() for v in item]
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, tier=None, on_position=None):
+        """
+        گرفتن slot سراسری؛ در صورت اشباع تا RAG_CORE_PRIORITY_QUEUE_TIMEOUT در صف می‌ماند
+
+        Args:
+            user_id: شناسه کاربر (None = بدون صف اولویت)
+            tier: tier اولویت (resolve_tier)
+            on_position: coroutine function که با موقعیت صف فراخوانی می‌شود
+
+        Raises:
+            CoreOverloadedError: انتظار در صف طولانی شد
+        """
+        if not self.enabled or user_id is None:
+            yield
+            return
+
+        if tier not in self.weights:
+            tier = 'free'
+        ticket = uuid.uuid4().hex
+        try:
+            redis = self.get_redis()
+            admitted = await self._wait_for_slot(redis, ticket, str(user_id), tier, on_position)
+        except CoreOverloadedError:
+            raise
+        except asyncio.CancelledError:
+            await self._abandon(ticket, tier)
+            raise
+        except Exception as e:
+            # Redis در دسترس نیست: فقط محدودکننده محلی اعمال می‌شود
+            logger.warning(f"Core priority queue unavailable: {e}")
+            await self._abandon(ticket, tier)
+            admitted = False
+
+        renewer = asyncio.create_task(self._keep_lease(ticket)) if admitted else None
+        try:
+            yield
+        finally:
+            if renewer is not None:
+                renewer.cancel()
+            if admitted:
+                await asyncio.shield(self._release(ticket))
+
+    async def _wait_for_slot(self, redis, ticket, user_id, tier, on_position):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        last_position = None
+        while True:
+            admitted, position = await redis.eval(
+                _ADMIT_SCRIPT, 1, KEY_PREFIX,
+                ticket, user_id, tier, self.global_limit, self.user_cap,
+                self.lease_ttl, self.heartbeat_ttl, self.scan_depth, *self._tier_args
+            )
+            if admitted:
+                return True
+
+            if loop.time() >= deadline:
+                await self._abandon(ticket, tier)
+                raise CoreOverloadedError('priority_timeout', max(1, int(self.poll_interval * position)))
+
+            if on_position is not None and position != last_position:
+                last_position = position
+                try:
+                    await on_position(position)
+                except Exception as e:
+                    logger.debug(f"Queue position callback failed: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def _keep_lease(self, ticket):
+        """تمدید دوره‌ای lease تا زمانی که slot نگه داشته شده است"""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                renewed = await self.get_redis().eval(_RENEW_SCRIPT, 1, KEY_PREFIX, ticket, self.lease_ttl)
+            except Exception as e:
+                logger.warning(f"Core priority lease renewal failed: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Core priority lease {ticket} expired while the slot was held")
+                return
+
+    async def _release(self, ticket):
+        try:
+            await self.get_redis().eval(_RELEASE_SCRIPT, 1, KEY_PREFIX, ticket)
+        except Exception as e:
+            # lease پس از lease_ttl خودکار آزاد می‌شود
+            logger.warning(f"Core priority slot release failed: {e}")
+
+    async def _abandon(self, ticket, tier):
+        try:
+            await asyncio.shield(self.get_redis().eval(_ABANDON_SCRIPT, 1, KEY_PREFIX, ticket, tier))
+        except Exception:
+            pass
+
+    async def stats(self):
+        """وضعیت سراسری صف: درخواست‌های در حال اجرا و طول صف هر tier"""
+        if not self.enabled:
+            return {'enabled': False}
+        try:
+            redis = self.get_redis()
+            pipe = redis.pipeline()
+            pipe.zcard(KEY_PREFIX + 'inflight')
+            for tier in self.weights:
+                pipe.zcard(KEY_PREFIX + 'queue:' + tier)
+            results = await pipe.execute()
+        except Exception as e:
+            return {'enabled': True, 'available': False, 'error': str(e)}
+        return {
+            'enabled': True,
+            'available': True,
+            'global_limit': self.global_limit,
+            'in_flight': results[0],
+            'queued': dict(zip(self.weights, results[1:])),
+            'weights': self.weights,
+            'user_max_in_flight': self.user_cap,
+        }
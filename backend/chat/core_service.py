@@ -2,14 +2,37 @@
 Core RAG System API Service
 This service handles all communication with the Core RAG system.
 """
+import asyncio
+import contextlib
+import hashlib
+import importlib.util
+import uuid
+import weakref
 import httpx
 import logging
 from typing import Optional, Dict, Any, AsyncGenerator
 from django.conf import settings
 import json
+import redis.asyncio as aioredis
+
+from core.utils import normalize_persian_text
+from .core_admission import CoreAdmissionController, CoreOverloadedError
+from .core_priority import CorePriorityQueue
 
 logger = logging.getLogger(__name__)
 
+# آزادسازی lock فقط توسط همان process که آن را گرفته است
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _LeaderFailed(Exception):
+    """درخواست leader در همین process ناموفق بود یا لغو شد"""
+
 
 class CoreAPIService:
     """Service for interacting with Core RAG API."""
@@ -20,6 +43,147 @@ class CoreAPIService:
         self.api_key = settings.RAG_CORE_API_KEY
         self.timeout = float(getattr(settings, 'RAG_CORE_TIMEOUT', 60))
         
+        # تنظیمات connection pool (keep-alive) برای اتصال به Core
+        self.limits = httpx.Limits(
+            max_connections=getattr(settings, 'RAG_CORE_MAX_CONNECTIONS', 100),
+            max_keepalive_connections=getattr(settings, 'RAG_CORE_MAX_KEEPALIVE_CONNECTIONS', 20),
+            keepalive_expiry=float(getattr(settings, 'RAG_CORE_KEEPALIVE_EXPIRY', 30)),
+        )
+        self.http2 = bool(getattr(settings, 'RAG_CORE_HTTP2', False))
+        if self.http2 and importlib.util.find_spec('h2') is None:
+            logger.warning("RAG_CORE_HTTP2 is enabled but 'h2' is not installed; falling back to HTTP/1.1")
+            self.http2 = False
+        
+        # یک client برای هر event loop (httpx.AsyncClient به loop خود وابسته است)
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        
+        # single-flight برای سوالات یکسان بدون context (در process و بین process ها از طریق Redis)
+        self.coalesce_queries = bool(getattr(settings, 'RAG_CORE_COALESCE_QUERIES', True))
+        self.coalesce_result_ttl = int(getattr(settings, 'RAG_CORE_COALESCE_RESULT_TTL', 10))
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._redis_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = (
+            weakref.WeakKeyDictionary()
+        )
+        
+        # صف اولویت سراسری (بر اساس پلن) و سپس محدودیت همزمانی تطبیقی و circuit breaker
+        self.priority = CorePriorityQueue(self._get_redis)
+        self.admission = CoreAdmissionController(health_check=self.health_check)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        دریافت client مشترک برای event loop جاری.
+        
+        Connection ها بین درخواست‌ها reuse می‌شوند تا handshake TCP/TLS
+        برای هر query تکرار نشود.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            self._prune_clients()
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                follow_redirects=True,
+            )
+            self._clients[loop] = client
+        return client
+    
+    def _prune_clients(self):
+        """حذف client های مربوط به loop های بسته شده"""
+        for loop in list(self._clients.keys()):
+            if loop.is_closed():
+                self._clients.pop(loop, None)
+    
+    def _get_redis(self) -> aioredis.Redis:
+        """client Redis (async) مشترک برای event loop جاری"""
+        loop = asyncio.get_running_loop()
+        client = self._redis_clients.get(loop)
+        if client is None:
+            client = aioredis.from_url(settings.CACHES['default']['LOCATION'])
+            self._redis_clients[loop] = client
+        return client
+    
+    async def aclose(self):
+        """
+        بستن client های مربوط به event loop جاری.
+        
+        فراخوانی‌هایی که loop کوتاه‌عمر خود را دارند (asyncio.run در Celery یا
+        management command) باید قبل از بسته شدن loop این متد را await کنند
+        (یا از loop_scope استفاده کنند)؛ در غیر این صورت socket ها و pool آن loop
+        آزاد نمی‌شوند. loop سرور daphne تا پایان process زنده است و نیازی به آن ندارد.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None and not client.is_closed:
+            await client.aclose()
+        redis_client = self._redis_clients.pop(loop, None)
+        if redis_client is not None:
+            await redis_client.aclose()
+    
+    @contextlib.asynccontextmanager
+    async def loop_scope(self):
+        """
+        محدوده استفاده از سرویس در یک event loop کوتاه‌عمر
+        
+        مثال:
+            async def main():
+                async with core_service.loop_scope():
+                    await core_service.delete_conversation(...)
+            asyncio.run(main())
+        """
+        try:
+            yield self
+        finally:
+            await self.aclose()
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        آمار connection pool برای تنظیم اندازه آن.
+        
+        آمار از ساختار داخلی httpcore خوانده می‌شود؛ اگر این ساختار (مثلاً پس از
+        ارتقای httpcore) در دسترس نباشد available=False برمی‌گردد.
+        
+        Returns:
+            Dict شامل تعداد کل اتصالات، اتصالات idle، فعال و درخواست‌های در صف
+        """
+        stats = {
+            'available': True,
+            'clients': 0,
+            'connections': 0,
+            'idle': 0,
+            'active': 0,
+            'waiting': 0,
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'http2': self.http2,
+        }
+        try:
+            for loop, client in list(self._clients.items()):
+                if client.is_closed or loop.is_closed():
+                    continue
+                pool = client._transport._pool
+                connections = list(pool.connections)
+                idle = sum(1 for connection in connections if connection.is_idle())
+                stats['clients'] += 1
+                stats['connections'] += len(connections)
+                stats['idle'] += idle
+                stats['active'] += len(connections) - idle
+                stats['waiting'] += sum(1 for request in list(pool._requests) if request.is_queued())
+        except Exception as e:
+            logger.debug(f"Core API pool stats unavailable: {e}")
+            return {
+                'available': False,
+                'max_connections': self.limits.max_connections,
+                'max_keepalive_connections': self.limits.max_keepalive_connections,
+                'http2': self.http2,
+            }
+        return stats
+    
     def _get_headers(self, token: str) -> Dict[str, str]:
         """Get headers for API requests."""
         return {
@@ -27,6 +191,34 @@ class CoreAPIService:
             'Content-Type': 'application/json',
         }
     
+    def _build_query_payload(
+        self,
+        query: str,
+        conversation_id: Optional[str],
+        language: str,
+        file_attachments: Optional[list],
+        enable_web_search: Optional[bool],
+    ) -> Dict[str, Any]:
+        """ساخت payload مطابق با API سیستم مرکزی"""
+        payload = {
+            "query": query,
+            "language": language,
+        }
+        
+        # اضافه کردن conversation_id برای استفاده از حافظه
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+        
+        # اضافه کردن فایل‌های ضمیمه (حداکثر 5)
+        if file_attachments and len(file_attachments) > 0:
+            payload["file_attachments"] = file_attachments[:5]
+        
+        # اضافه کردن تنظیم جستجوی وب
+        if enable_web_search is not None:
+            payload["enable_web_search"] = enable_web_search
+        
+        return payload
+    
     async def send_query(
         self,
         query: str,
@@ -35,6 +227,8 @@ class CoreAPIService:
         language: str = 'fa',
         file_attachments: Optional[list] = None,
         enable_web_search: Optional[bool] = None,
+        priority: Optional[Dict[str, Any]] = None,
+        coalesce: bool = False,
     ) -> Dict[str, Any]:
         """
         ارسال سوال به سیستم مرکزی RAG Core.
@@ -46,32 +240,35 @@ class CoreAPIService:
             language: زبان (پیش‌فرض: fa)
             file_attachments: لیست فایل‌های ضمیمه (حداکثر 5)
             enable_web_search: فعال/غیرفعال کردن جستجوی وب (None = پیش‌فرض سرور)
+            priority: صف اولویت {'user_id', 'tier', 'on_position'} (None = بدون صف اولویت)
+            coalesce: اشتراک درخواست upstream با سوالات یکسان همزمان؛ فقط برای
+                اولین سوال یک گفتگوی جدید (follower ها conversation_id در Core نمی‌گیرند)
             
         Returns:
             پاسخ شامل answer, file_analysis, conversation_id و غیره
         """
-        url = f"{self.base_url}/api/v1/query/"
-        
-        # ساخت payload مطابق با API سیستم مرکزی
-        payload = {
-            "query": query,
-            "language": language,
-        }
-        
-        # اضافه کردن conversation_id برای استفاده از حافظه
-        if conversation_id:
-            payload["conversation_id"] = conversation_id
+        payload = self._build_query_payload(
+            query, conversation_id, language, file_attachments, enable_web_search
+        )
         
-        # اضافه کردن فایل‌های ضمیمه (حداکثر 5)
-        if file_attachments and len(file_attachments) > 0:
-            payload["file_attachments"] = file_attachments[:5]
+        # اولین سوال‌های یکسان گفتگوهای جدید که همزمان در جریان هستند یک درخواست upstream مشترک دارند
+        if self.coalesce_queries and coalesce and not conversation_id and not file_attachments:
+            return await self._coalesced_query(payload, token, priority)
         
-        # اضافه کردن تنظیم جستجوی وب
-        if enable_web_search is not None:
-            payload["enable_web_search"] = enable_web_search
+        return await self._post_query(payload, token, priority)
+    
+    async def _post_query(
+        self,
+        payload: Dict[str, Any],
+        token: str,
+        priority: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """ارسال مستقیم سوال به Core"""
+        url = f"{self.base_url}/api/v1/query/"
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+            async with self.priority.slot(**(priority or {})), self.admission.admit():
+                client = self._get_client()
                 response = await client.post(
                     url,
                     json=payload,
@@ -79,7 +276,9 @@ class CoreAPIService:
                 )
                 response.raise_for_status()
                 return response.json()
-                
+            
+        except CoreOverloadedError:
+            raise
         except httpx.HTTPStatusError as e:
             logger.error(f"Core API HTTP error: {e.response.status_code} - {e.response.text}")
             raise
@@ -87,11 +286,262 @@ class CoreAPIService:
             logger.error(f"Core API error: {str(e)}")
             raise
     
+    @staticmethod
+    def _coalesce_key(payload: Dict[str, Any]) -> str:
+        """کلید single-flight بر اساس متن نرمال شده سوال، زبان و جستجوی وب"""
+        raw = '\x1f'.join([
+            normalize_persian_text(payload['query']),
+            payload.get('language') or 'fa',
+            str(payload.get('enable_web_search')),
+        ])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _shared_result(result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        نسخه پاسخ برای درخواست‌های منتظر (follower)
+        
+        conversation/message در Core متعلق به کاربر leader است و مصرف توکن فقط
+        برای او ثبت می‌شود.
+        """
+        private = ('conversation_id', 'message_id')
+        shared = {k: v for k, v in result.items() if k not in private}
+        if isinstance(result.get('metadata'), dict):
+            shared['metadata'] = {k: v for k, v in result['metadata'].items() if k not in private}
+        shared['tokens_used'] = 0
+        shared['coalesced'] = True
+        return shared
+    
+    async def _coalesced_query(
+        self,
+        payload: Dict[str, Any],
+        token: str,
+        priority: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        single-flight برای سوالات یکسان
+        
+        درخواست‌های همزمان در همین process منتظر future درخواست اول می‌مانند؛
+        بین process ها از lock و انتشار نتیجه در Redis استفاده می‌شود.
+        در صورت خطا یا لغو leader، هر follower خودش درخواست را ارسال می‌کند.
+        """
+        loop = asyncio.get_running_loop()
+        key = self._coalesce_key(payload)
+        inflight = self._inflight.setdefault(loop, {})
+        
+        future = inflight.get(key)
+        if future is not None:
+            try:
+                return self._shared_result(await asyncio.shield(future))
+            except _LeaderFailed:
+                return await self._post_query(payload, token, priority)
+        
+        future = loop.create_future()
+        inflight[key] = future
+        try:
+            result = await self._coalesce_across_processes(key, payload, token, priority)
+        except BaseException:
+            future.set_exception(_LeaderFailed())
+            future.exception()  # جلوگیری از هشدار "exception was never retrieved"
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            inflight.pop(key, None)
+    
+    async def _coalesce_across_processes(
+        self,
+        key: str,
+        payload: Dict[str, Any],
+        token: str,
+        priority: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """هماهنگی بین process های daphne از طریق Redis"""
+        lock_key = f'core_singleflight:lock:{key}'
+        result_key = f'core_singleflight:result:{key}'
+        owner = uuid.uuid4().hex
+        
+        try:
+            redis = self._get_redis()
+            acquired = await redis.set(lock_key, owner, nx=True, px=int(self.timeout * 1000))
+        except Exception as e:
+            logger.warning(f"Core single-flight unavailable (redis): {e}")
+            return await self._post_query(payload, token, priority)
+        
+        if acquired:
+            return await self._lead_query(redis, lock_key, result_key, owner, payload, token, priority)
+        
+        result = await self._wait_for_leader(redis, lock_key, result_key)
+        if result is not None:
+            return self._shared_result(result)
+        return await self._post_query(payload, token, priority)
+    
+    async def _lead_query(self, redis, lock_key, result_key, owner, payload, token, priority=None) -> Dict[str, Any]:
+        """ارسال درخواست به عنوان leader و انتشار نتیجه برای سایر process ها"""
+        message = {'ok': False}
+        try:
+            result = await self._post_query(payload, token, priority)
+            message = {'ok': True, 'result': result}
+            return result
+        finally:
+            try:
+                await asyncio.shield(self._publish_result(redis, lock_key, result_key, owner, message))
+            except Exception as e:
+                logger.warning(f"Core single-flight publish failed: {e}")
+    
+    async def _publish_result(self, redis, lock_key, result_key, owner, message):
+        data = json.dumps(message, ensure_ascii=False, default=str)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(result_key, data, ex=self.coalesce_result_ttl)
+            pipe.publish(result_key, '1')
+            pipe.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, owner)
+            await pipe.execute()
+    
+    async def _wait_for_leader(self, redis, lock_key, result_key) -> Optional[Dict[str, Any]]:
+        """
+        انتظار برای نتیجه leader در process دیگر
+        
+        Returns:
+            پاسخ leader، یا None اگر leader ناموفق بود یا بدون نتیجه متوقف شد
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(result_key)
+            while True:
+                data = await redis.get(result_key)
+                if data is None and not await redis.exists(lock_key):
+                    # ممکن است نتیجه بین دو فرمان بالا منتشر شده باشد
+                    data = await redis.get(result_key)
+                    if data is None:
+                        return None
+                if data is not None:
+                    message = json.loads(data)
+                    return message['result'] if message.get('ok') else None
+                
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(1.0, remaining))
+        except Exception as e:
+            logger.warning(f"Core single-flight wait failed: {e}")
+            return None
+        finally:
+            try:
+                await pubsub.unsubscribe(result_key)
+                await pubsub.aclose()
+            except Exception:
+                pass
+    
+    async def stream_query(
+        self,
+        query: str,
+        token: str,
+        conversation_id: Optional[str] = None,
+        language: str = 'fa',
+        file_attachments: Optional[list] = None,
+        enable_web_search: Optional[bool] = None,
+        priority: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        ارسال سوال به صورت streaming و دریافت پاسخ به محض تولید.
+        
+        بستن generator (مثلاً با قطع اتصال کلاینت) درخواست upstream را هم می‌بندد.
+        priority مانند send_query است.
+        
+        Yields:
+            {'type': 'chunk', 'content': '...'} برای هر تکه از پاسخ
+            {'type': 'done', 'data': {...}} در پایان (sources, conversation_id, ...)
+            {'type': 'error', 'message': '...'} در صورت خطای سیستم مرکزی
+            سایر رویدادها به شکل {'type': '<event>', 'data': {...}}
+        """
+        url = f"{self.base_url}/api/v1/query/stream"
+        payload = self._build_query_payload(
+            query, conversation_id, language, file_attachments, enable_web_search
+        )
+        
+        async with self.priority.slot(**(priority or {})), self.admission.admit() as permit:
+            client = self._get_client()
+            try:
+                async with client.stream(
+                    'POST',
+                    url,
+                    json=payload,
+                    headers={**self._get_headers(token), 'Accept': 'text/event-stream'},
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                        response.raise_for_status()
+                    permit.mark_first_byte()
+                    
+                    event_name = None
+                    data_lines = []
+                    async for line in response.aiter_lines():
+                        if not line:
+                            # پایان یک رویداد SSE
+                            if data_lines:
+                                event = self._parse_stream_event(event_name, '\n'.join(data_lines))
+                                data_lines = []
+                                event_name = None
+                                yield event
+                                if event['type'] == 'done':
+                                    return
+                            continue
+                        if line.startswith(':'):
+                            continue  # comment / keep-alive
+                        if line.startswith('event:'):
+                            event_name = line[len('event:'):].strip()
+                        elif line.startswith('data:'):
+                            data_lines.append(line[len('data:'):].lstrip())
+                        else:
+                            # پاسخ متنی ساده (غیر SSE)
+                            yield {'type': 'chunk', 'content': line}
+                    
+                    if data_lines:
+                        event = self._parse_stream_event(event_name, '\n'.join(data_lines))
+                        yield event
+                        if event['type'] == 'done':
+                            return
+                    
+                    yield {'type': 'done', 'data': {}}
+            
+            except httpx.HTTPStatusError as e:
+                logger.error(f"Core API stream HTTP error: {e.response.status_code} - {e.response.text}")
+                raise
+    
+    @staticmethod
+    def _parse_stream_event(event_name: Optional[str], data: str) -> Dict[str, Any]:
+        """تبدیل یک رویداد SSE سیستم مرکزی به فرمت یکسان"""
+        if data == '[DONE]':
+            return {'type': 'done', 'data': {}}
+        
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            return {'type': 'chunk', 'content': data}
+        
+        if not isinstance(obj, dict):
+            return {'type': 'chunk', 'content': str(obj)}
+        
+        kind = obj.get('type') or event_name or 'chunk'
+        if kind in ('done', 'complete', 'completed', 'end', 'final'):
+            data = obj.get('data')
+            return {'type': 'done', 'data': data if isinstance(data, dict) else obj}
+        if kind == 'error':
+            return {'type': 'error', 'message': obj.get('message') or obj.get('error') or ''}
+        if kind in ('chunk', 'token', 'delta', 'content', 'message'):
+            content = obj.get('content') or obj.get('token') or obj.get('delta') or obj.get('text') or ''
+            return {'type': 'chunk', 'content': content}
+        return {'type': kind, 'data': obj}
+    
     async def get_conversations(
         self,
         token: str,
         limit: int = 20,
         offset: int = 0,
+        raise_errors: bool = False,
     ) -> list:
         """
         Get user's conversations from Core.
@@ -100,6 +550,8 @@ class CoreAPIService:
             token: JWT token
             limit: Number of conversations to fetch
             offset: Offset for pagination
+            raise_errors: خطا (5xx، timeout) به جای لیست خالی raise شود؛ برای
+                فراخواننده‌ای که لیست خالی را پایان صفحه‌ها تعبیر می‌کند
             
         Returns:
             List of conversations
@@ -108,17 +560,20 @@ class CoreAPIService:
         params = {"limit": limit, "offset": offset}
         
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
-                response = await client.get(
-                    url,
-                    params=params,
-                    headers=self._get_headers(token),
-                )
-                response.raise_for_status()
-                return response.json()
-                
+            client = self._get_client()
+            response = await client.get(
+                url,
+                params=params,
+                headers=self._get_headers(token),
+                timeout=30,
+            )
+            response.raise_for_status()
+            return response.json()
+            
         except Exception as e:
             logger.error(f"Error fetching conversations: {str(e)}")
+            if raise_errors:
+                raise
             return []
     
     async def get_conversation_messages(
@@ -144,15 +599,16 @@ class CoreAPIService:
         params = {"limit": limit, "offset": offset}
         
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
-                response = await client.get(
-                    url,
-                    params=params,
-                    headers=self._get_headers(token),
-                )
-                response.raise_for_status()
-                return response.json()
-                
+            client = self._get_client()
+            response = await client.get(
+                url,
+                params=params,
+                headers=self._get_headers(token),
+                timeout=30,
+            )
+            response.raise_for_status()
+            return response.json()
+            
         except Exception as e:
             logger.error(f"Error fetching messages: {str(e)}")
             return []
@@ -175,14 +631,15 @@ class CoreAPIService:
         url = f"{self.base_url}/api/v1/users/conversations/{conversation_id}/"
         
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
-                response = await client.delete(
-                    url,
-                    headers=self._get_headers(token),
-                )
-                response.raise_for_status()
-                return True
-                
+            client = self._get_client()
+            response = await client.delete(
+                url,
+                headers=self._get_headers(token),
+                timeout=30,
+            )
+            response.raise_for_status()
+            return True
+            
         except Exception as e:
             logger.error(f"Error deleting conversation: {str(e)}")
             return False
@@ -218,15 +675,16 @@ class CoreAPIService:
             payload["feedback_text"] = feedback_text
         
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
-                response = await client.post(
-                    url,
-                    json=payload,
-                    headers=self._get_headers(token),
-                )
-                response.raise_for_status()
-                return True
-                
+            client = self._get_client()
+            response = await client.post(
+                url,
+                json=payload,
+                headers=self._get_headers(token),
+                timeout=30,
+            )
+            response.raise_for_status()
+            return True
+            
         except Exception as e:
             logger.error(f"Error submitting feedback: {str(e)}")
             return False
@@ -244,14 +702,15 @@ class CoreAPIService:
         url = f"{self.base_url}/api/v1/users/profile/"
         
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
-                response = await client.get(
-                    url,
-                    headers=self._get_headers(token),
-                )
-                response.raise_for_status()
-                return response.json()
-                
+            client = self._get_client()
+            response = await client.get(
+                url,
+                headers=self._get_headers(token),
+                timeout=30,
+            )
+            response.raise_for_status()
+            return response.json()
+            
         except Exception as e:
             logger.error(f"Error fetching user profile: {str(e)}")
             return None
@@ -274,22 +733,23 @@ class CoreAPIService:
         url = f"{self.base_url}/api/v1/users/conversations/{conversation_id}/"
         
         try:
-            async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
-                response = await client.delete(
-                    url,
-                    headers=self._get_headers(token),
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"✅ Conversation {conversation_id} deleted from Core RAG")
-                    return True
-                elif response.status_code == 404:
-                    logger.warning(f"⚠️ Conversation {conversation_id} not found in Core RAG")
-                    return True  # Consider it deleted if not found
-                else:
-                    logger.error(f"❌ Failed to delete conversation {conversation_id}: {response.status_code}")
-                    return False
-                    
+            client = self._get_client()
+            response = await client.delete(
+                url,
+                headers=self._get_headers(token),
+                timeout=30,
+            )
+            
+            if response.status_code == 200:
+                logger.info(f"✅ Conversation {conversation_id} deleted from Core RAG")
+                return True
+            elif response.status_code == 404:
+                logger.warning(f"⚠️ Conversation {conversation_id} not found in Core RAG")
+                return True  # Consider it deleted if not found
+            else:
+                logger.error(f"❌ Failed to delete conversation {conversation_id}: {response.status_code}")
+                return False
+            
         except Exception as e:
             logger.error(f"❌ Error deleting conversation from Core RAG: {str(e)}")
             return False
@@ -302,19 +762,19 @@ class CoreAPIService:
             Dict with status and details
         """
         try:
-            async with httpx.AsyncClient(timeout=5.0, follow_redirects=True) as client:
-                response = await client.get(f"{self.base_url}/health")
-                
-                if response.status_code == 200:
-                    return {
-                        'status': 'connected',
-                        'message': 'سیستم مرکزی متصل است'
-                    }
-                else:
-                    return {
-                        'status': 'error',
-                        'message': f'خطای سیستم مرکزی: {response.status_code}'
-                    }
+            client = self._get_client()
+            response = await client.get(f"{self.base_url}/health", timeout=5.0)
+            
+            if response.status_code == 200:
+                return {
+                    'status': 'connected',
+                    'message': 'سیستم مرکزی متصل است'
+                }
+            else:
+                return {
+                    'status': 'error',
+                    'message': f'خطای سیستم مرکزی: {response.status_code}'
+                }
         except httpx.TimeoutException:
             return {
                 'status': 'disconnected',
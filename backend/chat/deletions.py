@@ -0,0 +1,159 @@
+"""
+حذف گفتگوها با outbox تراکنشی
+
+- حذف توسط کاربر (تکی یا گروهی) فقط گفتگو را tombstone می‌کند (deleted_at) و در
+  همان تراکنش یک ردیف CoreDeletion ثبت می‌کند؛ گفتگو بلافاصله از همه query های
+  Conversation.objects پنهان می‌شود و پاسخ بدون انتظار برای Core برگردانده می‌شود
+- تسک drain_core_deletions ردیف‌ها را دسته‌ای برمی‌دارد (SKIP LOCKED)، حذف از Core
+  را با همزمانی محدود (asyncio.Semaphore) انجام می‌دهد و پس از موفقیت گفتگو و
+  پیام‌هایش را به صورت نهایی حذف می‌کند؛ خطاها با backoff نمایی دوباره تلاش می‌شوند
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .core_service import core_service
+from .models import Conversation, CoreDeletion
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'CORE_DELETE_BATCH_SIZE', 100)
+CONCURRENCY = getattr(settings, 'CORE_DELETE_CONCURRENCY', 10)
+MAX_ATTEMPTS = getattr(settings, 'CORE_DELETE_MAX_ATTEMPTS', 8)
+
+# ردیف processing قدیمی‌تر از این مقدار (worker متوقف شده) دوباره برداشته می‌شود
+PROCESSING_LEASE = timedelta(minutes=10)
+MAX_BACKOFF = timedelta(hours=1)
+
+
+def tombstone_conversations(queryset):
+    """
+    علامت‌گذاری حذف گفتگوها و ثبت حذف از Core در outbox
+
+    Returns:
+        تعداد گفتگوهای حذف شده
+    """
+    with transaction.atomic():
+        rows = list(
+            queryset.filter(deleted_at__isnull=True)
+            .select_for_update()
+            .values_list('id', 'user_id', 'rag_conversation_id')
+        )
+        if not rows:
+            return 0
+
+        CoreDeletion.objects.bulk_create([
+            CoreDeletion(user_id=user_id, conversation_id=conversation_id, rag_conversation_id=rag_id or '')
+            for conversation_id, user_id, rag_id in rows
+        ])
+        Conversation.all_objects.filter(id__in=[row[0] for row in rows]).update(deleted_at=timezone.now())
+        transaction.on_commit(schedule_drain)
+
+    return len(rows)
+
+
+def schedule_drain():
+    from .tasks import drain_core_deletions
+
+    try:
+        drain_core_deletions.delay()
+    except Exception as e:
+        # تسک زمان‌بندی شده (beat) ردیف‌های باقی‌مانده را پردازش می‌کند
+        logger.warning(f"Could not enqueue core deletion drain: {e}")
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """برداشتن دسته‌ای از ردیف‌های آماده (بدون تداخل بین worker ها)"""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            CoreDeletion.objects.select_for_update(skip_locked=True).filter(
+                Q(status='pending', next_attempt_at__lte=now) |
+                Q(status='processing', updated_at__lt=now - PROCESSING_LEASE)
+            ).order_by('next_attempt_at').values_list('id', flat=True)[:limit]
+        )
+        CoreDeletion.objects.filter(id__in=ids).update(status='processing', updated_at=now)
+    return list(CoreDeletion.objects.filter(id__in=ids).select_related('user'))
+
+
+async def _delete_from_core(deletions, tokens, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete_one(deletion):
+        if not deletion.rag_conversation_id:
+            return True
+        async with semaphore:
+            return await core_service.delete_conversation(
+                conversation_id=deletion.rag_conversation_id,
+                token=tokens[deletion.user_id]
+            )
+
+    # هر دسته loop کوتاه‌عمر خود را دارد (asyncio.run)؛ client های آن قبل از بسته شدن loop بسته می‌شوند
+    async with core_service.loop_scope():
+        results = await asyncio.gather(*(delete_one(d) for d in deletions), return_exceptions=True)
+    return [result is True for result in results]
+
+
+def process_batch(deletions, concurrency=CONCURRENCY):
+    """
+    حذف یک دسته از Core و اعمال نتیجه
+
+    Returns:
+        (تعداد موفق، تعداد ناموفق)
+    """
+    from accounts.tokens import get_core_access_token
+
+    tokens = {}
+    for deletion in deletions:
+        if deletion.rag_conversation_id and deletion.user_id not in tokens:
+            tokens[deletion.user_id] = get_core_access_token(deletion.user)
+
+    results = asyncio.run(_delete_from_core(deletions, tokens, concurrency))
+
+    succeeded = [d for d, ok in zip(deletions, results) if ok]
+    failed = [d for d, ok in zip(deletions, results) if not ok]
+
+    if succeeded:
+        with transaction.atomic():
+            # فقط گفتگوهای tombstone شده؛ اگر گفتگو قبلاً حذف شده باشد کاری انجام نمی‌شود
+            Conversation.all_objects.filter(
+                id__in=[d.conversation_id for d in succeeded],
+                deleted_at__isnull=False
+            ).delete()
+            CoreDeletion.objects.filter(id__in=[d.id for d in succeeded]).delete()
+
+    now = timezone.now()
+    for deletion in failed:
+        attempts = deletion.attempts + 1
+        backoff = min(timedelta(seconds=30 * 2 ** deletion.attempts), MAX_BACKOFF)
+        CoreDeletion.objects.filter(id=deletion.id).update(
+            status='failed' if attempts >= MAX_ATTEMPTS else 'pending',
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + backoff,
+            last_error='RAG Core deletion failed',
+            updated_at=now
+        )
+        logger.warning(
+            f"Core deletion of conversation {deletion.conversation_id} failed "
+            f"(attempt {attempts}/{MAX_ATTEMPTS})"
+        )
+
+    return len(succeeded), len(failed)
+
+
+def drain(max_batches=50, batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+    """پردازش ردیف‌های آماده تا خالی شدن صف (حداکثر max_batches دسته)"""
+    total_succeeded = total_failed = 0
+    for _ in range(max_batches):
+        deletions = claim_batch(batch_size)
+        if not deletions:
+            break
+        succeeded, failed = process_batch(deletions, concurrency)
+        total_succeeded += succeeded
+        total_failed += failed
+    return {'deleted': total_succeeded, 'failed': total_failed}
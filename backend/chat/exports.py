@@ -0,0 +1,404 @@
+"""
+Export گفتگوها
+
+- export یک گفتگو (json/txt/csv): پاسخ StreamingHttpResponse که پیام‌ها را با
+  iterator() به صورت دسته‌ای از پایگاه داده می‌خواند؛ مصرف حافظه به طول گفتگو
+  وابسته نیست
+- export همه گفتگوهای کاربر (ConversationExport): تسک Celery فایل ZIP شامل
+  JSONL و/یا Markdown هر گفتگو را در MinIO می‌سازد و لینک presigned را با
+  اعلان برای کاربر می‌فرستد
+
+ساخت ZIP در دو مرحله انجام می‌شود:
+1. گفتگوها به ترتیب id در دسته‌های EXPORT_BATCH_SIZE تایی در فایل‌های ZIP جزئی
+   (exports/<user>/<export>/part-00001.zip) نوشته و آپلود می‌شوند و بعد از هر
+   دسته checkpoint ذخیره می‌شود؛ اجرای مجدد تسک از آخرین دسته ادامه می‌دهد
+2. بخش‌ها در یک فایل ZIP نهایی (روی دیسک) ادغام و آپلود می‌شوند و سپس بخش‌ها حذف می‌شوند
+
+فایل‌های نهایی پس از CONVERSATION_EXPORT_RETENTION_HOURS حذف و ردیف export با
+وضعیت expired علامت‌گذاری می‌شود (expire_exports، تسک شبانه chat.tasks)؛ بخش‌های
+export های ناموفق یا رها شده نیز پس از همین مهلت حذف می‌شوند.
+"""
+import csv
+import json
+import logging
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Conversation, ConversationExport, Message
+
+logger = logging.getLogger(__name__)
+
+ITERATOR_CHUNK_SIZE = 500
+
+# اندازه تقریبی هر تکه ارسالی در پاسخ streaming
+STREAM_BUFFER_SIZE = 64 * 1024
+
+EXPORT_BATCH_SIZE = getattr(settings, 'CONVERSATION_EXPORT_BATCH_SIZE', 200)
+EXPORT_URL_TTL = getattr(settings, 'CONVERSATION_EXPORT_URL_TTL', 86400)
+EXPORT_PREFIX = 'exports/'
+EXPORT_RETENTION = timedelta(hours=getattr(settings, 'CONVERSATION_EXPORT_RETENTION_HOURS', 168))
+
+
+def _role_label(role):
+    return "کاربر" if role == "user" else "دستیار"
+
+
+def _iter_messages(conversation_id, fields=('role', 'content', 'created_at')):
+    """پیام‌های گفتگو به ترتیب زمان، بدون cache کردن queryset"""
+    return Message.objects.filter(
+        conversation_id=conversation_id
+    ).order_by('created_at').values(*fields).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+# ============================================================
+# export یک گفتگو (streaming)
+# ============================================================
+
+def iter_json(conversation):
+    yield '{"title": %s, "created_at": %s, "messages": [' % (
+        json.dumps(conversation.title, ensure_ascii=False),
+        json.dumps(conversation.created_at.isoformat())
+    )
+    separator = ''
+    for msg in _iter_messages(conversation.id):
+        yield separator + json.dumps({
+            'role': msg['role'],
+            'content': msg['content'],
+            'created_at': msg['created_at'].isoformat()
+        }, ensure_ascii=False)
+        separator = ', '
+    yield ']}'
+
+
+def iter_txt(conversation):
+    yield f"گفتگو: {conversation.title}\n"
+    yield f"تاریخ: {conversation.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+    yield "=" * 50 + "\n\n"
+    for msg in _iter_messages(conversation.id):
+        yield f"[{_role_label(msg['role'])}] {msg['created_at'].strftime('%H:%M')}\n{msg['content']}\n\n"
+
+
+class _Echo:
+    """فایل مجازی برای csv.writer که سطر نوشته شده را برمی‌گرداند"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(conversation):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['نقش', 'پیام', 'زمان'])
+    for msg in _iter_messages(conversation.id):
+        yield writer.writerow([
+            _role_label(msg['role']), msg['content'], msg['created_at'].strftime('%Y-%m-%d %H:%M')
+        ])
+
+
+STREAM_FORMATS = {
+    'json': (iter_json, 'application/json; charset=utf-8', None),
+    'txt': (iter_txt, 'text/plain; charset=utf-8', 'txt'),
+    'csv': (iter_csv, 'text/csv; charset=utf-8', 'csv'),
+}
+
+
+def _buffered(chunks, size=STREAM_BUFFER_SIZE):
+    """ادغام تکه‌های کوچک در بلوک‌های بزرگ‌تر (کاهش تعداد write ها)"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def _aiter(iterator):
+    """
+    مصرف iterator همگام از داخل event loop
+
+    Django 4.2 در ASGI یک iterator همگام را پیش از ارسال کامل در حافظه جمع
+    می‌کند؛ هر بلوک جداگانه در thread همگام (همان اتصال پایگاه داده) خوانده می‌شود.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+
+def streaming_export_response(request, conversation, export_format):
+    """
+    پاسخ streaming برای export یک گفتگو
+
+    Returns:
+        StreamingHttpResponse یا None اگر فرمت به صورت streaming پشتیبانی نشود
+    """
+    if export_format not in STREAM_FORMATS:
+        return None
+
+    render, content_type, extension = STREAM_FORMATS[export_format]
+    content = _buffered(render(conversation))
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        content = _aiter(content)
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    if extension:
+        response['Content-Disposition'] = f'attachment; filename="conversation_{conversation.id}.{extension}"'
+    return response
+
+
+# ============================================================
+# export همه گفتگوها (ZIP در MinIO)
+# ============================================================
+
+def _entry_name(conversation, extension):
+    slug = slugify(conversation['title'], allow_unicode=True)[:50] or 'conversation'
+    return f"conversations/{conversation['created_at']:%Y-%m-%d}_{slug}_{str(conversation['id'])[:8]}.{extension}"
+
+
+def write_jsonl(fileobj, conversation):
+    """خط اول اطلاعات گفتگو، سپس هر پیام در یک خط"""
+    header = {
+        'type': 'conversation',
+        'id': str(conversation['id']),
+        'title': conversation['title'],
+        'description': conversation['description'],
+        'created_at': conversation['created_at'].isoformat(),
+    }
+    fileobj.write((json.dumps(header, ensure_ascii=False) + '\n').encode('utf-8'))
+    for msg in _iter_messages(conversation['id'], fields=('role', 'content', 'sources', 'created_at')):
+        line = {
+            'type': 'message',
+            'role': msg['role'],
+            'content': msg['content'],
+            'sources': msg['sources'],
+            'created_at': msg['created_at'].isoformat(),
+        }
+        fileobj.write((json.dumps(line, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+def write_markdown(fileobj, conversation):
+    fileobj.write(f"# {conversation['title']}\n\n".encode('utf-8'))
+    if conversation['description']:
+        fileobj.write(f"{conversation['description']}\n\n".encode('utf-8'))
+    fileobj.write(f"_تاریخ: {conversation['created_at']:%Y-%m-%d %H:%M}_\n\n---\n\n".encode('utf-8'))
+    for msg in _iter_messages(conversation['id']):
+        fileobj.write(
+            f"**{_role_label(msg['role'])}** ({msg['created_at']:%Y-%m-%d %H:%M}):\n\n{msg['content']}\n\n".encode('utf-8')
+        )
+
+
+ARCHIVE_WRITERS = {
+    'jsonl': [('jsonl', write_jsonl)],
+    'markdown': [('md', write_markdown)],
+    'both': [('jsonl', write_jsonl), ('md', write_markdown)],
+}
+
+
+def _part_key(export, index):
+    return f"{EXPORT_PREFIX}{export.user_id}/{export.id}/part-{index:05d}.zip"
+
+
+def _archive_key(export):
+    return f"{EXPORT_PREFIX}{export.user_id}/{export.id}.zip"
+
+
+def _export_part(export, conversations, index):
+    """نوشتن یک دسته گفتگو در ZIP موقت روی دیسک و آپلود آن به عنوان بخش index"""
+    from core.storage import s3_service
+
+    writers = ARCHIVE_WRITERS[export.format]
+    with tempfile.TemporaryFile() as tmp:
+        with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for conversation in conversations:
+                for extension, write in writers:
+                    with archive.open(_entry_name(conversation, extension), 'w', force_zip64=True) as entry:
+                        write(entry, conversation)
+        tmp.seek(0)
+        s3_service.upload_fileobj(tmp, _part_key(export, index), content_type='application/zip')
+
+
+def _assemble(export):
+    """ادغام بخش‌ها در ZIP نهایی؛ Returns: حجم فایل نهایی"""
+    from core.storage import s3_service
+
+    with tempfile.TemporaryFile() as output:
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for index in range(1, export.part_count + 1):
+                with tempfile.TemporaryFile() as part:
+                    s3_service.download_fileobj(_part_key(export, index), part)
+                    part.seek(0)
+                    with zipfile.ZipFile(part) as source:
+                        for info in source.infolist():
+                            with source.open(info) as src, archive.open(info.filename, 'w', force_zip64=True) as dst:
+                                shutil.copyfileobj(src, dst)
+        size = output.tell()
+        output.seek(0)
+        s3_service.upload_fileobj(output, _archive_key(export), content_type='application/zip')
+    return size
+
+
+def _delete_parts(export):
+    from core.storage import s3_service
+
+    for index in range(1, export.part_count + 1):
+        s3_service.delete_file(_part_key(export, index))
+
+
+def download_url(export):
+    """لینک presigned دانلود فایل نهایی (هر بار جدید ساخته می‌شود)"""
+    from core.storage import s3_service
+
+    if export.status != 'completed' or not export.object_key:
+        return None
+    return s3_service.generate_presigned_url(
+        export.object_key,
+        expiration=EXPORT_URL_TTL,
+        download_name=f"conversations_{export.created_at:%Y%m%d}.zip"
+    )
+
+
+def _notify(export):
+    """اعلان آماده بودن فایل با لینک presigned"""
+    from notifications.models import Notification
+    from notifications.services import WebSocketService
+
+    url = download_url(export)
+    notification = Notification.objects.create(
+        user=export.user,
+        title='خروجی گفتگوها آماده است',
+        body=f'فایل خروجی {export.processed_conversations} گفتگوی شما آماده دانلود است.',
+        category='chat',
+        priority='normal',
+        # لینک presigned ممکن است از طول فیلد بیشتر باشد؛ در metadata کامل ذخیره می‌شود
+        action_url=url if len(url) <= 500 else '',
+        action_text='دانلود',
+        channels=['in_app', 'websocket'],
+        metadata={'export_id': str(export.id), 'download_url': url},
+        expires_at=timezone.now() + timedelta(seconds=EXPORT_URL_TTL)
+    )
+    WebSocketService.send(notification)
+
+
+def run_export(export_id):
+    """
+    ساخت (یا ادامه ساخت) ZIP همه گفتگوهای کاربر
+
+    بعد از هر دسته، last_conversation_id و part_count ذخیره می‌شوند؛ اگر تسک
+    متوقف شود اجرای بعدی از همان نقطه ادامه می‌دهد.
+    """
+    export = ConversationExport.objects.select_related('user').get(id=export_id)
+    if export.status == 'completed':
+        return
+
+    conversations = Conversation.objects.filter(user_id=export.user_id)
+    if export.last_conversation_id is None:
+        export.total_conversations = conversations.count()
+    export.status = 'processing'
+    export.error_message = ''
+    export.save(update_fields=['status', 'error_message', 'total_conversations', 'updated_at'])
+
+    while True:
+        batch = conversations.order_by('id')
+        if export.last_conversation_id is not None:
+            batch = batch.filter(id__gt=export.last_conversation_id)
+        batch = list(batch.values('id', 'title', 'description', 'created_at')[:EXPORT_BATCH_SIZE])
+        if not batch:
+            break
+
+        index = export.part_count + 1
+        _export_part(export, batch, index)
+
+        # checkpoint
+        export.part_count = index
+        export.last_conversation_id = batch[-1]['id']
+        export.processed_conversations += len(batch)
+        ConversationExport.objects.filter(id=export.id).update(
+            part_count=index,
+            last_conversation_id=export.last_conversation_id,
+            processed_conversations=F('processed_conversations') + len(batch),
+            updated_at=timezone.now()
+        )
+        logger.info(f"Export {export.id}: {export.processed_conversations}/{export.total_conversations} conversations")
+
+    export.file_size = _assemble(export)
+    export.object_key = _archive_key(export)
+    export.status = 'completed'
+    export.completed_at = timezone.now()
+    export.save(update_fields=['file_size', 'object_key', 'status', 'completed_at', 'updated_at'])
+
+    # بخش‌ها فقط بعد از ثبت فایل نهایی حذف می‌شوند (اجرای مجدد به آنها نیاز دارد)
+    _delete_parts(export)
+    _notify(export)
+
+
+def _export_keys(export):
+    """همه فایل‌های یک export در MinIO (فایل نهایی و بخش‌های باقی‌مانده)"""
+    keys = [_part_key(export, index) for index in range(1, export.part_count + 1)]
+    if export.object_key:
+        keys.append(export.object_key)
+    return keys
+
+
+def expire_exports(retention=EXPORT_RETENTION, batch_size=500):
+    """
+    حذف فایل‌های export قدیمی از MinIO و ثبت وضعیت expired
+
+    - export کامل شده: completed_at قدیمی‌تر از retention
+    - export ناموفق یا رها شده (pending/processing): updated_at قدیمی‌تر از retention
+
+    export هایی که حذف فایل آن‌ها ناموفق باشد در اجرای بعدی دوباره بررسی می‌شوند.
+
+    Returns:
+        تعداد export های منقضی شده
+    """
+    from django.db.models import Q
+    from core.storage import s3_service
+
+    cutoff = timezone.now() - retention
+    stale = ConversationExport.objects.filter(
+        Q(status='completed', completed_at__lt=cutoff) |
+        Q(status__in=('failed', 'pending', 'processing'), updated_at__lt=cutoff)
+    ).order_by('id')
+
+    expired = 0
+    last_id = None
+    while True:
+        batch = stale if last_id is None else stale.filter(id__gt=last_id)
+        exports = list(batch.only('id', 'user_id', 'object_key', 'part_count')[:batch_size])
+        if not exports:
+            break
+        last_id = exports[-1].id
+
+        keys = {export.id: _export_keys(export) for export in exports}
+        failed = set(s3_service.delete_files(k for export_keys in keys.values() for k in export_keys)['errors'])
+        done = [export_id for export_id, export_keys in keys.items() if not failed.intersection(export_keys)]
+
+        expired += ConversationExport.objects.filter(id__in=done).update(
+            status='expired',
+            object_key='',
+            part_count=0,
+            last_conversation_id=None,
+            updated_at=timezone.now()
+        )
+
+    if expired:
+        logger.info(f"Expired {expired} conversation exports")
+    return expired
@@ -0,0 +1,152 @@
+"""
+پشتیبانی از Idempotency-Key برای ارسال سوال
+درخواست‌های تکراری با کلید یکسان (مثلاً retry کلاینت موبایل) دوباره اجرا نمی‌شوند:
+نتیجه ذخیره شده برگردانده می‌شود یا منتظر درخواست در حال اجرا می‌مانند.
+
+وضعیت هر کلید در cache (Redis):
+- processing: درخواست اول در حال اجراست (TTL کوتاه تا در صورت از کار افتادن process آزاد شود)
+- done: نتیجه موفق ذخیره شده است (IDEMPOTENCY_TTL)
+درخواست‌های ناموفق کلید را آزاد می‌کنند تا retry دوباره اجرا شود.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# نتیجه acquire
+EXECUTE = 'execute'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+
+
+class IdempotencyKeyReused(Exception):
+    """کلید قبلاً برای درخواستی با محتوای متفاوت استفاده شده است"""
+
+
+def is_valid_key(key):
+    return bool(key) and len(key) <= MAX_KEY_LENGTH
+
+
+def fingerprint(*parts):
+    """اثر انگشت محتوای درخواست برای تشخیص استفاده مجدد از کلید"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _cache_key(user_id, key):
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return f'idempotency:{user_id}:{digest}'
+
+
+def _claim(user_id, key, request_fingerprint):
+    """
+    تلاش برای گرفتن کلید
+
+    Returns:
+        None اگر کلید گرفته شد (درخواست باید اجرا شود)، در غیر این صورت رکورد موجود
+    """
+    cache_key = _cache_key(user_id, key)
+    record = {'state': 'processing', 'fingerprint': request_fingerprint}
+    if cache.add(cache_key, record, settings.IDEMPOTENCY_PROCESSING_TTL):
+        return None
+    existing = cache.get(cache_key)
+    if existing is None:
+        # همزمان منقضی یا آزاد شد
+        return None if cache.add(cache_key, record, settings.IDEMPOTENCY_PROCESSING_TTL) else cache.get(cache_key)
+    if existing['fingerprint'] != request_fingerprint:
+        raise IdempotencyKeyReused(key)
+    return existing
+
+
+def _get(user_id, key):
+    return cache.get(_cache_key(user_id, key))
+
+
+def has_record(user_id, key):
+    """
+    آیا برای این کلید درخواستی در حال اجرا یا نتیجه ذخیره شده وجود دارد؟
+
+    SubscriptionMiddleware برای چنین retry هایی سهمیه را بررسی نمی‌کند تا
+    پاسخ ذخیره شده (حتی برای درخواستی که آخرین سهمیه را مصرف کرده) برگردد.
+    """
+    if not is_valid_key(key):
+        return False
+    try:
+        return _get(user_id, key) is not None
+    except Exception as e:
+        logger.warning(f"Idempotency store unavailable: {e}")
+        return False
+
+
+def complete(user_id, key, request_fingerprint, status_code, body):
+    """ذخیره نتیجه موفق برای پاسخ به retry ها"""
+    cache.set(
+        _cache_key(user_id, key),
+        {'state': 'done', 'fingerprint': request_fingerprint, 'status': status_code, 'body': body},
+        settings.IDEMPOTENCY_TTL
+    )
+
+
+def release(user_id, key):
+    """آزادسازی کلید پس از خطا تا retry دوباره اجرا شود"""
+    cache.delete(_cache_key(user_id, key))
+
+
+async def acquire(user_id, key, request_fingerprint):
+    """
+    تصمیم‌گیری برای درخواست با Idempotency-Key
+
+    اگر درخواستی با همین کلید در حال اجرا باشد تا IDEMPOTENCY_WAIT_TIMEOUT منتظر
+    نتیجه آن می‌ماند؛ اگر آن درخواست ناموفق شود، این درخواست اجرا می‌شود.
+
+    Returns:
+        (EXECUTE, None) | (REPLAY, record) | (IN_PROGRESS, None)
+
+    Raises:
+        IdempotencyKeyReused: کلید با محتوای متفاوت استفاده شده است
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    claim = sync_to_async(_claim, thread_sensitive=False)
+    get = sync_to_async(_get, thread_sensitive=False)
+
+    try:
+        record = await claim(user_id, key, request_fingerprint)
+        while record is not None:
+            if record['state'] == 'done':
+                return REPLAY, record
+            if loop.time() >= deadline:
+                return IN_PROGRESS, None
+            await asyncio.sleep(0.25)
+            record = await get(user_id, key)
+            if record is None:
+                record = await claim(user_id, key, request_fingerprint)
+    except IdempotencyKeyReused:
+        raise
+    except Exception as e:
+        # cache در دسترس نیست: بدون idempotency ادامه می‌دهیم
+        logger.warning(f"Idempotency store unavailable: {e}")
+    return EXECUTE, None
+
+
+async def finish(user_id, key, request_fingerprint, status_code=None, body=None):
+    """ذخیره نتیجه موفق، یا آزادسازی کلید در صورت خطا (status_code=None)"""
+    try:
+        if status_code is None:
+            await sync_to_async(release, thread_sensitive=False)(user_id, key)
+        else:
+            await sync_to_async(complete, thread_sensitive=False)(
+                user_id, key, request_fingerprint, status_code, body
+            )
+    except Exception as e:
+        logger.warning(f"Idempotency store unavailable: {e}")
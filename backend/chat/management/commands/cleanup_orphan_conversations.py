@@ -1,17 +1,63 @@
 """
 Management command to cleanup orphan conversations in Core RAG
+
+گفتگوهای هر کاربر در Core (core_service.get_conversations، صفحه به صفحه) با
+rag_conversation_id های محلی مقایسه می‌شوند و گفتگوهای Core که در دیتابیس محلی
+وجود ندارند حذف می‌شوند. کاربران به صورت دسته‌ای و همزمان پردازش می‌شوند؛
+همه فراخوانی‌های Core زیر یک asyncio.Semaphore و محدودیت نرخ مشترک انجام
+می‌شوند و پس از هر دسته checkpoint ذخیره می‌شود (--resume).
+
+کاربری که دریافت گفتگوهایش از Core با خطا مواجه شود (هر صفحه) reconcile شده
+حساب نمی‌شود؛ در checkpoint (failed_user_ids) می‌ماند و --resume ابتدا او را
+دوباره پردازش می‌کند.
 """
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
 import asyncio
-from rest_framework_simplejwt.tokens import RefreshToken
+import json
+import os
+import time
+from datetime import timedelta, timezone as dt_timezone
 
-from chat.models import Conversation
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.tokens import get_core_access_token
 from chat.core_service import core_service
+from chat.models import Conversation
 
 User = get_user_model()
 
 
+class RateLimiter:
+    """حداکثر rate فراخوانی در ثانیه (مشترک بین همه task ها)"""
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_slot > now:
+                await asyncio.sleep(self.next_slot - now)
+                now = self.next_slot
+            self.next_slot = now + self.interval
+
+
+def _items(page):
+    """لیست گفتگوها از پاسخ Core (لیست یا dict صفحه‌بندی شده)"""
+    if isinstance(page, dict):
+        for key in ('results', 'conversations', 'items'):
+            if isinstance(page.get(key), list):
+                return page[key]
+        return []
+    return page or []
+
+
 class Command(BaseCommand):
     help = 'Cleanup orphan conversations that exist in Core but not in local DB'
     
@@ -21,78 +67,218 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be deleted without actually deleting',
         )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help='Maximum concurrent requests to Core (default: 10)',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=20.0,
+            help='Maximum requests per second to Core, 0 for unlimited (default: 20)',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Conversations fetched from Core per request (default: 100)',
+        )
+        parser.add_argument(
+            '--user-batch',
+            type=int,
+            default=100,
+            help='Users reconciled concurrently between checkpoints (default: 100)',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Skip Core conversations created in the last N minutes (default: 60)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='cleanup_orphan_conversations.checkpoint.json',
+            help='Checkpoint file path',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Retry failed users and continue after the last user recorded in the checkpoint file',
+        )
     
     def handle(self, *args, **options):
+        self.options = options
         dry_run = options['dry_run']
         
         if dry_run:
             self.stdout.write(self.style.WARNING('🔍 DRY RUN MODE - No actual deletions will occur'))
         
-        self.stdout.write('Finding conversations with rag_conversation_id...')
+        stats = {'users': 0, 'remote': 0, 'orphans': 0, 'deleted': 0, 'errors': 0}
+        last_user_id = None
+        failed = []
+        if options['resume']:
+            checkpoint = self.load_checkpoint()
+            if checkpoint:
+                last_user_id = checkpoint['last_user_id']
+                failed = checkpoint.get('failed_user_ids', [])
+                stats.update(checkpoint['stats'])
+                self.stdout.write(f'Resuming after user {last_user_id}')
         
-        # پیدا کردن تمام conversation هایی که rag_conversation_id دارند
-        conversations = Conversation.objects.exclude(rag_conversation_id='').exclude(rag_conversation_id__isnull=True)
+        users = User.objects.order_by('id')
+        if failed:
+            self.stdout.write(f'Retrying {len(failed)} users that failed in the previous run')
+            failed = self.reconcile_users(list(users.filter(id__in=failed)), stats)
+            self.save_checkpoint(last_user_id, stats, failed)
         
-        self.stdout.write(f'Found {conversations.count()} conversations with RAG IDs')
-        
-        deleted_count = 0
-        error_count = 0
-        
-        for conv in conversations:
-            try:
-                # تولید token برای کاربر
-                refresh = RefreshToken.for_user(conv.user)
-                access_token = str(refresh.access_token)
-                
-                # حذف از Core
-                loop = asyncio.get_event_loop()
-                success = loop.run_until_complete(
-                    core_service.delete_conversation(
-                        conversation_id=conv.rag_conversation_id,
-                        token=access_token
-                    )
-                )
-                
-                if success:
-                    if dry_run:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f'  [DRY RUN] Would delete: {conv.rag_conversation_id} ({conv.title})'
-                            )
-                        )
-                    else:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f'  ✓ Deleted from Core: {conv.rag_conversation_id} ({conv.title})'
-                            )
-                        )
-                    deleted_count += 1
-                else:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'  ✗ Failed: {conv.rag_conversation_id} ({conv.title})'
-                        )
-                    )
-                    error_count += 1
-                    
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'  ✗ Error for {conv.rag_conversation_id}: {e}'
-                    )
-                )
-                error_count += 1
+        while True:
+            batch = users
+            if last_user_id is not None:
+                batch = batch.filter(id__gt=last_user_id)
+            batch = list(batch[:options['user_batch']])
+            if not batch:
+                break
+            
+            failed += self.reconcile_users(batch, stats)
+            last_user_id = str(batch[-1].id)
+            self.save_checkpoint(last_user_id, stats, failed)
+            self.stdout.write(
+                f"  users: {stats['users']}, remote: {stats['remote']}, orphans: {stats['orphans']}, "
+                f"deleted: {stats['deleted']}, errors: {stats['errors']}"
+            )
         
         self.stdout.write('')
         if dry_run:
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'DRY RUN: Would delete {deleted_count} conversations, {error_count} errors'
+                    f"DRY RUN: Would delete {stats['orphans']} conversations, {stats['errors']} errors"
                 )
             )
         else:
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Done! Deleted {deleted_count} conversations, {error_count} errors'
+                    f"Done! Deleted {stats['deleted']} conversations, {stats['errors']} errors"
                 )
             )
+        
+        if failed:
+            # checkpoint باقی می‌ماند تا --resume فقط کاربران ناموفق را دوباره پردازش کند
+            self.stdout.write(self.style.WARNING(
+                f"{len(failed)} users could not be fetched from Core; run again with --resume to retry them"
+            ))
+        elif os.path.exists(options['checkpoint']):
+            # اجرای کامل؛ اجرای بعدی از ابتدا شروع می‌شود
+            os.remove(options['checkpoint'])
+    
+    def reconcile_users(self, users, stats):
+        """
+        مقایسه و حذف orphan ها برای یک دسته کاربر
+        
+        Returns:
+            شناسه کاربرانی که پردازش آن‌ها با خطا متوقف شد
+        """
+        # مجموعه محلی با یک query (شامل گفتگوهای در صف حذف که هنوز حذف نهایی نشده‌اند)
+        local_ids = {user.id: set() for user in users}
+        rows = Conversation.all_objects.filter(
+            user_id__in=list(local_ids)
+        ).exclude(rag_conversation_id='').values_list('user_id', 'rag_conversation_id')
+        for user_id, rag_id in rows:
+            local_ids[user_id].add(str(rag_id))
+        
+        tokens = {user.id: get_core_access_token(user) for user in users}
+        results = asyncio.run(self.reconcile_async(users, tokens, local_ids))
+        
+        failed = []
+        for user, result in zip(users, results):
+            if isinstance(result, Exception):
+                stats['errors'] += 1
+                failed.append(str(user.id))
+                self.stdout.write(self.style.ERROR(f'  ✗ Error ({user.pk}): {result or result.__class__.__name__}'))
+                continue
+            for key, value in result.items():
+                stats[key] += value
+        return failed
+    
+    async def reconcile_async(self, users, tokens, local_ids):
+        self.semaphore = asyncio.Semaphore(self.options['concurrency'])
+        self.limiter = RateLimiter(self.options['rate'])
+        # هر دسته کاربر loop جداگانه (asyncio.run) دارد؛ client های Core آن در پایان دسته بسته می‌شوند
+        async with core_service.loop_scope():
+            return await asyncio.gather(
+                *(self.reconcile_user(user, tokens[user.id], local_ids[user.id]) for user in users),
+                return_exceptions=True
+            )
+    
+    async def call_core(self, coroutine_function, **kwargs):
+        async with self.semaphore:
+            await self.limiter.wait()
+            return await coroutine_function(**kwargs)
+    
+    async def reconcile_user(self, user, token, local_ids):
+        remote = await self.fetch_remote(token)
+        orphans = [
+            conversation_id for conversation_id, created_at in remote.items()
+            if conversation_id not in local_ids and not self.is_recent(created_at)
+        ]
+        
+        result = {'users': 1, 'remote': len(remote), 'orphans': len(orphans), 'deleted': 0, 'errors': 0}
+        if self.options['dry_run']:
+            for conversation_id in orphans:
+                self.stdout.write(self.style.SUCCESS(f'  [DRY RUN] Would delete: {conversation_id} ({user.pk})'))
+            return result
+        
+        deleted = await asyncio.gather(*(
+            self.call_core(core_service.delete_conversation, conversation_id=conversation_id, token=token)
+            for conversation_id in orphans
+        ), return_exceptions=True)
+        for conversation_id, success in zip(orphans, deleted):
+            if success is True:
+                result['deleted'] += 1
+                self.stdout.write(self.style.SUCCESS(f'  ✓ Deleted from Core: {conversation_id} ({user.pk})'))
+            else:
+                result['errors'] += 1
+                self.stdout.write(self.style.ERROR(f'  ✗ Failed: {conversation_id} ({user.pk})'))
+        return result
+    
+    async def fetch_remote(self, token):
+        """همه گفتگوهای کاربر در Core: {id: created_at}"""
+        page_size = self.options['page_size']
+        remote = {}
+        offset = 0
+        while True:
+            # خطای هر صفحه raise می‌شود؛ لیست خالی به معنای پایان صفحه‌ها است
+            page = _items(await self.call_core(
+                core_service.get_conversations, token=token, limit=page_size, offset=offset, raise_errors=True
+            ))
+            for item in page:
+                if item.get('id'):
+                    remote[str(item['id'])] = item.get('created_at')
+            if len(page) < page_size:
+                return remote
+            offset += page_size
+    
+    def is_recent(self, created_at):
+        """گفتگوی تازه Core ممکن است هنوز rag_conversation_id محلی نداشته باشد"""
+        if not created_at or not self.options['min_age']:
+            return False
+        created = parse_datetime(str(created_at))
+        if created is None:
+            return False
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created, dt_timezone.utc)
+        return created > timezone.now() - timedelta(minutes=self.options['min_age'])
+    
+    def load_checkpoint(self):
+        try:
+            with open(self.options['checkpoint']) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            self.stdout.write(self.style.WARNING('No checkpoint found, starting from the beginning'))
+            return None
+    
+    def save_checkpoint(self, last_user_id, stats, failed_user_ids):
+        path = self.options['checkpoint']
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'last_user_id': last_user_id, 'stats': stats, 'failed_user_ids': failed_user_ids}, f)
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,80 @@
+"""
+Management command to backfill full-text search vectors for conversations and messages
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.models import Conversation, Message
+from chat.search import conversation_vector_from_columns, message_vector_from_columns
+
+
+class Command(BaseCommand):
+    help = 'Backfill search_vector for conversations and messages (incremental, in batches)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows updated per UPDATE statement (default: 1000)',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute vectors for all rows, not only rows without a vector',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.0,
+            help='Seconds to pause between batches to limit database load',
+        )
+        parser.add_argument(
+            '--only',
+            choices=['conversations', 'messages'],
+            help='Backfill only one table',
+        )
+
+    def handle(self, *args, **options):
+        targets = [
+            ('conversations', Conversation, conversation_vector_from_columns),
+            ('messages', Message, message_vector_from_columns),
+        ]
+        for name, model, vector in targets:
+            if options['only'] and options['only'] != name:
+                continue
+            updated = self.backfill(name, model, vector, options)
+            self.stdout.write(self.style.SUCCESS(f'✅ {name}: {updated} rows updated'))
+
+    def backfill(self, name, model, vector, options):
+        """
+        به‌روزرسانی دسته‌ای به ترتیب id (keyset)؛ در صورت توقف، اجرای مجدد
+        بدون --rebuild از ردیف‌های باقی‌مانده ادامه می‌دهد
+        """
+        queryset = model.objects.all()
+        if not options['rebuild']:
+            queryset = queryset.filter(search_vector__isnull=True)
+
+        total = queryset.count()
+        self.stdout.write(f'{name}: {total} rows to index')
+
+        updated = 0
+        last_id = None
+        while True:
+            batch = queryset.order_by('id')
+            if last_id is not None:
+                batch = batch.filter(id__gt=last_id)
+            ids = list(batch.values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+
+            # vector در خود PostgreSQL از روی ستون‌ها ساخته می‌شود (بدون انتقال محتوا)
+            updated += model.objects.filter(id__in=ids).update(search_vector=vector())
+            last_id = ids[-1]
+            self.stdout.write(f'  {name}: {updated}/{total}')
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        return updated
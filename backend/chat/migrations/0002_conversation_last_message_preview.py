@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-17
+
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Value, When
+from django.db.models.functions import Concat, Left, Length
+
+
+def populate_last_message_preview(apps, schema_editor):
+    """پر کردن پیش‌نمایش آخرین پیام برای گفتگوهای موجود"""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    last_messages = Message.objects.filter(
+        conversation=OuterRef('pk')
+    ).order_by('-created_at')
+    preview = Case(
+        When(content_length__gt=100, then=Concat(Left('content', 100), Value('...'))),
+        default='content',
+        output_field=models.CharField()
+    )
+
+    Conversation.objects.filter(messages__isnull=False).update(
+        last_message_role=Subquery(last_messages.values('role')[:1]),
+        last_message_preview=Subquery(
+            last_messages.annotate(content_length=Length('content')).annotate(
+                preview=preview
+            ).values('preview')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=103),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_role',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.RunPython(populate_last_message_preview, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:09
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_last_message_at(apps, schema_editor):
+    """گفتگوهای بدون last_message_at: زمان ایجاد (برای ترتیب پایدار در صفحه‌بندی cursor)"""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Conversation.objects.filter(last_message_at__isnull=True).update(last_message_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.RunPython(fill_last_message_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0004_conversation_last_message_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationExport',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('format', models.CharField(choices=[('both', 'JSONL و Markdown'), ('jsonl', 'JSONL'), ('markdown', 'Markdown')], default='both', max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'در صف'), ('processing', 'در حال ساخت'), ('completed', 'آماده'), ('failed', 'خطا')], default='pending', max_length=20)),
+                ('total_conversations', models.IntegerField(default=0)),
+                ('processed_conversations', models.IntegerField(default=0)),
+                ('last_conversation_id', models.UUIDField(blank=True, null=True)),
+                ('part_count', models.IntegerField(default=0)),
+                ('object_key', models.CharField(blank=True, max_length=500)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_exports', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'خروجی گفتگوها',
+                'verbose_name_plural': 'خروجی\u200cهای گفتگوها',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='chat_conver_user_id_a1fbf5_idx')],
+            },
+        ),
+    ]
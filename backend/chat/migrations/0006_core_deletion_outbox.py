@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0005_conversation_export'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CoreDeletion',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('conversation_id', models.UUIDField()),
+                ('rag_conversation_id', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'در انتظار'), ('processing', 'در حال پردازش'), ('failed', 'خطا')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='core_deletions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'حذف از Core',
+                'verbose_name_plural': 'حذف\u200cها از Core',
+                'ordering': ['next_attempt_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='chat_corede_status_5b3dbc_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_core_deletion_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('scope', models.CharField(max_length=64)),
+                ('sha256', models.CharField(max_length=64)),
+                ('object_key', models.CharField(max_length=500, unique=True)),
+                ('size_bytes', models.BigIntegerField()),
+                ('content_type', models.CharField(max_length=200)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'فایل ذخیره شده',
+                'verbose_name_plural': 'فایل\u200cهای ذخیره شده',
+                'indexes': [models.Index(fields=['ref_count', 'last_used_at'], name='chat_attach_ref_cou_a8e5a7_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='attachmentblob',
+            constraint=models.UniqueConstraint(fields=('scope', 'sha256'), name='unique_blob_per_scope'),
+        ),
+    ]
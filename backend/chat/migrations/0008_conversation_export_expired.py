@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_attachment_blob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversationexport',
+            name='status',
+            field=models.CharField(choices=[('pending', 'در صف'), ('processing', 'در حال ساخت'), ('completed', 'آماده'), ('failed', 'خطا'), ('expired', 'منقضی شده')], default='pending', max_length=20),
+        ),
+    ]
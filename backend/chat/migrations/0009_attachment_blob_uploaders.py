@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0008_conversation_export_expired'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachmentblob',
+            name='uploaders',
+            field=models.ManyToManyField(blank=True, related_name='attachment_blobs', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -7,6 +9,16 @@ import json
 
 User = get_user_model()
 
+# حداکثر طول پیش‌نمایش آخرین پیام در لیست گفتگوها
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+
+class LiveConversationManager(models.Manager):
+    """گفتگوهای حذف نشده (بدون tombstone)"""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class Conversation(models.Model):
     """محلی conversation tracking که با RAG Core همگام می‌شود"""
@@ -45,23 +57,46 @@ class Conversation(models.Model):
     # آمار
     message_count = models.IntegerField(default=0)
     token_usage = models.IntegerField(default=0)
-    last_message_at = models.DateTimeField(null=True, blank=True)
+    # مقدار اولیه زمان ایجاد است تا ترتیب (و صفحه‌بندی cursor) لیست گفتگوها بدون NULL باشد
+    last_message_at = models.DateTimeField(default=timezone.now, null=True, blank=True)
+    
+    # پیش‌نمایش آخرین پیام (برای لیست گفتگوها، توسط chat.turns به‌روز می‌شود)
+    last_message_role = models.CharField(max_length=20, blank=True)
+    last_message_preview = models.CharField(max_length=LAST_MESSAGE_PREVIEW_LENGTH + 3, blank=True)
+    
+    # جستجوی متن کامل روی عنوان و توضیحات (chat.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    # tombstone: گفتگوی حذف شده تا حذف از Core و حذف نهایی (chat.deletions) پنهان است
+    deleted_at = models.DateTimeField(null=True, blank=True)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = LiveConversationManager()
+    all_objects = models.Manager()
+    
     class Meta:
         ordering = ['-last_message_at', '-created_at']
         indexes = [
             models.Index(fields=['user', '-last_message_at']),
             models.Index(fields=['rag_conversation_id']),
+            GinIndex(fields=['search_vector'], name='chat_conversation_search_gin'),
         ]
         verbose_name = _('گفتگو')
         verbose_name_plural = _('گفتگوها')
     
     def __str__(self):
         return f"{self.title} - {self.user.email}"
+    
+    @staticmethod
+    def make_preview(content):
+        """متن کوتاه شده پیام برای last_message_preview"""
+        content = content or ''
+        if len(content) > LAST_MESSAGE_PREVIEW_LENGTH:
+            return content[:LAST_MESSAGE_PREVIEW_LENGTH] + '...'
+        return content
 
 
 class Message(models.Model):
@@ -113,6 +148,9 @@ class Message(models.Model):
     model_used = models.CharField(max_length=50, blank=True)
     cached = models.BooleanField(default=False)
     
+    # جستجوی متن کامل روی محتوا (chat.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     # بازخورد کاربر
     rating = models.IntegerField(null=True, blank=True)  # 1-5
     feedback_type = models.CharField(max_length=50, blank=True)
@@ -127,6 +165,7 @@ class Message(models.Model):
         indexes = [
             models.Index(fields=['conversation', 'created_at']),
             models.Index(fields=['rag_message_id']),
+            GinIndex(fields=['search_vector'], name='chat_message_search_gin'),
         ]
         verbose_name = _('پیام')
         verbose_name_plural = _('پیام‌ها')
@@ -270,3 +309,145 @@ class MessageAttachment(models.Model):
     
     def __str__(self):
         return f"{self.file_name} - {self.message.id}"
+
+
+class ConversationExport(models.Model):
+    """
+    خروجی ZIP همه گفتگوهای کاربر (ساخته شده در پس‌زمینه، chat.exports)
+    
+    پیشرفت پس از هر دسته گفتگو ثبت می‌شود (last_conversation_id) تا اجرای
+    مجدد تسک از همان نقطه ادامه دهد.
+    """
+    STATUS_CHOICES = [
+        ('pending', _('در صف')),
+        ('processing', _('در حال ساخت')),
+        ('completed', _('آماده')),
+        ('failed', _('خطا')),
+        ('expired', _('منقضی شده')),
+    ]
+    
+    FORMAT_CHOICES = [
+        ('both', _('JSONL و Markdown')),
+        ('jsonl', _('JSONL')),
+        ('markdown', _('Markdown')),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_exports')
+    format = models.CharField(max_length=20, choices=FORMAT_CHOICES, default='both')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    # پیشرفت (keyset روی id گفتگو)
+    total_conversations = models.IntegerField(default=0)
+    processed_conversations = models.IntegerField(default=0)
+    last_conversation_id = models.UUIDField(null=True, blank=True)
+    part_count = models.IntegerField(default=0)  # بخش‌های ZIP آپلود شده در MinIO
+    
+    # فایل نهایی
+    object_key = models.CharField(max_length=500, blank=True)
+    file_size = models.BigIntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+        verbose_name = _('خروجی گفتگوها')
+        verbose_name_plural = _('خروجی‌های گفتگوها')
+    
+    @property
+    def progress(self):
+        """درصد پیشرفت"""
+        if self.status == 'completed':
+            return 100
+        if not self.total_conversations:
+            return 0
+        return min(99, int(self.processed_conversations * 100 / self.total_conversations))
+    
+    def __str__(self):
+        return f"Export {self.id} - {self.user} ({self.status})"
+
+
+class AttachmentBlob(models.Model):
+    """
+    فایل پیوست ذخیره شده بر اساس محتوا (SHA-256) در MinIO
+    
+    محتوای یکسان برای هر کاربر یا سازمان (scope) یک بار ذخیره می‌شود. ref_count
+    تعداد MessageAttachment هایی است که به object_key ارجاع می‌دهند؛ فایل‌های بدون
+    ارجاع پس از مهلت توسط cleanup_old_files حذف می‌شوند (chat.blobs).
+    """
+    id = models.BigAutoField(primary_key=True)
+    scope = models.CharField(max_length=64)  # users/<id> یا orgs/<id>
+    sha256 = models.CharField(max_length=64)
+    object_key = models.CharField(max_length=500, unique=True)
+    size_bytes = models.BigIntegerField()
+    content_type = models.CharField(max_length=200)
+    
+    ref_count = models.IntegerField(default=0)
+    # کاربرانی که محتوا را واقعاً آپلود کرده‌اند؛ پرسش با hash (upload/check/) فقط برای آن‌ها
+    # فایل را برمی‌گرداند (دانستن hash و اندازه دسترسی به فایل سایر اعضای سازمان نمی‌دهد)
+    uploaders = models.ManyToManyField(User, related_name='attachment_blobs', blank=True)
+    # آخرین آپلود/استفاده؛ فایل بدون ارجاع تا مهلت نگهداری حذف نمی‌شود
+    last_used_at = models.DateTimeField(default=timezone.now)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'sha256'], name='unique_blob_per_scope'),
+        ]
+        indexes = [
+            models.Index(fields=['ref_count', 'last_used_at']),
+        ]
+        verbose_name = _('فایل ذخیره شده')
+        verbose_name_plural = _('فایل‌های ذخیره شده')
+    
+    def __str__(self):
+        return f"{self.scope}/{self.sha256[:12]} ({self.ref_count} refs)"
+
+
+class CoreDeletion(models.Model):
+    """
+    صف (outbox) حذف گفتگوها از RAG Core
+    
+    در همان تراکنش علامت‌گذاری حذف گفتگو ثبت می‌شود و worker آن را با
+    همزمانی محدود و تلاش مجدد اجرا می‌کند (chat.deletions).
+    """
+    STATUS_CHOICES = [
+        ('pending', _('در انتظار')),
+        ('processing', _('در حال پردازش')),
+        ('failed', _('خطا')),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='core_deletions')
+    # گفتگوی محلی (پس از حذف از Core به صورت نهایی حذف می‌شود)
+    conversation_id = models.UUIDField()
+    rag_conversation_id = models.CharField(max_length=255, blank=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        verbose_name = _('حذف از Core')
+        verbose_name_plural = _('حذف‌ها از Core')
+    
+    def __str__(self):
+        return f"Core deletion {self.conversation_id} ({self.status})"
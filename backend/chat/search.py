@@ -0,0 +1,120 @@
+"""
+جستجوی متن کامل (PostgreSQL full-text search) در گفتگوها و پیام‌ها
+
+- ستون search_vector روی Message (محتوا) و Conversation (عنوان با وزن A، توضیحات با وزن B)
+  با GIN index؛ در مسیر ذخیره (chat.turns) و با دستور rebuild_search_vectors پر می‌شود
+- متن قبل از ساخت vector و query نرمال می‌شود (ي/ی، ك/ک، نیم‌فاصله، ارقام فارسی، اعراب)
+- پیکربندی 'simple' (بدون stemming) چون PostgreSQL پیکربندی فارسی ندارد؛
+  جستجو بر اساس پیشوند کلمات است (مناسب جستجوی همزمان با تایپ)
+"""
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db.models import Exists, F, FloatField, Func, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce, Greatest, Left, Lower
+
+from core.utils import normalize_persian_text, persian_translate_args
+from .models import Message
+
+SEARCH_CONFIG = 'simple'
+
+# محدودیت اندازه tsvector در PostgreSQL یک مگابایت است
+MAX_INDEXED_CHARS = 100000
+MAX_QUERY_TERMS = 10
+
+_TERM_RE = re.compile(r'\w+')
+
+
+def _normalize(text):
+    return normalize_persian_text(text)[:MAX_INDEXED_CHARS]
+
+
+def _normalized_column(column):
+    """معادل SQL نرمال‌سازی برای یک ستون (برای backfill و snippet)"""
+    from_chars, to_chars = persian_translate_args()
+    return Lower(Func(
+        Left(column, MAX_INDEXED_CHARS), Value(from_chars), Value(to_chars),
+        function='translate',
+        output_field=TextField()
+    ))
+
+
+def message_vector(content):
+    """expression مقدار search_vector برای پیام جدید"""
+    return SearchVector(Value(_normalize(content)), config=SEARCH_CONFIG)
+
+
+def conversation_vector(title, description=''):
+    """expression مقدار search_vector برای گفتگو"""
+    return (
+        SearchVector(Value(_normalize(title)), weight='A', config=SEARCH_CONFIG) +
+        SearchVector(Value(_normalize(description)), weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def message_vector_from_columns():
+    """search_vector پیام از روی ستون‌های خود ردیف (برای update های دسته‌ای)"""
+    return SearchVector(_normalized_column('content'), config=SEARCH_CONFIG)
+
+
+def conversation_vector_from_columns():
+    """search_vector گفتگو از روی ستون‌های خود ردیف (برای update های دسته‌ای)"""
+    return (
+        SearchVector(_normalized_column('title'), weight='A', config=SEARCH_CONFIG) +
+        SearchVector(_normalized_column('description'), weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def build_query(text):
+    """
+    تبدیل متن جستجوی کاربر به tsquery (همه کلمات، تطبیق پیشوندی)
+
+    Returns:
+        SearchQuery یا None اگر کلمه قابل جستجویی وجود نداشته باشد
+    """
+    terms = _TERM_RE.findall(normalize_persian_text(text))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return SearchQuery(
+        ' & '.join(f'{term}:*' for term in terms),
+        config=SEARCH_CONFIG,
+        search_type='raw'
+    )
+
+
+def search_conversations(queryset, text):
+    """
+    فیلتر و رتبه‌بندی گفتگوها بر اساس عنوان/توضیحات و محتوای پیام‌ها
+
+    هر گفتگو annotate می‌شود با:
+    - search_rank: بیشترین رتبه بین عنوان و بهترین پیام منطبق
+    - search_snippet: بخشی از بهترین پیام منطبق با کلمات مشخص شده با <mark>
+    """
+    query = build_query(text)
+    if query is None:
+        return queryset.none()
+
+    matching_messages = Message.objects.filter(conversation=OuterRef('pk'), search_vector=query)
+    best_message = matching_messages.annotate(
+        rank=SearchRank(F('search_vector'), query)
+    ).order_by('-rank', '-created_at')
+    snippet = SearchHeadline(
+        _normalized_column('content'),
+        query,
+        config=SEARCH_CONFIG,
+        start_sel='<mark>',
+        stop_sel='</mark>',
+        max_words=30,
+        min_words=10,
+        max_fragments=2
+    )
+
+    return queryset.filter(
+        Q(search_vector=query) | Q(Exists(matching_messages))
+    ).annotate(
+        search_rank=Greatest(
+            Coalesce(SearchRank(F('search_vector'), query), Value(0.0), output_field=FloatField()),
+            Coalesce(Subquery(best_message.values('rank')[:1]), Value(0.0), output_field=FloatField())
+        ),
+        search_snippet=Subquery(best_message.annotate(snippet=snippet).values('snippet')[:1])
+    ).order_by('-search_rank', '-last_message_at')
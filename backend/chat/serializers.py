@@ -5,7 +5,7 @@ from rest_framework import serializers
 from django.utils.translation import gettext_lazy as _
 from .models import (
     Conversation, Message, ConversationFolder, 
-    ChatTemplate, SharedConversation, MessageAttachment
+    ChatTemplate, SharedConversation, MessageAttachment, ConversationExport
 )
 
 
@@ -22,9 +22,21 @@ class MessageAttachmentSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'thumbnail', 'extracted_text', 'extraction_status']
 
 
+# فیلدهای حجیم پیام که در حالت سبک فقط با ?expand=... برگردانده می‌شوند
+MESSAGE_HEAVY_FIELDS = ('sources', 'chunks', 'file_analysis')
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    """Serializer برای پیام‌ها"""
+    """
+    Serializer برای پیام‌ها
+    
+    بدون context['expand'] خروجی کامل قبلی برگردانده می‌شود. در حالت سبک
+    (context['expand'] یک set است) فیلدهای MESSAGE_HEAVY_FIELDS فقط در صورت
+    درخواست اضافه می‌شوند و context['fields'] فیلدهای خروجی را محدود می‌کند.
+    """
     attachments = MessageAttachmentSerializer(many=True, read_only=True)
+    file_analysis = serializers.SerializerMethodField()
+    sources_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
@@ -33,19 +45,52 @@ class MessageSerializer(serializers.ModelSerializer):
             'response_mode', 'sources', 'chunks', 'status', 'error_message',
             'tokens', 'processing_time_ms', 'model_used', 'cached',
             'rating', 'feedback_type', 'feedback_text',
-            'attachments', 'created_at', 'updated_at'
+            'attachments', 'file_analysis', 'sources_count',
+            'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'rag_message_id', 'sources', 'chunks', 'status',
             'error_message', 'tokens', 'processing_time_ms', 'model_used',
             'cached', 'created_at', 'updated_at'
         ]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get('expand')
+        if expand is None:
+            # خروجی کامل (سازگار با کلاینت‌های قبلی)
+            self.fields.pop('file_analysis')
+            self.fields.pop('sources_count')
+            return
+        
+        for name in MESSAGE_HEAVY_FIELDS:
+            if name not in expand:
+                self.fields.pop(name)
+        
+        only = self.context.get('fields')
+        if only:
+            for name in list(self.fields):
+                if name != 'id' and name not in only and name not in expand:
+                    self.fields.pop(name)
+    
+    def get_file_analysis(self, obj):
+        """نتیجه تحلیل فایل ذخیره شده در metadata"""
+        return (obj.metadata or {}).get('file_analysis')
+    
+    def get_sources_count(self, obj):
+        """تعداد منابع (برای نمایش دکمه بارگذاری منابع بدون دریافت خود منابع)"""
+        count = getattr(obj, 'sources_count', None)
+        if count is None:
+            count = len(obj.sources or [])
+        return count
 
 
 class ConversationSerializer(serializers.ModelSerializer):
     """Serializer برای گفتگوها"""
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
+    search_rank = serializers.SerializerMethodField()
+    search_snippet = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
@@ -54,7 +99,8 @@ class ConversationSerializer(serializers.ModelSerializer):
             'description', 'tags', 'default_response_mode', 'folder',
             'is_pinned', 'is_archived', 'is_shared', 'share_token',
             'message_count', 'token_usage', 'last_message_at',
-            'last_message', 'unread_count', 'created_at', 'updated_at'
+            'last_message', 'unread_count', 'search_rank', 'search_snippet',
+            'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'user', 'organization', 'rag_conversation_id',
@@ -63,15 +109,22 @@ class ConversationSerializer(serializers.ModelSerializer):
         ]
     
     def get_last_message(self, obj):
-        """دریافت آخرین پیام گفتگو"""
-        last_msg = obj.messages.order_by('-created_at').first()
-        if last_msg:
-            return {
-                'role': last_msg.role,
-                'content': last_msg.content[:100] + '...' if len(last_msg.content) > 100 else last_msg.content,
-                'created_at': last_msg.created_at
-            }
-        return None
+        """آخرین پیام گفتگو (پیش‌نمایش ذخیره شده روی conversation، بدون query اضافه)"""
+        if not obj.last_message_role:
+            return None
+        return {
+            'role': obj.last_message_role,
+            'content': obj.last_message_preview,
+            'created_at': obj.last_message_at
+        }
+    
+    def get_search_rank(self, obj):
+        """رتبه در نتایج جستجو (فقط در صورت وجود پارامتر search)"""
+        return getattr(obj, 'search_rank', None)
+    
+    def get_search_snippet(self, obj):
+        """بخش منطبق بهترین پیام با کلمات مشخص شده (<mark>)"""
+        return getattr(obj, 'search_snippet', None)
     
     def get_unread_count(self, obj):
         """تعداد پیام‌های خوانده نشده"""
@@ -100,6 +153,9 @@ class ConversationFolderSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_conversations_count(self, obj):
+        # در لیست از annotate در ConversationFolderViewSet استفاده می‌شود
+        if hasattr(obj, 'conversations_count'):
+            return obj.conversations_count
         return obj.conversation_set.count()
 
 
@@ -155,9 +211,21 @@ class QueryRequestSerializer(serializers.Serializer):
     file_attachments = FileAttachmentSerializer(many=True, required=False, allow_null=True)
     
     def validate_file_attachments(self, value):
-        """اعتبارسنجی فایل‌های ضمیمه - حداکثر 5 فایل"""
+        """
+        اعتبارسنجی فایل‌های ضمیمه - حداکثر 5 فایل
+        
+        object_key باید متعلق به کاربر باشد (context['request'])؛ کلیدهای blobs/ قابل
+        حدس هستند و پیوست کلید دیگران ref_count فایل آن‌ها را تغییر می‌دهد.
+        """
         if value and len(value) > 5:
             raise serializers.ValidationError('حداکثر 5 فایل مجاز است')
+        if value:
+            from .blobs import owns_object_key
+            
+            request = self.context.get('request')
+            user = getattr(request, 'user', None)
+            if user is None or not all(owns_object_key(user, f['object_key']) for f in value):
+                raise serializers.ValidationError('فایل ضمیمه یافت نشد')
         return value
     
     def validate_query(self, value):
@@ -212,7 +280,7 @@ class MessageFeedbackSerializer(serializers.Serializer):
 class ConversationExportSerializer(serializers.Serializer):
     """Serializer برای export گفتگو"""
     format = serializers.ChoiceField(
-        choices=['json', 'pdf', 'docx', 'txt'],
+        choices=['json', 'pdf', 'docx', 'txt', 'csv'],
         default='pdf'
     )
     include_sources = serializers.BooleanField(default=True)
@@ -220,12 +288,39 @@ class ConversationExportSerializer(serializers.Serializer):
     include_timestamps = serializers.BooleanField(default=True)
 
 
+class ConversationExportJobSerializer(serializers.ModelSerializer):
+    """Serializer برای وضعیت export همه گفتگوها"""
+    progress = serializers.IntegerField(read_only=True)
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ConversationExport
+        fields = [
+            'id', 'format', 'status', 'progress', 'total_conversations',
+            'processed_conversations', 'file_size', 'download_url',
+            'error_message', 'created_at', 'updated_at', 'completed_at'
+        ]
+        read_only_fields = [
+            'id', 'status', 'total_conversations', 'processed_conversations',
+            'file_size', 'error_message', 'created_at', 'updated_at', 'completed_at'
+        ]
+    
+    def get_download_url(self, obj):
+        """لینک presigned جدید (فقط برای export کامل شده)"""
+        from .exports import download_url
+        return download_url(obj)
+
+
+# عملیات گروهی با یک UPDATE انجام می‌شود (chat.views.ConversationViewSet.bulk_action)
+BULK_ACTION_MAX_CONVERSATIONS = 1000
+
+
 class BulkConversationActionSerializer(serializers.Serializer):
     """Serializer برای عملیات گروهی روی گفتگوها"""
     conversation_ids = serializers.ListField(
         child=serializers.UUIDField(),
         min_length=1,
-        max_length=50
+        max_length=BULK_ACTION_MAX_CONVERSATIONS
     )
     action = serializers.ChoiceField(
         choices=['archive', 'unarchive', 'delete', 'move_to_folder', 'tag']
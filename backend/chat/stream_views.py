@@ -0,0 +1,171 @@
+"""
+Streaming (Server-Sent Events) views برای ارسال سوال
+پاسخ سیستم مرکزی به محض تولید به مرورگر ارسال می‌شود
+"""
+import asyncio
+import json
+import logging
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import permissions
+
+from core.async_views import AsyncAPIView
+from .models import Message
+from .serializers import QueryRequestSerializer
+from .core_service import core_service
+from .core_admission import CoreOverloadedError
+from .turns import start_turn, finish_turn
+
+logger = logging.getLogger('app')
+
+# فاصله زمانی ذخیره موقت پاسخ در حال تولید (ثانیه)
+CHECKPOINT_INTERVAL = 3.0
+
+
+def _sse(event, data):
+    """فرمت یک رویداد SSE"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _checkpoint(message_id, content):
+    """ذخیره موقت محتوای تولید شده تا این لحظه"""
+    Message.objects.filter(id=message_id).update(content=content, updated_at=timezone.now())
+
+
+async def _event_stream(turn, query, language, meta):
+    """
+    رله رویدادهای Core به کلاینت به صورت SSE
+
+    با قطع اتصال کلاینت، StreamDisconnectMiddleware (core/asgi.py) task درخواست را
+    لغو می‌کند؛ generator سیستم مرکزی بسته می‌شود (درخواست upstream، slot صف
+    اولویت و admission آزاد می‌شوند) و محتوای تولید شده تا آن لحظه ذخیره می‌شود.
+
+    هر خطای پیش‌بینی نشده (رویداد ناقص Core، خطای دیتابیس در checkpoint،
+    خطای Redis در صف اولویت) پیام را failed ذخیره و رویداد error ارسال می‌کند.
+    """
+    conversation = turn['conversation']
+    assistant_message = turn['assistant_message']
+    loop = asyncio.get_running_loop()
+
+    parts = []
+    final = {}
+    error_message = ''
+    last_checkpoint = loop.time()
+
+    yield _sse('start', {
+        'conversation_id': str(conversation.id),
+        'user_message_id': str(turn['user_message'].id),
+        'message_id': str(assistant_message.id),
+    })
+
+    stream = core_service.stream_query(
+        query=query,
+        token=turn['token'],
+        conversation_id=conversation.rag_conversation_id or None,
+        language=language,
+        file_attachments=turn['file_attachments'],
+        enable_web_search=turn['enable_web_search'],
+        priority=turn['priority'],
+    )
+    try:
+        async for event in stream:
+            if event['type'] == 'chunk':
+                if not event['content']:
+                    continue
+                parts.append(event['content'])
+                yield _sse('chunk', {'content': event['content']})
+
+                if loop.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    last_checkpoint = loop.time()
+                    await sync_to_async(_checkpoint)(assistant_message.id, ''.join(parts))
+            elif event['type'] == 'done':
+                # بدون break: generator پس از done خودش تمام می‌شود و admission موفقیت
+                # (زمان اولین بایت) را ثبت می‌کند؛ aclose در این نقطه فقط slot را آزاد می‌کند
+                final = event['data']
+            elif event['type'] == 'error':
+                error_message = event['message'] or 'Core stream error'
+                yield _sse('error', {'error': 'خطا در پردازش سوال', 'code': 'rag_core_error'})
+                break
+            else:
+                yield _sse(event['type'], event.get('data', {}))
+    except (asyncio.CancelledError, GeneratorExit):
+        error_message = 'client disconnected'
+        raise
+    except CoreOverloadedError as e:
+        logger.warning(f"Stream rejected by Core admission control: {e.reason}")
+        error_message = str(e)
+        yield _sse('error', {
+            'error': 'سرور پردازش در حال حاضر مشغول است. لطفاً چند لحظه دیگر دوباره تلاش کنید.',
+            'code': 'core_overloaded',
+            'retryable': True,
+            'retry_after': e.retry_after,
+        })
+    except httpx.TimeoutException as e:
+        logger.error(f"RAG Core stream timeout: {e}")
+        error_message = 'timeout'
+        yield _sse('error', {'error': 'زمان پردازش تمام شد. لطفاً دوباره تلاش کنید.', 'code': 'timeout'})
+    except httpx.HTTPError as e:
+        logger.error(f"RAG Core stream error: {e}")
+        error_message = str(e) or 'Core stream error'
+        yield _sse('error', {'error': 'خطا در اتصال به سرور پردازش', 'code': 'rag_core_error'})
+    except Exception as e:
+        logger.exception(f"Unexpected error in query stream: {e}")
+        error_message = str(e) or e.__class__.__name__
+        yield _sse('error', {'error': 'خطا در پردازش سوال', 'code': 'rag_core_error'})
+    finally:
+        # بستن درخواست upstream و ذخیره نهایی حتی در صورت لغو
+        await stream.aclose()
+        await asyncio.shield(
+            sync_to_async(finish_turn)(turn, final, meta, ''.join(parts), error_message)
+        )
+
+    if not error_message:
+        yield _sse('done', {
+            'conversation_id': str(conversation.id),
+            'message_id': str(assistant_message.id),
+            'sources': assistant_message.sources,
+            'tokens_used': assistant_message.tokens,
+            'processing_time_ms': assistant_message.processing_time_ms,
+            'context_used': assistant_message.cached,
+            **({'file_analysis': final['file_analysis']} if 'file_analysis' in final else {}),
+        })
+
+
+class QueryStreamView(AsyncAPIView):
+    """
+    ارسال سوال با پاسخ streaming (text/event-stream)
+
+    رویدادها: start، chunk، sources و سایر رویدادهای Core، done، error
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # کلاینت‌های SSE هدر Accept: text/event-stream می‌فرستند؛ خطاها JSON برمی‌گردند
+        return super().perform_content_negotiation(request, force=True)
+
+    async def post(self, request):
+        serializer = QueryRequestSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        turn = await sync_to_async(start_turn)(request.user, data, getattr(request, 'subscription', None))
+        if turn is None:
+            raise Http404
+
+        meta = {
+            'action': 'chat_query_stream',
+            'query_length': len(data['query']),
+            'ip_address': request.META.get('REMOTE_ADDR'),
+            'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+        }
+
+        response = StreamingHttpResponse(
+            _event_stream(turn, data['query'], data.get('language', 'fa'), meta),
+            content_type='text/event-stream; charset=utf-8'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # غیرفعال کردن buffering در nginx
+        return response
@@ -30,18 +30,85 @@ def log_audit(user_id, action, details, ip_address, user_agent):
 
 @shared_task(name='chat.tasks.update_conversation_stats')
 def update_conversation_stats(conversation_id):
-    """به‌روزرسانی آمار conversation در پس‌زمینه"""
+    """
+    محاسبه مجدد کامل آمار conversation (برای اصلاح داده‌های قدیمی)
+    
+    مسیر عادی ذخیره پیام آمار را به صورت افزایشی به‌روز می‌کند (chat.turns)
+    """
     try:
         from chat.models import Conversation
-        from django.utils import timezone
-        from django.db.models import Count
+        from django.db.models import Count, Max, Q, Sum
         
-        conversation = Conversation.objects.get(id=conversation_id)
-        conversation.message_count = conversation.messages.filter(role='user').count()
-        conversation.token_usage = conversation.messages.aggregate(
-            total=Count('tokens')
-        )['total'] or 0
-        conversation.last_message_at = timezone.now()
-        conversation.save(update_fields=['message_count', 'token_usage', 'last_message_at'])
+        stats = Conversation.objects.filter(id=conversation_id).aggregate(
+            message_count=Count('messages', filter=Q(messages__role='user')),
+            token_usage=Sum('messages__tokens'),
+            last_message_at=Max('messages__created_at')
+        )
+        Conversation.objects.filter(id=conversation_id).update(
+            message_count=stats['message_count'] or 0,
+            token_usage=stats['token_usage'] or 0,
+            last_message_at=stats['last_message_at']
+        )
     except Exception as e:
         logger.error(f"Failed to update conversation stats: {e}")
+
+
+@shared_task(
+    bind=True,
+    name='chat.tasks.export_conversations',
+    acks_late=True,
+    max_retries=5,
+    soft_time_limit=25 * 60
+)
+def export_conversations(self, export_id):
+    """
+    ساخت ZIP همه گفتگوهای کاربر در MinIO (chat.exports)
+    
+    پیشرفت بعد از هر دسته ذخیره می‌شود؛ در صورت خطا یا رسیدن به محدودیت زمان،
+    تسک دوباره زمان‌بندی می‌شود و از آخرین checkpoint ادامه می‌دهد.
+    """
+    from celery.exceptions import SoftTimeLimitExceeded
+    from chat.exports import run_export
+    from chat.models import ConversationExport
+    
+    try:
+        run_export(export_id)
+    except ConversationExport.DoesNotExist:
+        logger.warning(f"Conversation export {export_id} not found")
+    except SoftTimeLimitExceeded:
+        # ادامه در اجرای جدید (محدودیت زمان برای هر اجرا است، نه کل export)
+        export_conversations.apply_async((export_id,), countdown=1)
+    except Exception as e:
+        logger.error(f"Conversation export {export_id} failed: {e}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=60 * (self.request.retries + 1))
+        ConversationExport.objects.filter(id=export_id).update(
+            status='failed',
+            error_message=str(e)[:1000]
+        )
+
+
+@shared_task(name='chat.tasks.drain_core_deletions')
+def drain_core_deletions():
+    """
+    پردازش صف حذف گفتگوها از RAG Core (chat.deletions)
+    
+    بعد از هر حذف و به صورت دوره‌ای (برای تلاش‌های مجدد) اجرا می‌شود.
+    """
+    from chat.deletions import drain
+    
+    result = drain()
+    if result['deleted'] or result['failed']:
+        logger.info(f"Core deletions drained: {result}")
+    return result
+
+
+@shared_task(name='chat.tasks.expire_conversation_exports')
+def expire_conversation_exports():
+    """
+    حذف فایل‌های export قدیمی‌تر از CONVERSATION_EXPORT_RETENTION_HOURS از MinIO
+    و ثبت وضعیت expired (chat.exports)
+    """
+    from chat.exports import expire_exports
+    
+    return expire_exports()
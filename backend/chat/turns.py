@@ -0,0 +1,239 @@
+"""
+ذخیره‌سازی یک نوبت گفتگو (سوال کاربر + پاسخ دستیار)
+توابع sync هستند تا از view های async با یک sync_to_async فراخوانی شوند
+
+هر مرحله در یک transaction انجام می‌شود و آمار conversation (message_count،
+token_usage، last_message_at) با F() به صورت افزایشی به‌روز می‌شود؛ هزینه
+ذخیره هر نوبت به طول گفتگو وابسته نیست. پیش‌نمایش آخرین پیام نیز همین‌جا
+روی conversation ذخیره می‌شود تا لیست گفتگوها به جدول پیام‌ها نیاز نداشته باشد.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.tokens import get_core_access_token
+from .core_priority import resolve_tier
+from .models import Conversation, Message, MessageAttachment
+from .search import conversation_vector, message_vector
+
+logger = logging.getLogger('app')
+
+
+def to_core_file_attachments(file_attachments):
+    """تبدیل فایل‌های ضمیمه درخواست به فرمت Core (Core RAG انتظار minio_url دارد)"""
+    if not file_attachments:
+        return None
+    return [
+        {
+            'filename': f['filename'],
+            'minio_url': f['object_key'],
+            'file_type': f['file_type'],
+            'size_bytes': f.get('size_bytes')
+        }
+        for f in file_attachments
+    ]
+
+
+def start_turn(user, data, subscription=None):
+    """
+    ایجاد conversation (در صورت نیاز)، پیام کاربر، پیوست‌ها و پیام دستیار
+    در حالت processing، و آماده‌سازی پارامترهای ارسال به Core.
+
+    Returns:
+        dict شامل conversation، new_conversation، user_message، assistant_message،
+        token، file_attachments، enable_web_search (پس از اعمال preferences) و
+        priority؛ یا None اگر conversation یافت نشود
+
+    new_conversation فقط برای اولین نوبت گفتگو True است؛ کش پاسخ و اشتراک
+    درخواست‌های همزمان فقط برای این نوبت مجاز است (نوبت‌های بعدی context دارند
+    حتی اگر پاسخ اول از کش آمده و rag_conversation_id خالی مانده باشد).
+    """
+    conversation_id = data.get('conversation_id')
+    now = timezone.now()
+
+    with transaction.atomic():
+        if conversation_id:
+            conversation = Conversation.objects.filter(id=conversation_id, user=user).first()
+            if conversation is None:
+                return None
+            Conversation.objects.filter(id=conversation.id).update(
+                message_count=F('message_count') + 1,
+                last_message_at=now,
+                last_message_role='user',
+                last_message_preview=Conversation.make_preview(data['query']),
+                updated_at=now
+            )
+        else:
+            title = data['query'][:50] + '...' if len(data['query']) > 50 else data['query']
+            conversation = Conversation.objects.create(
+                user=user,
+                organization=user.organization,
+                title=title,
+                default_response_mode=data.get('response_mode', 'simple_explanation'),
+                search_vector=conversation_vector(title),
+                message_count=1,
+                last_message_at=now,
+                last_message_role='user',
+                last_message_preview=Conversation.make_preview(data['query'])
+            )
+
+        user_message = Message.objects.create(
+            conversation=conversation,
+            role='user',
+            content=data['query'],
+            response_mode=data.get('response_mode', 'simple_explanation'),
+            status='completed',
+            search_vector=message_vector(data['query'])
+        )
+
+        MessageAttachment.objects.bulk_create([
+            MessageAttachment(
+                message=user_message,
+                file=file_data['object_key'],  # object_key در MinIO
+                file_name=file_data['filename'],
+                file_size=file_data.get('size_bytes', 0),
+                file_type='image' if file_data['file_type'].startswith('image/') else 'document',
+                mime_type=file_data['file_type'],
+                extraction_status='pending'
+            )
+            for file_data in data.get('file_attachments') or []
+        ])
+        if data.get('file_attachments'):
+            from .blobs import add_references
+            add_references([file_data['object_key'] for file_data in data['file_attachments']])
+
+        assistant_message = Message.objects.create(
+            conversation=conversation,
+            role='assistant',
+            content='',
+            status='processing'
+        )
+
+    # دریافت تنظیم enable_web_search از request یا preferences کاربر
+    enable_web_search = data.get('enable_web_search')
+    if enable_web_search is None and user.preferences:
+        enable_web_search = user.preferences.get('enable_web_search')
+
+    # tier صف اولویت Core (اشتراک resolve شده در SubscriptionMiddleware یا از روی کاربر)
+    if subscription is None:
+        subscription = user.get_active_subscription()
+
+    return {
+        'conversation': conversation,
+        'new_conversation': not conversation_id,
+        'user_message': user_message,
+        'assistant_message': assistant_message,
+        'token': get_core_access_token(user),
+        'file_attachments': to_core_file_attachments(data.get('file_attachments')),
+        'enable_web_search': enable_web_search,
+        'priority': {'user_id': user.id, 'tier': resolve_tier(subscription)},
+    }
+
+
+def finish_turn(turn, response, meta, content=None, error_message='', audit=True):
+    """
+    ذخیره پاسخ دستیار، rag_conversation_id و token_usage در یک transaction و
+    ارسال audit log به Celery.
+
+    Args:
+        turn: خروجی start_turn
+        response: پاسخ Core (یا داده رویداد done در حالت streaming)
+        meta: dict شامل action، query_length، ip_address، user_agent و
+            details (اختیاری، جزئیات اضافه audit log)
+        content: محتوای تجمیع شده (حالت streaming)؛ پیش‌فرض answer پاسخ Core
+        error_message: در صورت وجود، پیام با وضعیت failed ذخیره می‌شود
+        audit: با False ثبت audit log به فراخواننده سپرده می‌شود (log_turn)
+    """
+    conversation = turn['conversation']
+    assistant_message = turn['assistant_message']
+
+    # به‌روزرسانی پیام assistant - مطابق با API سیستم مرکزی
+    assistant_message.content = content or response.get('answer', '')
+    assistant_message.sources = response.get('sources', [])
+    if error_message:
+        assistant_message.status = 'failed'
+        assistant_message.error_message = error_message
+    else:
+        assistant_message.status = 'completed'
+    assistant_message.tokens = response.get('tokens_used', 0) or 0
+    assistant_message.processing_time_ms = response.get('processing_time_ms', 0) or 0
+    assistant_message.cached = bool(response.get('cached')) or response.get('context_used', False)
+    assistant_message.rag_message_id = response.get('message_id', '') or ''
+    assistant_message.model_used = (response.get('model_used', '') or '')[:50]
+
+    # ذخیره file_analysis اگر وجود داشته باشد
+    if 'file_analysis' in response:
+        assistant_message.metadata = assistant_message.metadata or {}
+        assistant_message.metadata['file_analysis'] = response['file_analysis']
+
+    # پاسخ از کش پاسخ‌های تکراری (answer_cache)
+    if response.get('cached'):
+        assistant_message.metadata = assistant_message.metadata or {}
+        assistant_message.metadata['answer_cache'] = {'hit': True, 'key': response.get('cache_key')}
+
+    # پاسخ مشترک با درخواست همزمان یکسان (single-flight در core_service)
+    if response.get('coalesced'):
+        assistant_message.metadata = assistant_message.metadata or {}
+        assistant_message.metadata['coalesced'] = True
+
+    now = timezone.now()
+    conversation_updates = {
+        'token_usage': F('token_usage') + assistant_message.tokens,
+        'last_message_at': now,
+        'last_message_role': 'assistant',
+        'last_message_preview': Conversation.make_preview(assistant_message.content),
+        'updated_at': now,
+    }
+    # به‌روزرسانی conversation با ID از RAG Core
+    if not conversation.rag_conversation_id and response.get('conversation_id'):
+        conversation.rag_conversation_id = response['conversation_id']
+        conversation_updates['rag_conversation_id'] = conversation.rag_conversation_id
+
+    assistant_message.search_vector = message_vector(assistant_message.content)
+
+    with transaction.atomic():
+        assistant_message.save(update_fields=[
+            'content', 'sources', 'status', 'error_message', 'tokens', 'processing_time_ms',
+            'cached', 'rag_message_id', 'model_used', 'metadata', 'search_vector', 'updated_at'
+        ])
+        Conversation.objects.filter(id=conversation.id).update(**conversation_updates)
+
+    if audit:
+        log_turn(turn, meta)
+
+    return assistant_message
+
+
+def log_turn(turn, meta):
+    """ارسال audit log یک نوبت ذخیره شده (finish_turn) به Celery"""
+    conversation = turn['conversation']
+    details = {
+        'conversation_id': str(conversation.id),
+        'query_length': meta['query_length'],
+        'tokens_used': turn['assistant_message'].tokens,
+        **meta.get('details', {})
+    }
+
+    # ثبت audit log در پس‌زمینه (Celery)
+    try:
+        from chat.tasks import log_audit
+        log_audit.delay(
+            str(conversation.user_id),
+            meta['action'],
+            details,
+            meta.get('ip_address'),
+            meta.get('user_agent', '')
+        )
+    except Exception as celery_err:
+        logger.warning(f"Celery dispatch failed, running sync: {celery_err}")
+        # Fallback: اجرای همزمان
+        from accounts.models import AuditLog
+        AuditLog.objects.create(
+            user_id=conversation.user_id,
+            action=meta['action'],
+            details=details,
+            ip_address=meta.get('ip_address') or '0.0.0.0',
+            user_agent=meta.get('user_agent', '')
+        )
@@ -1,14 +1,38 @@
 """
 File upload views for chat attachments.
+
+فایل‌ها به صورت تدریجی (multipart، تکه به تکه) به MinIO ارسال می‌شوند و چند فایل
+همزمان روی یک thread pool محدود آپلود می‌شوند. اگر کلاینت upload_id بفرستد،
+پیشرفت هر فایل در cache ثبت می‌شود و از upload/progress/<upload_id>/ قابل دریافت است.
+
+آپلود مستقیم (بدون عبور فایل از سرور): upload/presign/ یک presigned POST با
+محدودیت نوع، اندازه و SHA-256 فایل برمی‌گرداند، کلاینت فایل را مستقیماً به MinIO
+ارسال می‌کند (MinIO محتوا را با checksum بررسی می‌کند) و سپس upload/finalize/
+مشخصات و checksum فایل را با HEAD بررسی می‌کند و آن را از temp_uploads/ به کلید
+محتوا (blobs/) منتقل می‌کند.
+
+محتوای تکراری (SHA-256) برای هر کاربر/سازمان یک بار ذخیره می‌شود؛ کلاینت می‌تواند
+قبل از آپلود با upload/check/ وجود فایلی را که خودش قبلاً آپلود کرده بررسی کند (chat.blobs).
 """
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import re
+import threading
+import time
+
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.core.files.uploadedfile import UploadedFile
 import logging
 
 from core.storage import s3_service
+from .blobs import SHA256_PATTERN, blob_payload, find_blob, promote_upload, store_upload
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +59,125 @@ MAX_FILE_SIZE = 10 * 1024 * 1024
 # Maximum number of files per upload
 MAX_FILES_PER_UPLOAD = 5
 
+# Concurrent uploads to MinIO per request
+UPLOAD_CONCURRENCY = getattr(settings, 'UPLOAD_CONCURRENCY', 3)
+
+# Upload progress (cache)
+UPLOAD_ID_PATTERN = re.compile(r'^[\w-]{1,64}$')
+UPLOAD_PROGRESS_TTL = 3600  # seconds
+UPLOAD_PROGRESS_INTERVAL = 0.5  # seconds between cache writes per request
+
+# Direct (presigned) uploads
+UPLOAD_PRESIGN_TTL = getattr(settings, 'UPLOAD_PRESIGN_TTL', 900)  # seconds
+UPLOAD_SLOT_TTL = UPLOAD_PRESIGN_TTL + 3600  # finalize تا یک ساعت پس از انقضای policy
+
+
+def _progress_key(user_id, upload_id):
+    return f'upload_progress:{user_id}:{upload_id}'
+
+
+class UploadProgress:
+    """
+    پیشرفت آپلود فایل‌های یک درخواست
+    
+    callback ها از thread های آپلود فراخوانی می‌شوند؛ نوشتن در cache با فاصله
+    حداقل UPLOAD_PROGRESS_INTERVAL انجام می‌شود (تغییر وضعیت فایل‌ها بلافاصله).
+    پیشرفت فقط مرحله ارسال به MinIO را نشان می‌دهد (بدنه درخواست قبلاً دریافت شده است).
+    """
+    
+    def __init__(self, user_id, upload_id, files):
+        self.cache_key = _progress_key(user_id, upload_id) if upload_id else None
+        self.lock = threading.Lock()
+        self.saved_at = 0.0
+        self.files = [
+            {'filename': f.name, 'size_bytes': f.size, 'uploaded_bytes': 0, 'status': 'pending'}
+            for f in files
+        ]
+        self.save()
+    
+    def callback(self, index):
+        def on_progress(bytes_amount):
+            with self.lock:
+                entry = self.files[index]
+                entry['uploaded_bytes'] += bytes_amount
+                entry['status'] = 'uploading'
+                if time.monotonic() - self.saved_at >= UPLOAD_PROGRESS_INTERVAL:
+                    self._save()
+        return on_progress
+    
+    def set_status(self, index, file_status, error=None):
+        with self.lock:
+            entry = self.files[index]
+            entry['status'] = file_status
+            if file_status == 'completed':
+                entry['uploaded_bytes'] = entry['size_bytes']
+            if error:
+                entry['error'] = error
+            self._save()
+    
+    def save(self):
+        with self.lock:
+            self._save()
+    
+    def _save(self):
+        self.saved_at = time.monotonic()
+        if not self.cache_key:
+            return
+        try:
+            cache.set(self.cache_key, {'files': self.files}, UPLOAD_PROGRESS_TTL)
+        except Exception as e:
+            logger.warning(f"Could not store upload progress: {e}")
+
+
+def _get_upload_id(request):
+    """upload_id اختیاری از فیلد فرم یا هدر X-Upload-ID"""
+    upload_id = request.data.get('upload_id') or request.headers.get('X-Upload-ID')
+    if upload_id and UPLOAD_ID_PATTERN.match(upload_id):
+        return upload_id
+    return None
+
+
+def _validation_error(file):
+    return _limits_error(file.size, file.content_type)
+
+
+def _limits_error(size, content_type):
+    if size > MAX_FILE_SIZE:
+        return f'حجم فایل نباید بیشتر از {MAX_FILE_SIZE // (1024*1024)}MB باشد'
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        return f'نوع فایل {content_type} پشتیبانی نمی‌شود'
+    return None
+
+
+def _slot_key(user_id, object_key):
+    digest = hashlib.sha256(object_key.encode('utf-8')).hexdigest()
+    return f'upload_slot:{user_id}:{digest}'
+
+
+def _stream_upload(file, user, progress, index):
+    """
+    آپلود تدریجی یک فایل (محتوای تکراری دوباره آپلود نمی‌شود، chat.blobs)
+    
+    Raises:
+        خطای MinIO (وضعیت فایل در progress به failed تغییر می‌کند)
+    """
+    progress.set_status(index, 'uploading')
+    try:
+        result = store_upload(file, user, callback=progress.callback(index))
+    except Exception:
+        progress.set_status(index, 'failed', 'خطا در آپلود فایل')
+        raise
+    progress.set_status(index, 'completed')
+    return result
+
+
+def _pooled_upload(*args):
+    """اجرای _stream_upload در thread pool (اتصال دیتابیس thread در پایان بسته می‌شود)"""
+    try:
+        return _stream_upload(*args)
+    finally:
+        connection.close()
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -67,31 +210,18 @@ def upload_file(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Validate file size
-    if file.size > MAX_FILE_SIZE:
-        return Response(
-            {'error': f'حجم فایل نباید بیشتر از {MAX_FILE_SIZE // (1024*1024)}MB باشد'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    # Validate content type
-    if file.content_type not in ALLOWED_CONTENT_TYPES:
+    # Validate file size and content type
+    error = _validation_error(file)
+    if error:
         return Response(
-            {'error': f'نوع فایل {file.content_type} پشتیبانی نمی‌شود'},
+            {'error': error},
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    progress = UploadProgress(request.user.id, _get_upload_id(request), [file])
     try:
-        # Read file content
-        file_content = file.read()
-        
-        # Upload to S3
-        result = s3_service.upload_file(
-            file_content=file_content,
-            filename=file.name,
-            user_id=str(request.user.id),
-            content_type=file.content_type
-        )
+        # Upload to S3 (streaming)
+        result = _stream_upload(file, request.user, progress, 0)
         
         logger.info(f"User {request.user.id} uploaded file: {file.name}")
         
@@ -111,6 +241,9 @@ def upload_multiple_files(request):
     """
     آپلود چند فایل همزمان (حداکثر 5).
     
+    فایل‌های معتبر به صورت موازی (حداکثر UPLOAD_CONCURRENCY) آپلود می‌شوند؛
+    ترتیب نتایج مطابق ترتیب فایل‌های ارسالی است.
+    
     Returns:
         {
             'files': [
@@ -140,46 +273,254 @@ def upload_multiple_files(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    results = []
+    results = [None] * len(files)
+    progress = UploadProgress(request.user.id, _get_upload_id(request), files)
     
-    for file in files:
-        # Validate file size
-        if file.size > MAX_FILE_SIZE:
-            results.append({
-                'filename': file.name,
-                'error': f'حجم فایل نباید بیشتر از {MAX_FILE_SIZE // (1024*1024)}MB باشد'
-            })
-            continue
-        
-        # Validate content type
-        if file.content_type not in ALLOWED_CONTENT_TYPES:
-            results.append({
-                'filename': file.name,
-                'error': f'نوع فایل {file.content_type} پشتیبانی نمی‌شود'
-            })
-            continue
-        
-        try:
-            # Read file content
-            file_content = file.read()
-            
-            # Upload to MinIO
-            result = s3_service.upload_file(
-                file_content=file_content,
-                filename=file.name,
-                user_id=str(request.user.id),
-                content_type=file.content_type
-            )
-            
-            results.append(result)
-            
-        except Exception as e:
-            logger.error(f"File upload error for {file.name}: {e}")
-            results.append({
-                'filename': file.name,
-                'error': 'خطا در آپلود فایل'
-            })
+    valid = []
+    for index, file in enumerate(files):
+        error = _validation_error(file)
+        if error:
+            results[index] = {'filename': file.name, 'error': error}
+            progress.set_status(index, 'rejected', error)
+        else:
+            valid.append(index)
+    
+    if valid:
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_CONCURRENCY, len(valid))) as executor:
+            futures = {
+                index: executor.submit(_pooled_upload, files[index], request.user, progress, index)
+                for index in valid
+            }
+            for index, future in futures.items():
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    logger.error(f"File upload error for {files[index].name}: {e}")
+                    results[index] = {
+                        'filename': files[index].name,
+                        'error': 'خطا در آپلود فایل'
+                    }
     
     logger.info(f"User {request.user.id} uploaded {len(results)} files")
     
     return Response({'files': results}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def upload_progress(request, upload_id):
+    """
+    پیشرفت آپلود فایل‌های یک درخواست (با upload_id ارسال شده در آپلود).
+    
+    Returns:
+        {
+            'files': [
+                {
+                    'filename': '...',
+                    'size_bytes': 1024,
+                    'uploaded_bytes': 512,
+                    'status': 'pending|uploading|completed|failed|rejected'
+                },
+                ...
+            ]
+        }
+    """
+    data = cache.get(_progress_key(request.user.id, upload_id))
+    if data is None:
+        return Response(
+            {'error': 'آپلودی با این شناسه یافت نشد'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def presign_upload(request):
+    """
+    دریافت مجوز آپلود مستقیم یک فایل به MinIO.
+    
+    Body:
+        {'filename': 'document.pdf', 'content_type': 'application/pdf', 'size_bytes': 1024,
+         'sha256': '...'}
+    
+    Returns:
+        {
+            'object_key': 'temp_uploads/user123/file.pdf',
+            'url': 'https://s3.../temp-userfile',
+            'fields': {...},
+            'expires_at': '2024-11-30T12:00:00'
+        }
+    
+    کلاینت فایل را با multipart/form-data به url ارسال می‌کند (همه fields و سپس
+    فیلد file) و بعد upload/finalize/ را با object_key فراخوانی می‌کند.
+    """
+    filename = os.path.basename(str(request.data.get('filename') or '').strip())
+    content_type = request.data.get('content_type') or ''
+    
+    if not filename:
+        return Response(
+            {'error': 'نام فایل الزامی است'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        size_bytes = int(request.data.get('size_bytes'))
+    except (TypeError, ValueError):
+        size_bytes = 0
+    if size_bytes <= 0:
+        return Response(
+            {'error': 'حجم فایل الزامی است'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    error = _limits_error(size_bytes, content_type)
+    if error:
+        return Response(
+            {'error': error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    sha256 = str(request.data.get('sha256') or '').lower()
+    if not SHA256_PATTERN.match(sha256):
+        return Response(
+            {'error': 'hash فایل (sha256) الزامی است'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        slot = s3_service.generate_presigned_upload(
+            filename=filename,
+            user_id=str(request.user.id),
+            content_type=content_type,
+            size_bytes=size_bytes,
+            expiration=UPLOAD_PRESIGN_TTL,
+            sha256=sha256
+        )
+    except Exception as e:
+        logger.error(f"Presigned upload error: {e}")
+        return Response(
+            {'error': 'خطا در آپلود فایل'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    cache.set(_slot_key(request.user.id, slot['object_key']), {
+        'filename': filename,
+        'content_type': content_type,
+        'size_bytes': size_bytes,
+        'sha256': sha256,
+    }, UPLOAD_SLOT_TTL)
+    
+    return Response(slot, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload(request):
+    """
+    تایید آپلود مستقیم پس از ارسال فایل به MinIO.
+    
+    Body:
+        {'object_key': 'temp_uploads/user123/file.pdf'}
+    
+    Returns:
+        مانند upload/ (object_key در blobs/، filename، size_bytes، content_type،
+        expires_at، bucket_name، sha256، deduplicated)
+    """
+    object_key = request.data.get('object_key') or ''
+    slot = cache.get(_slot_key(request.user.id, object_key)) if object_key else None
+    if slot is None:
+        return Response(
+            {'error': 'آپلودی با این شناسه یافت نشد'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        head = s3_service.head_file(object_key)
+    except Exception as e:
+        logger.error(f"Finalize upload error: {e}")
+        return Response(
+            {'error': 'خطا در آپلود فایل'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    if head is None:
+        return Response(
+            {'error': 'فایل هنوز آپلود نشده است'},
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    # policy همین محدودیت‌ها را اجبار می‌کند؛ بررسی مجدد در برابر فایل‌های مغایر
+    # (بدون checksum تایید شده توسط MinIO، hash اعلام شده قابل اعتماد نیست)
+    if (
+        head['size_bytes'] != slot['size_bytes']
+        or head['content_type'] != slot['content_type']
+        or head['sha256'] != slot['sha256']
+    ):
+        s3_service.delete_file(object_key)
+        cache.delete(_slot_key(request.user.id, object_key))
+        return Response(
+            {'error': 'فایل آپلود شده با مشخصات اعلام شده مطابقت ندارد'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        result = promote_upload(
+            object_key, request.user, slot['sha256'],
+            slot['filename'], head['size_bytes'], head['content_type']
+        )
+    except Exception as e:
+        logger.error(f"Finalize upload error: {e}")
+        return Response(
+            {'error': 'خطا در آپلود فایل'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    cache.delete(_slot_key(request.user.id, object_key))
+    
+    logger.info(f"User {request.user.id} uploaded file directly: {slot['filename']}")
+    
+    return Response(result, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def check_upload(request):
+    """
+    بررسی وجود فایل با همین محتوا قبل از آپلود (SHA-256).
+    
+    Body:
+        {'sha256': '...', 'filename': 'document.pdf', 'content_type': 'application/pdf', 'size_bytes': 1024}
+    
+    Returns:
+        {'exists': True, ...خروجی upload/} اگر فایل قبلاً ذخیره شده باشد (بدون نیاز به آپلود)،
+        در غیر این صورت {'exists': False}
+    """
+    filename = os.path.basename(str(request.data.get('filename') or '').strip())
+    content_type = request.data.get('content_type') or ''
+    
+    if not filename:
+        return Response(
+            {'error': 'نام فایل الزامی است'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        size_bytes = int(request.data.get('size_bytes'))
+    except (TypeError, ValueError):
+        size_bytes = 0
+    
+    error = _limits_error(size_bytes, content_type)
+    if error:
+        return Response(
+            {'error': error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    blob = find_blob(request.user, request.data.get('sha256'), size_bytes)
+    if blob is None:
+        return Response({'exists': False}, status=status.HTTP_200_OK)
+    
+    return Response(
+        {'exists': True, **blob_payload(blob, filename, content_type, deduplicated=True)},
+        status=status.HTTP_200_OK
+    )
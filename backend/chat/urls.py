@@ -14,7 +14,10 @@ from .views import (
     SharedConversationView,
     HealthCheckView
 )
-from .upload_views import upload_file, upload_multiple_files
+from .stream_views import QueryStreamView
+from .upload_views import (
+    upload_file, upload_multiple_files, upload_progress, presign_upload, finalize_upload, check_upload
+)
 from .memory_views import (
     MemoryListView,
     MemoryDetailView,
@@ -37,12 +40,17 @@ app_name = 'chat'
 urlpatterns = [
     # Query endpoints
     path('query/', QueryView.as_view(), name='query'),
+    path('query/stream/', QueryStreamView.as_view(), name='query-stream'),
     # Health check
     path('health/', HealthCheckView.as_view(), name='health-check'),
     
     # File upload endpoints
     path('upload/', upload_file, name='upload-file'),
     path('upload/multiple/', upload_multiple_files, name='upload-multiple-files'),
+    path('upload/progress/<str:upload_id>/', upload_progress, name='upload-progress'),
+    path('upload/presign/', presign_upload, name='upload-presign'),
+    path('upload/finalize/', finalize_upload, name='upload-finalize'),
+    path('upload/check/', check_upload, name='upload-check'),
     
     # Shared conversations
     path('shared/<str:share_token>/', SharedConversationView.as_view(), name='shared-conversation'),
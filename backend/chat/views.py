@@ -8,8 +8,11 @@ from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-from django.db.models import Q, Count
-from django.http import StreamingHttpResponse, HttpResponse
+from django.db.models import Q, Count, F, Func, IntegerField, JSONField
+from django.db.models.expressions import RawSQL
+from django.urls import reverse
+from urllib.parse import urlencode
+from django.http import StreamingHttpResponse, HttpResponse, Http404
 from asgiref.sync import sync_to_async, async_to_sync
 from channels.generic.http import AsyncHttpConsumer
 import asyncio
@@ -21,7 +24,7 @@ from typing import AsyncGenerator
 
 from .models import (
     Conversation, Message, ConversationFolder,
-    ChatTemplate, SharedConversation, MessageAttachment
+    ChatTemplate, SharedConversation, MessageAttachment, ConversationExport
 )
 from .serializers import (
     ConversationSerializer, ConversationDetailSerializer,
@@ -29,15 +32,106 @@ from .serializers import (
     ChatTemplateSerializer, SharedConversationSerializer,
     QueryRequestSerializer, QueryResponseSerializer,
     MessageFeedbackSerializer, ConversationExportSerializer,
-    BulkConversationActionSerializer
+    BulkConversationActionSerializer, ConversationExportJobSerializer,
+    MESSAGE_HEAVY_FIELDS
 )
 from .core_service import core_service
-from accounts.models import AuditLog
-from rest_framework_simplejwt.tokens import RefreshToken
+from .core_admission import CoreOverloadedError
+from . import answer_cache, idempotency
+from .turns import start_turn, finish_turn
+from .search import conversation_vector, search_conversations
+from .exports import streaming_export_response
+from .deletions import tombstone_conversations
+from .tasks import export_conversations
+from core.async_views import AsyncAPIView
+from core.pagination import HybridPagination
+from core.storage import cleanup_stats
 
 logger = logging.getLogger('app')
 
 
+class ConversationPagination(HybridPagination):
+    """گفتگوها به ترتیب آخرین پیام (index user, -last_message_at)"""
+    ordering = '-last_message_at'
+    
+    def use_cursor(self, request, view=None):
+        # نتایج جستجو بر اساس رتبه مرتب می‌شوند و صفحه‌بندی شماره‌ای دارند
+        if request.query_params.get('search'):
+            return False
+        return super().use_cursor(request, view)
+
+
+class MessagePagination(HybridPagination):
+    """
+    پیام‌ها در حالت cursor از جدیدترین (index conversation, created_at)
+    next: پیام‌های قدیمی‌تر، previous: پیام‌های جدیدتر
+    """
+    ordering = '-created_at'
+
+
+# تعداد پیام‌های جدید در جزئیات سبک گفتگو (?messages=N)
+DETAIL_MESSAGES_DEFAULT = 20
+DETAIL_MESSAGES_MAX = 100
+
+# تعداد منابع بدون خواندن ستون sources در Python
+SOURCES_COUNT = Func(
+    F('sources'),
+    template="CASE WHEN jsonb_typeof(%(expressions)s) = 'array' "
+             "THEN jsonb_array_length(%(expressions)s) ELSE 0 END",
+    output_field=IntegerField()
+)
+
+
+def _split_param(request, name):
+    return {
+        value.strip() for value in request.query_params.get(name, '').split(',')
+        if value.strip()
+    }
+
+
+def message_options(request, triggers=('fields', 'expand')):
+    """
+    پارامترهای حالت سبک پیام‌ها
+    
+    Returns:
+        None برای خروجی کامل قبلی، در غیر این صورت dict با expand (set)
+        و fields (set یا None) برای context سریالایزر
+    """
+    if not any(name in request.query_params for name in triggers):
+        return None
+    expand = _split_param(request, 'expand') & set(MESSAGE_HEAVY_FIELDS)
+    return {'expand': expand, 'fields': _split_param(request, 'fields') or None}
+
+
+def merge_tags(tags):
+    """
+    expression اضافه کردن برچسب‌ها به ستون JSONB tags (بدون تکرار، با حفظ ترتیب)
+    
+    برچسب‌های موجود حفظ می‌شوند و برچسب‌های جدیدی که در آرایه نیستند به انتها
+    اضافه می‌شوند؛ ادغام کامل در PostgreSQL و در یک UPDATE انجام می‌شود.
+    """
+    return RawSQL(
+        "COALESCE(tags, '[]'::jsonb) || COALESCE(("
+        "SELECT jsonb_agg(new_tag.value ORDER BY new_tag.ordinality) "
+        "FROM jsonb_array_elements(%s::jsonb) WITH ORDINALITY AS new_tag(value, ordinality) "
+        "WHERE NOT COALESCE(tags, '[]'::jsonb) @> jsonb_build_array(new_tag.value)"
+        "), '[]'::jsonb)",
+        [json.dumps(list(dict.fromkeys(tags)), ensure_ascii=False)],
+        output_field=JSONField()
+    )
+
+
+def light_messages(queryset, expand):
+    """queryset پیام‌ها بدون خواندن ستون‌های JSON حجیمی که درخواست نشده‌اند"""
+    deferred = ['search_vector']
+    deferred += [name for name in ('sources', 'chunks') if name not in expand]
+    if 'file_analysis' not in expand:
+        deferred.append('metadata')
+    if 'sources' not in expand:
+        queryset = queryset.annotate(sources_count=SOURCES_COUNT)
+    return queryset.defer(*deferred).prefetch_related('attachments')
+
+
 class RAGCoreException(Exception):
     """Exception for RAG Core errors"""
     pass
@@ -48,168 +142,105 @@ class RateLimitException(Exception):
     pass
 
 
-class QueryView(APIView):
-    """ارسال سوال به سیستم RAG Core"""
+class QueryView(AsyncAPIView):
+    """
+    ارسال سوال به سیستم RAG Core
+
+    view به صورت async اجرا می‌شود: فراخوانی Core مستقیماً روی event loop سرور
+    await می‌شود و کارهای ORM در دو sync_to_async گروهی انجام می‌شوند.
+    """
     permission_classes = [permissions.IsAuthenticated]
     
-    def post(self, request):
+    async def post(self, request):
         """ارسال سوال معمولی (non-streaming)"""
-        serializer = QueryRequestSerializer(data=request.data)
+        serializer = QueryRequestSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         
         data = serializer.validated_data
-        user = request.user
         
-        # اشتراک توسط SubscriptionMiddleware بررسی و ست شده
-        active_subscription = getattr(request, 'subscription', None) or user.get_active_subscription()
+        # Idempotency-Key: retry کلاینت دوباره اجرا نمی‌شود (نه پیام تکراری، نه فراخوانی Core، نه کسر سهمیه)
+        idempotency_key = request.headers.get(idempotency.IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return await self.process_query(request, data)
         
-        # دریافت یا ایجاد conversation
-        conversation_id = data.get('conversation_id')
-        conversation = None
+        if not idempotency.is_valid_key(idempotency_key):
+            return Response(
+                {'error': 'Idempotency-Key نامعتبر است', 'code': 'invalid_idempotency_key'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if conversation_id:
-            conversation = get_object_or_404(
-                Conversation,
-                id=conversation_id,
-                user=user
+        user_id = request.user.id
+        request_fingerprint = idempotency.fingerprint(
+            data['query'],
+            data.get('conversation_id'),
+            data.get('file_attachments'),
+            data.get('enable_web_search')
+        )
+        try:
+            outcome, record = await idempotency.acquire(user_id, idempotency_key, request_fingerprint)
+        except idempotency.IdempotencyKeyReused:
+            return Response(
+                {'error': 'این Idempotency-Key قبلاً برای درخواست دیگری استفاده شده است', 'code': 'idempotency_key_reused'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
             )
-        else:
-            # ایجاد conversation جدید
-            conversation = Conversation.objects.create(
-                user=user,
-                organization=user.organization,
-                title=data['query'][:50] + '...' if len(data['query']) > 50 else data['query'],
-                default_response_mode=data.get('response_mode', 'simple_explanation')
+        
+        if outcome == idempotency.REPLAY:
+            return Response(
+                record['body'],
+                status=record['status'],
+                headers={idempotency.REPLAYED_HEADER: 'true'}
+            )
+        if outcome == idempotency.IN_PROGRESS:
+            return Response(
+                {'error': 'درخواست قبلی با همین کلید هنوز در حال پردازش است', 'code': 'idempotency_in_progress', 'retryable': True},
+                status=status.HTTP_409_CONFLICT
             )
         
-        # ایجاد پیام کاربر
-        user_message = Message.objects.create(
-            conversation=conversation,
-            role='user',
-            content=data['query'],
-            response_mode=data.get('response_mode', 'simple_explanation'),
-            status='completed'
-        )
+        response = None
+        try:
+            response = await self.process_query(request, data)
+            return response
+        finally:
+            if response is not None and response.status_code == status.HTTP_200_OK:
+                await idempotency.finish(user_id, idempotency_key, request_fingerprint, response.status_code, response.data)
+            else:
+                await idempotency.finish(user_id, idempotency_key, request_fingerprint)
+    
+    async def process_query(self, request, data):
+        """ایجاد پیام‌ها، فراخوانی Core و ذخیره پاسخ"""
+        user = request.user
         
-        # ذخیره file attachments برای پیام کاربر
-        if 'file_attachments' in data and data['file_attachments']:
-            from chat.models import MessageAttachment
-            for file_data in data['file_attachments']:
-                MessageAttachment.objects.create(
-                    message=user_message,
-                    file=file_data['object_key'],  # object_key در MinIO
-                    file_name=file_data['filename'],
-                    file_size=file_data.get('size_bytes', 0),
-                    file_type='image' if file_data['file_type'].startswith('image/') else 'document',
-                    mime_type=file_data['file_type'],
-                    extraction_status='pending'
-                )
+        # ایجاد conversation، پیام کاربر، پیوست‌ها و پیام assistant (در حالت processing)
+        turn = await sync_to_async(start_turn)(user, data, getattr(request, 'subscription', None))
+        if turn is None:
+            raise Http404
         
-        # ایجاد پیام assistant (در حالت processing)
-        assistant_message = Message.objects.create(
-            conversation=conversation,
-            role='assistant',
-            content='',
-            status='processing'
-        )
+        conversation = turn['conversation']
+        assistant_message = turn['assistant_message']
         
         try:
-            # Generate JWT token for Core API
-            refresh = RefreshToken.for_user(user)
-            access_token = str(refresh.access_token)
-            
-            # آماده‌سازی file_attachments برای ارسال به RAG Core
-            file_attachments = None
-            if 'file_attachments' in data and data['file_attachments']:
-                # فایل‌ها قبلاً آپلود شده‌اند و object_key دارند
-                # Core RAG API انتظار minio_url دارد، پس object_key را به minio_url تبدیل می‌کنیم
-                file_attachments = [
-                    {
-                        'filename': f['filename'],
-                        'minio_url': f['object_key'],  # Core RAG انتظار minio_url دارد
-                        'file_type': f['file_type'],
-                        'size_bytes': f.get('size_bytes')
-                    }
-                    for f in data['file_attachments']
-                ]
-            
-            # ارسال به RAG Core به صورت async
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            # دریافت تنظیم enable_web_search از request یا preferences کاربر
-            enable_web_search = data.get('enable_web_search')
-            if enable_web_search is None and user.preferences:
-                enable_web_search = user.preferences.get('enable_web_search')
-            
-            response = loop.run_until_complete(
-                core_service.send_query(
-                    query=data['query'],
-                    token=access_token,
-                    conversation_id=conversation.rag_conversation_id or None,
-                    language=data.get('language', 'fa'),
-                    file_attachments=file_attachments,
-                    enable_web_search=enable_web_search
-                )
+            # ارسال به RAG Core (اولین سوال گفتگوی جدید از کش پاسخ)
+            response = await answer_cache.send_query(
+                query=data['query'],
+                token=turn['token'],
+                conversation_id=conversation.rag_conversation_id or None,
+                language=data.get('language', 'fa'),
+                file_attachments=turn['file_attachments'],
+                enable_web_search=turn['enable_web_search'],
+                priority=turn['priority'],
+                new_conversation=turn['new_conversation']
             )
             
-            # به‌روزرسانی conversation با ID از RAG Core
-            if not conversation.rag_conversation_id and 'conversation_id' in response:
-                conversation.rag_conversation_id = response.get('conversation_id')
-                conversation.save(update_fields=['rag_conversation_id'])
-            
             # DEBUG: Log raw response from RAG Core
-            import json
             logger.info(f"RAG Core raw response: {json.dumps(response, ensure_ascii=False, default=str)}")
             
-            # به‌روزرسانی پیام assistant - مطابق با API سیستم مرکزی
-            assistant_message.content = response.get('answer', '')
-            assistant_message.sources = response.get('sources', [])
-            assistant_message.status = 'completed'
-            assistant_message.tokens = response.get('tokens_used', 0)
-            assistant_message.processing_time_ms = response.get('processing_time_ms', 0)
-            assistant_message.cached = response.get('context_used', False)
-            assistant_message.rag_message_id = response.get('message_id', '')
-            
-            # ذخیره file_analysis اگر وجود داشته باشد
-            if 'file_analysis' in response:
-                assistant_message.metadata = assistant_message.metadata or {}
-                assistant_message.metadata['file_analysis'] = response['file_analysis']
-            
-            assistant_message.save()
-            
-            # به‌روزرسانی آمار و ثبت audit log در پس‌زمینه (Celery)
-            try:
-                from chat.tasks import log_audit, update_conversation_stats
-                update_conversation_stats.delay(str(conversation.id))
-                log_audit.delay(
-                    str(user.id),
-                    'chat_query',
-                    {
-                        'conversation_id': str(conversation.id),
-                        'query_length': len(data['query']),
-                        'tokens_used': assistant_message.tokens
-                    },
-                    request.META.get('REMOTE_ADDR'),
-                    request.META.get('HTTP_USER_AGENT', '')
-                )
-            except Exception as celery_err:
-                logger.warning(f"Celery dispatch failed, running sync: {celery_err}")
-                # Fallback: اجرای همزمان
-                conversation.message_count = conversation.messages.filter(role='user').count()
-                conversation.last_message_at = timezone.now()
-                conversation.save(update_fields=['message_count', 'last_message_at'])
-                AuditLog.objects.create(
-                    user=user,
-                    action='chat_query',
-                    details={
-                        'conversation_id': str(conversation.id),
-                        'query_length': len(data['query']),
-                        'tokens_used': assistant_message.tokens
-                    },
-                    ip_address=request.META.get('REMOTE_ADDR', '0.0.0.0'),
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')
-                )
+            # ذخیره پاسخ، آمار و audit log
+            await sync_to_async(finish_turn)(turn, response, {
+                'action': 'chat_query',
+                'query_length': len(data['query']),
+                'ip_address': request.META.get('REMOTE_ADDR'),
+                'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+            })
             
             # ثبت مصرف توسط SubscriptionMiddleware انجام می‌شود (بعد از response 200)
             
@@ -221,7 +252,8 @@ class QueryView(APIView):
                 'sources': assistant_message.sources,
                 'tokens_used': assistant_message.tokens,
                 'processing_time_ms': assistant_message.processing_time_ms,
-                'context_used': assistant_message.cached,
+                'context_used': response.get('context_used', False),
+                'cached': bool(response.get('cached')),
             }
             
             # اضافه کردن file_analysis اگر وجود داشته باشد
@@ -230,16 +262,30 @@ class QueryView(APIView):
             
             return Response(response_data, status=status.HTTP_200_OK)
             
+        except CoreOverloadedError as e:
+            logger.warning(f"Query rejected by Core admission control: {e.reason}")
+            # حذف پیام assistant چون خطا رخ داده
+            await sync_to_async(assistant_message.delete)()
+            return Response(
+                {
+                    'error': 'سرور پردازش در حال حاضر مشغول است. لطفاً چند لحظه دیگر دوباره تلاش کنید.',
+                    'code': 'core_overloaded',
+                    'retryable': True,
+                    'retry_after': e.retry_after
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(e.retry_after)}
+            )
         except RateLimitException as e:
             # حذف پیام assistant چون خطا رخ داده
-            assistant_message.delete()
+            await sync_to_async(assistant_message.delete)()
             return Response(
                 {'error': str(e), 'code': 'rate_limit_exceeded'},
                 status=status.HTTP_429_TOO_MANY_REQUESTS
             )
         except RAGCoreException as e:
             # حذف پیام assistant چون خطا رخ داده
-            assistant_message.delete()
+            await sync_to_async(assistant_message.delete)()
             return Response(
                 {'error': str(e), 'code': 'rag_core_error'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -256,7 +302,7 @@ class QueryView(APIView):
                 error_msg = f'خطا در پردازش درخواست (کد {e.response.status_code})'
             
             # حذف پیام assistant چون خطا رخ داده
-            assistant_message.delete()
+            await sync_to_async(assistant_message.delete)()
             return Response(
                 {'error': error_msg, 'code': 'rag_core_http_error'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -264,7 +310,7 @@ class QueryView(APIView):
         except httpx.TimeoutException as e:
             logger.error(f"RAG Core timeout: {str(e)}")
             # حذف پیام assistant چون خطا رخ داده
-            assistant_message.delete()
+            await sync_to_async(assistant_message.delete)()
             return Response(
                 {'error': 'زمان پردازش تمام شد. لطفاً دوباره تلاش کنید.', 'code': 'timeout'},
                 status=status.HTTP_504_GATEWAY_TIMEOUT
@@ -272,7 +318,7 @@ class QueryView(APIView):
         except httpx.ConnectError as e:
             logger.error(f"Cannot connect to RAG Core: {str(e)}")
             # حذف پیام assistant چون خطا رخ داده
-            assistant_message.delete()
+            await sync_to_async(assistant_message.delete)()
             return Response(
                 {'error': 'خطا در اتصال به سرور پردازش', 'code': 'connection_error'},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -280,7 +326,7 @@ class QueryView(APIView):
         except Exception as e:
             logger.error(f"Unexpected error in query: {str(e)}", exc_info=True)
             # حذف پیام assistant چون خطا رخ داده
-            assistant_message.delete()
+            await sync_to_async(assistant_message.delete)()
             return Response(
                 {'error': 'خطای غیرمنتظره در پردازش سوال'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -291,6 +337,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
     """مدیریت گفتگوها"""
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ConversationPagination
     
     def get_queryset(self):
         user = self.request.user
@@ -309,14 +356,10 @@ class ConversationViewSet(viewsets.ModelViewSet):
         if is_archived is not None:
             queryset = queryset.filter(is_archived=is_archived == 'true')
         
-        # جستجو
+        # جستجوی متن کامل (رتبه‌بندی شده با snippet)
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(description__icontains=search) |
-                Q(messages__content__icontains=search)
-            ).distinct()
+            queryset = search_conversations(queryset, search)
         
         return queryset
     
@@ -325,65 +368,113 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return ConversationDetailSerializer
         return ConversationSerializer
     
+    def retrieve(self, request, *args, **kwargs):
+        """
+        جزئیات گفتگو
+        
+        بدون پارامتر، همه پیام‌ها مانند قبل برگردانده می‌شوند. با ?messages=N
+        (یا fields/expand) فقط N پیام آخر به ترتیب زمانی، بدون sources/chunks/
+        file_analysis (مگر با ?expand=sources,chunks,file_analysis)، به همراه
+        لینک‌های cursor endpoint پیام‌ها برگردانده می‌شود:
+        messages_next -> پیام‌های قدیمی‌تر، messages_previous -> پیام‌های جدیدتر
+        """
+        options = message_options(request, triggers=('messages', 'fields', 'expand'))
+        if options is None:
+            return super().retrieve(request, *args, **kwargs)
+        
+        conversation = self.get_object()
+        data = ConversationSerializer(conversation, context=self.get_serializer_context()).data
+        data.update(self.recent_messages(request, conversation, options))
+        return Response(data)
+    
+    def recent_messages(self, request, conversation, options):
+        """N پیام آخر گفتگو با cursor صفحه‌بندی endpoint پیام‌ها"""
+        try:
+            limit = int(request.query_params.get('messages', DETAIL_MESSAGES_DEFAULT))
+        except ValueError:
+            limit = DETAIL_MESSAGES_DEFAULT
+        limit = min(max(limit, 1), DETAIL_MESSAGES_MAX)
+        
+        paginator = MessagePagination().get_cursor_paginator()
+        paginator.page_size = limit
+        paginator.page_size_query_param = None
+        queryset = light_messages(conversation.messages.all(), options['expand'])
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        
+        # لینک‌ها به endpoint پیام‌ها با همان پارامترهای حالت سبک
+        # (expand حتی خالی، حالت سبک را در endpoint پیام‌ها فعال می‌کند)
+        params = {'page_size': limit, 'expand': ','.join(sorted(options['expand']))}
+        if options['fields']:
+            params['fields'] = ','.join(sorted(options['fields']))
+        paginator.base_url = request.build_absolute_uri(
+            reverse('chat:conversation-messages-list', kwargs={'conversation_pk': conversation.pk})
+        ) + '?' + urlencode(params)
+        
+        context = {**self.get_serializer_context(), **options}
+        return {
+            'messages': MessageSerializer(reversed(page), many=True, context=context).data,
+            'messages_next': paginator.get_next_link(),
+            'messages_previous': paginator.get_previous_link(),
+        }
+    
+    def perform_create(self, serializer):
+        user = self.request.user
+        conversation = serializer.save(user=user, organization=user.organization)
+        # vector جستجو (عنوان پیش‌فرض مدل نیز قابل جستجو باشد)
+        Conversation.objects.filter(id=conversation.id).update(
+            search_vector=conversation_vector(conversation.title, conversation.description)
+        )
+    
+    def perform_update(self, serializer):
+        conversation = serializer.save()
+        # به‌روزرسانی vector جستجو در صورت تغییر عنوان/توضیحات
+        if {'title', 'description'} & set(serializer.validated_data):
+            Conversation.objects.filter(id=conversation.id).update(
+                search_vector=conversation_vector(conversation.title, conversation.description)
+            )
+    
+    def set_flag(self, field, value):
+        """تغییر یک فیلد بولی؛ فقط همان ستون (و updated_at) نوشته می‌شود"""
+        conversation = self.get_object()
+        setattr(conversation, field, value)
+        conversation.save(update_fields=[field, 'updated_at'])
+        return conversation
+    
     @action(detail=True, methods=['post'])
     def pin(self, request, pk=None):
         """پین کردن گفتگو"""
-        conversation = self.get_object()
-        conversation.is_pinned = True
-        conversation.save()
+        self.set_flag('is_pinned', True)
         return Response({'status': 'pinned'})
     
     @action(detail=True, methods=['post'])
     def unpin(self, request, pk=None):
         """برداشتن پین گفتگو"""
-        conversation = self.get_object()
-        conversation.is_pinned = False
-        conversation.save()
+        self.set_flag('is_pinned', False)
         return Response({'status': 'unpinned'})
     
     @action(detail=True, methods=['post'])
     def archive(self, request, pk=None):
         """آرشیو کردن گفتگو"""
-        conversation = self.get_object()
-        conversation.is_archived = True
-        conversation.save()
+        self.set_flag('is_archived', True)
         return Response({'status': 'archived'})
     
     @action(detail=True, methods=['post'])
     def unarchive(self, request, pk=None):
         """خارج کردن از آرشیو"""
-        conversation = self.get_object()
-        conversation.is_archived = False
-        conversation.save()
+        self.set_flag('is_archived', False)
         return Response({'status': 'unarchived'})
     
     def destroy(self, request, *args, **kwargs):
         """
         حذف گفتگو
-        ابتدا از Core حذف می‌شود، سپس از Django
-        اگر حذف از Core ناموفق باشد، خطا برمی‌گرداند
+        گفتگو بلافاصله پنهان می‌شود؛ حذف از Core و حذف نهایی در پس‌زمینه (chat.deletions)
         """
         conversation = self.get_object()
-        
-        try:
-            # Signal به طور خودکار حذف از Core را انجام می‌دهد
-            # اگر خطا رخ دهد، exception می‌فرستد و حذف متوقف می‌شود
-            conversation.delete()
-            
-            return Response(
-                {'message': 'گفتگو با موفقیت حذف شد'},
-                status=status.HTTP_204_NO_CONTENT
-            )
-            
-        except Exception as e:
-            logger.error(f"Failed to delete conversation {conversation.id}: {e}")
-            return Response(
-                {
-                    'error': 'خطا در حذف گفتگو',
-                    'detail': 'امکان حذف از سیستم مرکزی وجود ندارد. لطفا دوباره تلاش کنید.'
-                },
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        tombstone_conversations(Conversation.objects.filter(id=conversation.id))
+        return Response(
+            {'message': 'گفتگو با موفقیت حذف شد'},
+            status=status.HTTP_204_NO_CONTENT
+        )
     
     @action(detail=True, methods=['post'])
     def share(self, request, pk=None):
@@ -409,57 +500,49 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def export(self, request, pk=None):
-        """Export گفتگو به فرمت‌های مختلف"""
-        from django.http import HttpResponse
-        import csv
-        import io
-        
+        """Export گفتگو به فرمت‌های مختلف (streaming، بدون ساخت کل فایل در حافظه)"""
         conversation = self.get_object()
         serializer = ConversationExportSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
         export_format = serializer.validated_data['format']
-        messages = conversation.messages.all().order_by('created_at')
-        
-        if export_format == 'json':
-            data = {
-                'title': conversation.title,
-                'created_at': conversation.created_at.isoformat(),
-                'messages': [
-                    {
-                        'role': msg.role,
-                        'content': msg.content,
-                        'created_at': msg.created_at.isoformat()
-                    } for msg in messages
-                ]
-            }
-            return Response(data)
-        
-        elif export_format == 'txt':
-            content = f"گفتگو: {conversation.title}\n"
-            content += f"تاریخ: {conversation.created_at.strftime('%Y-%m-%d %H:%M')}\n"
-            content += "=" * 50 + "\n\n"
-            for msg in messages:
-                role = "کاربر" if msg.role == "user" else "دستیار"
-                content += f"[{role}] {msg.created_at.strftime('%H:%M')}\n{msg.content}\n\n"
-            
-            response = HttpResponse(content, content_type='text/plain; charset=utf-8')
-            response['Content-Disposition'] = f'attachment; filename="conversation_{pk}.txt"'
-            return response
+        response = streaming_export_response(request, conversation, export_format)
+        if response is None:
+            return Response({'error': 'فرمت نامعتبر'}, status=400)
+        return response
+    
+    @action(detail=False, methods=['get', 'post'], url_path='export-all')
+    def export_all(self, request):
+        """
+        Export همه گفتگوهای کاربر به صورت ZIP در پس‌زمینه
         
-        elif export_format == 'csv':
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['نقش', 'پیام', 'زمان'])
-            for msg in messages:
-                role = "کاربر" if msg.role == "user" else "دستیار"
-                writer.writerow([role, msg.content, msg.created_at.strftime('%Y-%m-%d %H:%M')])
-            
-            response = HttpResponse(output.getvalue(), content_type='text/csv; charset=utf-8')
-            response['Content-Disposition'] = f'attachment; filename="conversation_{pk}.csv"'
-            return response
+        GET: وضعیت آخرین export (درصد پیشرفت و لینک دانلود در صورت آماده بودن)
+        POST: شروع export جدید؛ اگر export در حال اجرا باشد همان برگردانده
+        می‌شود و export ناموفق از آخرین checkpoint ادامه پیدا می‌کند
+        """
+        latest = ConversationExport.objects.filter(user=request.user).first()
+        
+        if request.method == 'GET':
+            if latest is None:
+                return Response({'error': 'خروجی‌ای یافت نشد'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(ConversationExportJobSerializer(latest).data)
+        
+        if latest is not None and latest.status in ('pending', 'processing'):
+            return Response(ConversationExportJobSerializer(latest).data, status=status.HTTP_202_ACCEPTED)
+        
+        serializer = ConversationExportJobSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        if latest is not None and latest.status == 'failed' and \
+                latest.format == serializer.validated_data.get('format', latest.format):
+            export = latest
+            export.status = 'pending'
+            export.save(update_fields=['status', 'updated_at'])
+        else:
+            export = serializer.save(user=request.user)
         
-        return Response({'error': 'فرمت نامعتبر'}, status=400)
+        export_conversations.delay(str(export.id))
+        return Response(ConversationExportJobSerializer(export).data, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=False, methods=['post'])
     def bulk_action(self, request):
@@ -476,35 +559,69 @@ class ConversationViewSet(viewsets.ModelViewSet):
             user=request.user
         )
         
+        # هر عملیات یک UPDATE است؛ تعداد ردیف‌های تغییر یافته از همان UPDATE خوانده می‌شود
+        now = timezone.now()
         if action == 'archive':
-            conversations.update(is_archived=True)
+            affected = conversations.update(is_archived=True, updated_at=now)
         elif action == 'unarchive':
-            conversations.update(is_archived=False)
+            affected = conversations.update(is_archived=False, updated_at=now)
         elif action == 'delete':
-            conversations.delete()
+            affected = tombstone_conversations(conversations)
         elif action == 'move_to_folder':
             folder_id = data.get('folder_id')
-            conversations.update(folder_id=folder_id)
+            affected = conversations.update(folder_id=folder_id, updated_at=now)
         elif action == 'tag':
-            tags = data.get('tags', [])
-            for conv in conversations:
-                conv.tags = list(set(conv.tags + tags))
-                conv.save()
+            affected = conversations.update(tags=merge_tags(data.get('tags', [])), updated_at=now)
         
-        return Response({'status': 'success', 'affected': conversations.count()})
+        return Response({'status': 'success', 'affected': affected})
 
 
 class MessageViewSet(viewsets.ModelViewSet):
     """مدیریت پیام‌ها"""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessagePagination
     
     def get_queryset(self):
         conversation_id = self.kwargs.get('conversation_pk')
-        return Message.objects.filter(
+        queryset = Message.objects.filter(
             conversation_id=conversation_id,
-            conversation__user=self.request.user
+            conversation__user=self.request.user,
+            conversation__deleted_at__isnull=True
         )
+        options = self.get_message_options()
+        if options is not None:
+            queryset = light_messages(queryset, options['expand'])
+        return queryset
+    
+    def get_message_options(self):
+        # حالت سبک فقط برای خواندن؛ منابع با action جداگانه sources
+        if self.action not in ('list', 'retrieve'):
+            return None
+        return message_options(self.request)
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        options = self.get_message_options()
+        if options is not None:
+            context.update(options)
+        return context
+    
+    @action(detail=True, methods=['get'])
+    def sources(self, request, conversation_pk=None, pk=None):
+        """
+        بارگذاری تنبل منابع یک پیام
+        
+        chunks و file_analysis با ?expand=chunks,file_analysis اضافه می‌شوند.
+        """
+        message = self.get_object()
+        expand = {'sources'} | (_split_param(request, 'expand') & set(MESSAGE_HEAVY_FIELDS))
+        serializer = MessageSerializer(message, context={
+            **self.get_serializer_context(),
+            'expand': expand,
+            'fields': {'id'},
+        })
+        return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
     def feedback(self, request, conversation_pk=None, pk=None):
@@ -545,7 +662,10 @@ class ConversationFolderViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return ConversationFolder.objects.filter(user=self.request.user)
+        # Meta.ordering در query های GROUP BY اعمال نمی‌شود
+        return ConversationFolder.objects.filter(user=self.request.user).annotate(
+            conversations_count=Count('conversation', filter=Q(conversation__deleted_at__isnull=True))
+        ).order_by('order', 'name')
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -589,7 +709,8 @@ class SharedConversationView(APIView):
         """دریافت گفتگوی اشتراکی"""
         shared = get_object_or_404(
             SharedConversation,
-            share_token=share_token
+            share_token=share_token,
+            conversation__deleted_at__isnull=True
         )
         
         # بررسی انقضا
@@ -635,6 +756,14 @@ class HealthCheckView(APIView):
         from asgiref.sync import async_to_sync
         result = async_to_sync(core_service.health_check)()
         
+        # آمار connection pool فقط برای ادمین‌ها (برای تنظیم اندازه pool)
+        if request.user.is_staff:
+            result['pool'] = core_service.pool_stats()
+            result['answer_cache'] = answer_cache.stats()
+            result['admission'] = core_service.admission.stats()
+            result['priority_queue'] = async_to_sync(core_service.priority.stats)()
+            result['storage_cleanup'] = cleanup_stats()
+        
         status_code = status.HTTP_200_OK if result['status'] == 'connected' else status.HTTP_503_SERVICE_UNAVAILABLE
         
         return Response(result, status=status_code)
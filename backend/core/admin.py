@@ -2,7 +2,7 @@
 Override admin for third-party apps to add Persian names
 This will be called from accounts/apps.py ready() method
 """
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.models import Group
 from django.apps import apps
 from django.utils.translation import gettext_lazy as _
@@ -58,6 +58,24 @@ class SiteSettingsAdmin(admin.ModelAdmin):
         # Prevent deletion of settings
         return False
     
+    actions = ['purge_answer_cache']
+    
+    def purge_answer_cache(self, request, queryset):
+        """پاکسازی کش پاسخ سوالات تکراری (پس از به‌روزرسانی پایگاه دانش Core)"""
+        from chat import answer_cache
+        
+        cache_stats = answer_cache.stats()
+        try:
+            deleted = answer_cache.purge()
+        except Exception as e:
+            self.message_user(request, f'خطا در پاکسازی کش پاسخ‌ها: {e}', level=messages.ERROR)
+            return
+        self.message_user(
+            request,
+            f'{deleted} پاسخ از کش حذف شد (نرخ hit: {cache_stats.get("hit_rate", 0):.1%})'
+        )
+    purge_answer_cache.short_description = 'پاکسازی کش پاسخ‌ها'
+    
     fieldsets = (
         (_('تنظیمات سایت'), {
             'fields': (
@@ -17,10 +17,11 @@ django_asgi_app = get_asgi_application()
 
 # Import WebSocket routing after Django setup
 from chat import routing as chat_routing
+from core.middleware import StreamDisconnectMiddleware
 
 application = ProtocolTypeRouter({
-    # HTTP handler
-    "http": django_asgi_app,
+    # HTTP handler (streaming responses are cancelled when the client disconnects)
+    "http": StreamDisconnectMiddleware(django_asgi_app),
     
     # WebSocket handler
     "websocket": AllowedHostsOriginValidator(
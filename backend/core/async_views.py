@@ -0,0 +1,53 @@
+"""
+Async adapter برای DRF views
+DRF (3.14) از view های async پشتیبانی نمی‌کند؛ این کلاس احراز هویت، مجوزها
+و throttling را در یک thread hop انجام می‌دهد و سپس handler async را مستقیماً
+روی event loop سرور اجرا می‌کند.
+"""
+import asyncio
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView با handler های async (مثلاً ``async def post``).
+
+    - ``initial()`` (authentication, permissions, throttles) با یک sync_to_async اجرا می‌شود
+    - handler بدون thread hop await می‌شود؛ کار ORM داخل handler باید با
+      sync_to_async (ترجیحاً گروهی) انجام شود
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # csrf_exempt در DRF تابع را wrap می‌کند؛ علامت coroutine را تضمین می‌کنیم
+        markcoroutinefunction(view)
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(),
+                                  self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+
+        except Exception as exc:
+            response = await sync_to_async(self.handle_exception)(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
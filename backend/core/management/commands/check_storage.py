@@ -0,0 +1,101 @@
+"""
+Management command to verify the MinIO/S3 bucket at deploy time
+
+S3Service در زمان اجرا bucket را بررسی نمی‌کند؛ این دستور یک بار در deploy
+(پس از migrate) اجرا می‌شود و در صورت نیاز bucket را می‌سازد. اگر
+S3_TEMP_LIFECYCLE_DAYS یا S3_EXPORT_LIFECYCLE_DAYS تنظیم شده باشد قانون انقضای
+temp_uploads/ یا exports/ هم نصب می‌شود.
+
+Usage:
+    python manage.py check_storage
+    python manage.py check_storage --no-create
+    python manage.py check_storage --benchmark
+"""
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.storage import S3Service
+
+# import سرد core.storage در یک process جدید (پس از django.setup)
+COLD_IMPORT_SCRIPT = '''
+import os, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+import django
+django.setup()
+start = time.perf_counter()
+import core.storage
+print((time.perf_counter() - start) * 1000, 'boto3' in sys.modules)
+'''
+
+
+class Command(BaseCommand):
+    help = 'Check (and create if missing) the S3/MinIO bucket; optionally benchmark storage startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-create',
+            action='store_true',
+            help='Only check the bucket, do not create it',
+        )
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='Measure cold import, client creation and first request latency',
+        )
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark()
+
+        service = S3Service()
+        try:
+            state = service.ensure_bucket(create=not options['no_create'])
+        except Exception as e:
+            raise CommandError(f'Bucket {service.bucket_name} check failed: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Bucket {service.bucket_name}: {state}'))
+
+        # انقضای temp_uploads/ و exports/ توسط خود MinIO (پاکسازی دوره‌ای همچنان به عنوان پشتیبان اجرا می‌شود)
+        from chat.exports import EXPORT_PREFIX
+        
+        rules = [
+            (service.temp_prefix, getattr(settings, 'S3_TEMP_LIFECYCLE_DAYS', 0)),
+            (EXPORT_PREFIX, getattr(settings, 'S3_EXPORT_LIFECYCLE_DAYS', 0)),
+        ]
+        for prefix, days in rules:
+            if not days or options['no_create']:
+                continue
+            try:
+                service.ensure_lifecycle_rule(prefix, days)
+            except Exception as e:
+                raise CommandError(f'Lifecycle rule for {prefix} failed: {e}')
+            self.stdout.write(self.style.SUCCESS(f'✅ Lifecycle: {prefix} expires after {days} days'))
+
+    def benchmark(self):
+        script = COLD_IMPORT_SCRIPT.format(settings_module=settings.SETTINGS_MODULE)
+        result = subprocess.run(
+            [sys.executable, '-c', script],
+            capture_output=True, text=True, timeout=120
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Cold import failed: {result.stderr.strip()}')
+        import_ms, boto3_loaded = result.stdout.split()[-2:]
+        self.stdout.write(f'cold import core.storage: {float(import_ms):.1f} ms (boto3 loaded: {boto3_loaded})')
+
+        service = S3Service()
+        start = time.perf_counter()
+        service.s3_client
+        self.stdout.write(f'client creation (first use): {(time.perf_counter() - start) * 1000:.1f} ms')
+
+        for label in ('first head_bucket', 'warm head_bucket'):
+            start = time.perf_counter()
+            try:
+                service.s3_client.head_bucket(Bucket=service.bucket_name)
+                outcome = 'ok'
+            except Exception as e:
+                outcome = type(e).__name__
+            self.stdout.write(f'{label}: {(time.perf_counter() - start) * 1000:.1f} ms ({outcome})')
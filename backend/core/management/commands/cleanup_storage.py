@@ -0,0 +1,39 @@
+"""
+Management command to remove expired temporary uploads from MinIO
+
+همان پاکسازی تسک core.tasks.cleanup_old_files (دسته‌های 1000 تایی delete_objects
+به صورت موازی)، برای اجرا از cron یا به صورت دستی.
+
+Usage:
+    python manage.py cleanup_storage
+    python manage.py cleanup_storage --hours 48 --concurrency 8
+"""
+from django.core.management.base import BaseCommand
+
+from core.tasks import cleanup_old_files
+
+
+class Command(BaseCommand):
+    help = 'Delete expired temp_uploads/ objects and unreferenced blobs from MinIO in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=None,
+            help='Delete temporary uploads older than N hours (default: TEMP_UPLOAD_RETENTION_HOURS)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Delete batches running in parallel (default: S3_CLEANUP_CONCURRENCY)',
+        )
+
+    def handle(self, *args, **options):
+        result = cleanup_old_files(hours=options['hours'], concurrency=options['concurrency'])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Deleted {result['objects']} objects ({result['bytes'] / (1024 * 1024):.1f} MB) "
+            f"of {result['scanned']} scanned in {result['batches']} batches, "
+            f"{result['blobs_deleted']} unreferenced blobs, {result['errors']} errors"
+        ))
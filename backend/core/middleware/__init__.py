@@ -3,5 +3,7 @@ Core middleware
 """
 from .timezone_middleware import TimezoneMiddleware
 from .admin_title_middleware import DynamicAdminTitleMiddleware
+from .static_middleware import AsyncWhiteNoiseMiddleware
+from .disconnect_middleware import StreamDisconnectMiddleware
 
-__all__ = ['TimezoneMiddleware', 'DynamicAdminTitleMiddleware']
+__all__ = ['TimezoneMiddleware', 'DynamicAdminTitleMiddleware', 'AsyncWhiteNoiseMiddleware', 'StreamDisconnectMiddleware']
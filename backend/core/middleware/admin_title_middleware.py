@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.conf import settings
 from datetime import datetime
 
@@ -5,29 +6,46 @@ from datetime import datetime
 class DynamicAdminTitleMiddleware:
     """Middleware to dynamically set admin site title from SiteSettings"""
     
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
         # Only process admin requests
         if request.path.startswith('/admin/'):
-            try:
-                from core.models import SiteSettings
-                site_settings = SiteSettings.get_settings()
-                if site_settings and site_settings.admin_site_name:
-                    from django.contrib import admin
-                    admin.site.site_header = site_settings.admin_site_name
-                    admin.site.site_title = site_settings.admin_site_name
-                    admin.site.index_title = f"خوش آمدید به {site_settings.admin_site_name}"
-                    
-                    # Update Jazzmin settings dynamically
-                    if hasattr(settings, 'JAZZMIN_SETTINGS'):
-                        settings.JAZZMIN_SETTINGS['copyright'] = site_settings.copyright_text or f"{site_settings.admin_site_name} © {datetime.now().year}"
-                        settings.JAZZMIN_SETTINGS['site_title'] = site_settings.admin_site_name
-                        settings.JAZZMIN_SETTINGS['site_header'] = site_settings.admin_site_name
-                        settings.JAZZMIN_SETTINGS['welcome_sign'] = f"خوش آمدید به {site_settings.admin_site_name}"
-            except Exception:
-                pass
+            self.update_admin_title()
         
         response = self.get_response(request)
         return response
+    
+    async def __acall__(self, request):
+        if request.path.startswith('/admin/'):
+            await sync_to_async(self.update_admin_title)()
+        
+        return await self.get_response(request)
+    
+    def update_admin_title(self):
+        try:
+            from core.models import SiteSettings
+            site_settings = SiteSettings.get_settings()
+            if site_settings and site_settings.admin_site_name:
+                from django.contrib import admin
+                admin.site.site_header = site_settings.admin_site_name
+                admin.site.site_title = site_settings.admin_site_name
+                admin.site.index_title = f"خوش آمدید به {site_settings.admin_site_name}"
+                
+                # Update Jazzmin settings dynamically
+                if hasattr(settings, 'JAZZMIN_SETTINGS'):
+                    settings.JAZZMIN_SETTINGS['copyright'] = site_settings.copyright_text or f"{site_settings.admin_site_name} © {datetime.now().year}"
+                    settings.JAZZMIN_SETTINGS['site_title'] = site_settings.admin_site_name
+                    settings.JAZZMIN_SETTINGS['site_header'] = site_settings.admin_site_name
+                    settings.JAZZMIN_SETTINGS['welcome_sign'] = f"خوش آمدید به {site_settings.admin_site_name}"
+        except Exception:
+            pass
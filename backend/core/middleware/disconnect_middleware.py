@@ -0,0 +1,75 @@
+"""
+لغو پاسخ‌های streaming با قطع اتصال کلاینت (middleware در سطح ASGI)
+ASGIHandler در Django 4.2 پس از خواندن بدنه درخواست دیگر receive() را نمی‌خواند؛
+با قطع اتصال، generator پاسخ streaming (مثلاً SSE سوال) تا پایان پاسخ Core ادامه
+می‌یابد و slot صف اولویت و admission را نگه می‌دارد.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler
+
+logger = logging.getLogger(__name__)
+
+
+class StreamDisconnectMiddleware:
+    """
+    گوش دادن به http.disconnect در حین ارسال پاسخ streaming و لغو task درخواست
+
+    لغو فقط پس از شروع ارسال بدنه به صورت تکه‌ای (more_body) انجام می‌شود؛
+    پاسخ‌های معمولی و view های در حال اجرا لغو نمی‌شوند. CancelledError در
+    generator پاسخ رخ می‌دهد تا درخواست upstream را ببندد و نتیجه را ذخیره کند.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        body_received = asyncio.Event()
+        streaming = asyncio.Event()
+        finished = False
+        disconnected = False
+
+        async def receive_request():
+            message = await receive()
+            if message['type'] != 'http.request' or not message.get('more_body', False):
+                body_received.set()
+            return message
+
+        async def send_response(message):
+            nonlocal finished
+            if message['type'] == 'http.response.body':
+                if message.get('more_body', False):
+                    streaming.set()
+                else:
+                    finished = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, receive_request, send_response))
+
+        async def watch():
+            nonlocal disconnected
+            await body_received.wait()
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            await streaming.wait()
+            if not finished:
+                disconnected = True
+                app_task.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            logger.info(f"Client disconnected, cancelled streaming response: {scope.get('path')}")
+            # مانند response.close() در ASGIHandler (که با لغو اجرا نمی‌شود)
+            await sync_to_async(signals.request_finished.send, thread_sensitive=True)(sender=ASGIHandler)
+        finally:
+            watcher.cancel()
@@ -0,0 +1,38 @@
+"""
+WhiteNoise با پشتیبانی از async
+WhiteNoiseMiddleware (6.x) فقط sync است و در زنجیره middleware باعث می‌شود
+همه درخواست‌ها (حتی view های async) در thread pool اجرا شوند.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    همان WhiteNoiseMiddleware؛ در حالت async فقط سرو فایل استاتیک در thread
+    انجام می‌شود و سایر درخواست‌ها مستقیماً await می‌شوند.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=None):
+        if settings is None:
+            super().__init__(get_response)
+        else:
+            super().__init__(get_response, settings=settings)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
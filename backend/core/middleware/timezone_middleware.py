@@ -1,6 +1,7 @@
 """
 Middleware to activate user's timezone
 """
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils import timezone
 import pytz
 
@@ -9,18 +10,21 @@ class TimezoneMiddleware:
     """
     Middleware برای فعال‌سازی timezone کاربر
     """
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # دریافت timezone کاربر
-        if request.user.is_authenticated:
-            user_timezone = self.get_user_timezone(request.user)
-            if user_timezone:
-                timezone.activate(user_timezone)
-        else:
-            # برای کاربران مهمان، از تهران استفاده کن
-            timezone.activate(pytz.timezone('Asia/Tehran'))
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        user_timezone = self.resolve_timezone(request)
+        if user_timezone:
+            timezone.activate(user_timezone)
         
         response = self.get_response(request)
         
@@ -29,6 +33,26 @@ class TimezoneMiddleware:
         
         return response
     
+    async def __acall__(self, request):
+        # request.user به صورت lazy از دیتابیس خوانده می‌شود؛ فعال‌سازی در context خود درخواست
+        user_timezone = await sync_to_async(self.resolve_timezone)(request)
+        if user_timezone:
+            timezone.activate(user_timezone)
+        
+        response = await self.get_response(request)
+        
+        timezone.deactivate()
+        
+        return response
+    
+    def resolve_timezone(self, request):
+        """تعیین timezone درخواست"""
+        # دریافت timezone کاربر
+        if request.user.is_authenticated:
+            return self.get_user_timezone(request.user)
+        # برای کاربران مهمان، از تهران استفاده کن
+        return pytz.timezone('Asia/Tehran')
+    
     def get_user_timezone(self, user):
         """دریافت timezone کاربر"""
         try:
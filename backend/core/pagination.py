@@ -0,0 +1,89 @@
+"""
+Pagination classes
+
+HybridPagination: صفحه‌بندی keyset (cursor) برای اسکرول بی‌نهایت، با حفظ
+صفحه‌بندی شماره‌ای قبلی برای سازگاری با کلاینت‌های موجود.
+
+- حالت پیش‌فرض: ?page=N (مانند قبل: count/next/previous/results)
+- حالت cursor: ?pagination=cursor برای صفحه اول، سپس لینک‌های next/previous
+  next   -> موارد بعدی در ترتیب (مثلاً پیام‌های قدیمی‌تر)
+  previous -> موارد قبلی در ترتیب (مثلاً پیام‌های جدیدتر از اولین مورد دریافت شده)
+"""
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    CursorPagination دو طرفه
+
+    برخلاف رفتار پیش‌فرض DRF، صفحه اول هم لینک previous دارد و اگر مورد
+    جدیدتری وجود نداشته باشد همان cursor برگردانده می‌شود؛ کلاینت می‌تواند
+    با آن به صورت دوره‌ای موارد جدید را دریافت کند.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # ترتیب ثابت مطابق index؛ OrderingFilter در حالت cursor اعمال نمی‌شود
+        if isinstance(self.ordering, str):
+            return (self.ordering,)
+        return tuple(self.ordering)
+
+    def get_previous_link(self):
+        if not self.page and self.cursor is not None and self.cursor.reverse:
+            return self.encode_cursor(self.cursor)
+        if self.page and not self.has_previous:
+            # لینک موارد قبل از اولین مورد این صفحه (حتی اگر فعلاً موردی نباشد)
+            self.has_previous = True
+            self.previous_position = None
+        return super().get_previous_link()
+
+
+class HybridPagination(BasePagination):
+    """
+    انتخاب بین cursor و page-number بر اساس پارامترهای درخواست
+
+    زیرکلاس‌ها ordering را مطابق index مربوطه تعیین می‌کنند.
+    """
+    ordering = '-created_at'
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+
+    def use_cursor(self, request, view=None):
+        return (
+            self.cursor_query_param in request.query_params or
+            request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+
+    def get_cursor_paginator(self):
+        paginator = KeysetPagination()
+        paginator.ordering = self.ordering
+        paginator.cursor_query_param = self.cursor_query_param
+        return paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request, view):
+            self.paginator = self.get_cursor_paginator()
+        else:
+            self.paginator = PageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return PageNumberPagination().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        cursor_paginator = self.get_cursor_paginator()
+        return [
+            *PageNumberPagination().get_schema_operation_parameters(view),
+            *cursor_paginator.get_schema_operation_parameters(view),
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': "'cursor' for keyset pagination (first page)",
+                'schema': {'type': 'string', 'enum': ['cursor']},
+            },
+        ]
@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party apps
     'rest_framework',
@@ -51,7 +52,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise with async support
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -252,6 +253,10 @@ SIMPLE_JWT = {
     'JTI_CLAIM': 'jti',
 }
 
+# توکن سرویس برای فراخوانی Core API (کش شده per-user در Redis)
+RAG_CORE_TOKEN_LIFETIME = config('RAG_CORE_TOKEN_LIFETIME', default=900, cast=int)  # seconds
+RAG_CORE_TOKEN_RENEW_BEFORE = config('RAG_CORE_TOKEN_RENEW_BEFORE', default=120, cast=int)  # seconds
+
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = config(
     'CORS_ALLOWED_ORIGINS',
@@ -260,6 +265,7 @@ CORS_ALLOWED_ORIGINS = config(
 )
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = False  # Security: Only allow specified origins
+CORS_EXPOSE_HEADERS = ['idempotent-replayed', 'retry-after']
 CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
@@ -270,6 +276,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
 ]
 
 # Email Configuration
@@ -329,6 +336,16 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'support.tasks.auto_close_answered_tickets',
         'schedule': crontab(minute='*/30'),
     },
+    # حذف فایل‌های export قدیمی گفتگوها - هر شب ساعت 2:30
+    'expire-conversation-exports': {
+        'task': 'chat.tasks.expire_conversation_exports',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    # حذف گفتگوها از RAG Core (تلاش مجدد موارد ناموفق) - هر دقیقه
+    'drain-core-deletions': {
+        'task': 'chat.tasks.drain_core_deletions',
+        'schedule': crontab(minute='*'),
+    },
 }
 
 # Payment Gateways
@@ -554,6 +571,27 @@ S3_USERS_BUCKET = config('S3_USERS_BUCKET', default='users-system')
 S3_USE_SSL = config('S3_USE_SSL', default=True, cast=bool)
 S3_REGION = config('S3_REGION', default='us-east-1')
 
+# کلاینت S3 (core.storage، در اولین استفاده ساخته می‌شود؛ bucket با manage.py check_storage بررسی می‌شود)
+S3_MAX_POOL_CONNECTIONS = config('S3_MAX_POOL_CONNECTIONS', default=20, cast=int)
+S3_CONNECT_TIMEOUT = config('S3_CONNECT_TIMEOUT', default=5, cast=float)  # seconds
+S3_READ_TIMEOUT = config('S3_READ_TIMEOUT', default=60, cast=float)  # seconds
+S3_MAX_ATTEMPTS = config('S3_MAX_ATTEMPTS', default=3, cast=int)
+
+# پاکسازی فایل‌های موقت (core.tasks.cleanup_old_files): مهلت نگهداری، تعداد دسته‌های حذف موازی و
+# قانون lifecycle اختیاری MinIO برای temp_uploads/ (روز، 0 = غیرفعال؛ با manage.py check_storage نصب می‌شود)
+TEMP_UPLOAD_RETENTION_HOURS = config('TEMP_UPLOAD_RETENTION_HOURS', default=24, cast=int)
+S3_CLEANUP_CONCURRENCY = config('S3_CLEANUP_CONCURRENCY', default=4, cast=int)
+S3_TEMP_LIFECYCLE_DAYS = config('S3_TEMP_LIFECYCLE_DAYS', default=0, cast=int)
+S3_EXPORT_LIFECYCLE_DAYS = config('S3_EXPORT_LIFECYCLE_DAYS', default=0, cast=int)  # پشتیبان انقضای exports/ (بیشتر از مهلت نگهداری export)
+
+# آپلود تدریجی فایل‌ها (chat/upload_views): اندازه تکه multipart و تعداد آپلود همزمان در هر درخواست
+S3_MULTIPART_CHUNK_SIZE = config('S3_MULTIPART_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)  # bytes (min 5MB)
+UPLOAD_CONCURRENCY = config('UPLOAD_CONCURRENCY', default=3, cast=int)
+
+# آپلود مستقیم به MinIO (presigned POST): آدرس عمومی MinIO برای مرورگر و اعتبار policy
+S3_PUBLIC_ENDPOINT_URL = config('S3_PUBLIC_ENDPOINT_URL', default='')  # empty = S3_ENDPOINT_URL
+UPLOAD_PRESIGN_TTL = config('UPLOAD_PRESIGN_TTL', default=900, cast=int)  # seconds
+
 # Configure Django storage backends
 STORAGES = {
     "default": {
@@ -578,3 +616,58 @@ STORAGES = {
 RAG_CORE_BASE_URL = config('RAG_CORE_BASE_URL', default='')
 RAG_CORE_API_KEY = config('RAG_CORE_API_KEY', default='')
 RAG_CORE_TIMEOUT = config('RAG_CORE_TIMEOUT', default=300, cast=int)  # seconds (5 minutes for file processing)
+
+# RAG Core connection pool (keep-alive)
+RAG_CORE_MAX_CONNECTIONS = config('RAG_CORE_MAX_CONNECTIONS', default=100, cast=int)
+RAG_CORE_MAX_KEEPALIVE_CONNECTIONS = config('RAG_CORE_MAX_KEEPALIVE_CONNECTIONS', default=20, cast=int)
+RAG_CORE_KEEPALIVE_EXPIRY = config('RAG_CORE_KEEPALIVE_EXPIRY', default=30, cast=int)  # seconds
+RAG_CORE_HTTP2 = config('RAG_CORE_HTTP2', default=False, cast=bool)  # requires 'h2' package
+
+# Single-flight: سوالات یکسان همزمان بدون context یک درخواست مشترک به Core دارند
+RAG_CORE_COALESCE_QUERIES = config('RAG_CORE_COALESCE_QUERIES', default=True, cast=bool)
+RAG_CORE_COALESCE_RESULT_TTL = config('RAG_CORE_COALESCE_RESULT_TTL', default=10, cast=int)  # seconds
+
+# Answer cache (exact-match) برای سوالات تکراری بدون context
+ANSWER_CACHE_ENABLED = config('ANSWER_CACHE_ENABLED', default=True, cast=bool)
+ANSWER_CACHE_TTL = config('ANSWER_CACHE_TTL', default=86400, cast=int)  # seconds
+ANSWER_CACHE_MAX_ENTRIES = config('ANSWER_CACHE_MAX_ENTRIES', default=10000, cast=int)
+
+# RAG Core admission control (محدودیت همزمانی تطبیقی + circuit breaker، به ازای هر process)
+RAG_CORE_INITIAL_CONCURRENCY = config('RAG_CORE_INITIAL_CONCURRENCY', default=20, cast=int)
+RAG_CORE_MIN_CONCURRENCY = config('RAG_CORE_MIN_CONCURRENCY', default=2, cast=int)
+RAG_CORE_MAX_CONCURRENCY = config('RAG_CORE_MAX_CONCURRENCY', default=80, cast=int)
+# زمان هدف تا اولین بایت پاسخ streaming (پاسخ‌های non-streaming در تطبیق limit اندازه‌گیری نمی‌شوند)
+RAG_CORE_LATENCY_TARGET = config('RAG_CORE_LATENCY_TARGET', default=20, cast=float)  # seconds
+RAG_CORE_LIMIT_BACKOFF = config('RAG_CORE_LIMIT_BACKOFF', default=0.7, cast=float)
+RAG_CORE_MAX_QUEUE = config('RAG_CORE_MAX_QUEUE', default=100, cast=int)
+RAG_CORE_QUEUE_TIMEOUT = config('RAG_CORE_QUEUE_TIMEOUT', default=10, cast=float)  # seconds
+RAG_CORE_BREAKER_FAILURES = config('RAG_CORE_BREAKER_FAILURES', default=5, cast=int)
+RAG_CORE_BREAKER_COOLDOWN = config('RAG_CORE_BREAKER_COOLDOWN', default=30, cast=float)  # seconds
+
+# صف اولویت سراسری Core بر اساس پلن (هماهنگ بین replica ها از طریق Redis)
+RAG_CORE_PRIORITY_ENABLED = config('RAG_CORE_PRIORITY_ENABLED', default=True, cast=bool)
+RAG_CORE_GLOBAL_CONCURRENCY = config('RAG_CORE_GLOBAL_CONCURRENCY', default=60, cast=int)
+RAG_CORE_TIER_WEIGHTS = {
+    'enterprise': config('RAG_CORE_WEIGHT_ENTERPRISE', default=6, cast=int),
+    'premium': config('RAG_CORE_WEIGHT_PREMIUM', default=3, cast=int),
+    'free': config('RAG_CORE_WEIGHT_FREE', default=1, cast=int),
+}
+RAG_CORE_USER_MAX_IN_FLIGHT = config('RAG_CORE_USER_MAX_IN_FLIGHT', default=2, cast=int)
+RAG_CORE_PRIORITY_QUEUE_TIMEOUT = config('RAG_CORE_PRIORITY_QUEUE_TIMEOUT', default=60, cast=float)  # seconds
+RAG_CORE_PRIORITY_POLL_INTERVAL = config('RAG_CORE_PRIORITY_POLL_INTERVAL', default=0.25, cast=float)  # seconds
+RAG_CORE_PRIORITY_LEASE_TTL = config('RAG_CORE_PRIORITY_LEASE_TTL', default=60, cast=float)  # seconds، هر TTL/3 تمدید می‌شود
+
+# Idempotency-Key برای ارسال سوال (retry های کلاینت دوباره اجرا نمی‌شوند)
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=86400, cast=int)  # seconds
+IDEMPOTENCY_PROCESSING_TTL = config('IDEMPOTENCY_PROCESSING_TTL', default=RAG_CORE_TIMEOUT + 60, cast=int)  # seconds
+IDEMPOTENCY_WAIT_TIMEOUT = config('IDEMPOTENCY_WAIT_TIMEOUT', default=30, cast=float)  # seconds
+
+# Export همه گفتگوها (ZIP در MinIO، chat.exports)
+CONVERSATION_EXPORT_BATCH_SIZE = config('CONVERSATION_EXPORT_BATCH_SIZE', default=200, cast=int)  # conversations per checkpoint
+CONVERSATION_EXPORT_URL_TTL = config('CONVERSATION_EXPORT_URL_TTL', default=86400, cast=int)  # seconds (presigned link)
+CONVERSATION_EXPORT_RETENTION_HOURS = config('CONVERSATION_EXPORT_RETENTION_HOURS', default=168, cast=int)  # فایل‌های exports/ سپس حذف می‌شوند
+
+# صف حذف گفتگوها از RAG Core (outbox، chat.deletions)
+CORE_DELETE_BATCH_SIZE = config('CORE_DELETE_BATCH_SIZE', default=100, cast=int)
+CORE_DELETE_CONCURRENCY = config('CORE_DELETE_CONCURRENCY', default=10, cast=int)
+CORE_DELETE_MAX_ATTEMPTS = config('CORE_DELETE_MAX_ATTEMPTS', default=8, cast=int)
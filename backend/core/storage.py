@@ -1,62 +1,133 @@
 """
 S3 Storage Service for file uploads.
+
+کلاینت boto3 در اولین استفاده ساخته می‌شود (نه هنگام import)؛ process های
+daphne، Celery و management command ها هزینه import boto3 و ارتباط با MinIO را
+در زمان راه‌اندازی نمی‌پردازند و با در دسترس نبودن MinIO متوقف نمی‌شوند.
+بررسی/ایجاد bucket یک بار در زمان deploy انجام می‌شود (manage.py check_storage).
 """
-import boto3
-from botocore.exceptions import ClientError
-from botocore.config import Config
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from datetime import datetime, timedelta
+import base64
+import hashlib
+import threading
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
+# حداکثر کلید در هر درخواست delete_objects (محدودیت S3)
+DELETE_BATCH_SIZE = 1000
+
+# آمار پاکسازی (core.tasks.cleanup_old_files) در cache
+CLEANUP_LAST_RUN_KEY = 'storage_cleanup:last_run'
+CLEANUP_TOTALS_KEY = 'storage_cleanup:totals'
+
 
 class S3Service:
     """سرویس مدیریت فایل در S3."""
     
     def __init__(self):
-        """Initialize S3 client."""
-        endpoint_url = settings.S3_ENDPOINT_URL
+        """تنظیمات؛ کلاینت‌ها در اولین استفاده ساخته می‌شوند."""
+        self.endpoint_url = settings.S3_ENDPOINT_URL
+        self.bucket_name = settings.S3_TEMP_BUCKET
+        self.temp_prefix = "temp_uploads/"
+        self.content_prefix = "blobs/"
+        self._lock = threading.Lock()
+        self._s3_client = None
+        self._presign_client = None
+        self._stream_config = None
+    
+    def _create_client(self, endpoint_url, use_ssl=True):
+        import boto3
+        from botocore.config import Config
         
-        # Configure boto3 client with signature version
+        # Configure boto3 client with signature version and connection pool
         boto_config = Config(
             signature_version='s3v4',
-            s3={'addressing_style': 'path'}
+            s3={'addressing_style': 'path'},
+            max_pool_connections=getattr(settings, 'S3_MAX_POOL_CONNECTIONS', 20),
+            connect_timeout=getattr(settings, 'S3_CONNECT_TIMEOUT', 5),
+            read_timeout=getattr(settings, 'S3_READ_TIMEOUT', 60),
+            retries={'max_attempts': getattr(settings, 'S3_MAX_ATTEMPTS', 3), 'mode': 'standard'}
         )
-            
-        self.s3_client = boto3.client(
+        return boto3.client(
             's3',
             endpoint_url=endpoint_url,
             aws_access_key_id=settings.S3_ACCESS_KEY_ID,
             aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
             region_name=settings.S3_REGION,
-            use_ssl=settings.S3_USE_SSL,
+            use_ssl=use_ssl,
             config=boto_config
         )
-        self.bucket_name = settings.S3_TEMP_BUCKET
-        self.temp_prefix = "temp_uploads/"
+    
+    @property
+    def s3_client(self):
+        """کلاینت boto3 (thread-safe؛ یک بار برای هر process ساخته می‌شود)"""
+        if self._s3_client is None:
+            with self._lock:
+                if self._s3_client is None:
+                    self._s3_client = self._create_client(self.endpoint_url, settings.S3_USE_SSL)
+        return self._s3_client
+    
+    @property
+    def presign_client(self):
+        """امضای آپلود مستقیم با آدرس قابل دسترس از مرورگر (در صورت تفاوت با آدرس داخلی)"""
+        public_endpoint_url = getattr(settings, 'S3_PUBLIC_ENDPOINT_URL', '')
+        if not public_endpoint_url or public_endpoint_url == self.endpoint_url:
+            return self.s3_client
+        if self._presign_client is None:
+            with self._lock:
+                if self._presign_client is None:
+                    # آدرس عمومی: پروتکل از خود URL (مستقل از S3_USE_SSL داخلی)
+                    self._presign_client = self._create_client(public_endpoint_url)
+        return self._presign_client
+    
+    @property
+    def stream_config(self):
+        """
+        آپلود تدریجی: هر فایل در تکه‌های multipart_chunksize خوانده و ارسال می‌شود
+        (بدون thread داخلی boto3؛ همزمانی بین فایل‌ها در لایه view کنترل می‌شود)
+        """
+        if self._stream_config is None:
+            from boto3.s3.transfer import TransferConfig
+            
+            chunk_size = getattr(settings, 'S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024)
+            self._stream_config = TransferConfig(
+                multipart_threshold=chunk_size,
+                multipart_chunksize=chunk_size,
+                use_threads=False
+            )
+        return self._stream_config
+    
+    def ensure_bucket(self, create=True):
+        """
+        بررسی وجود bucket و ایجاد آن در صورت نیاز (manage.py check_storage).
         
-        # Create bucket if it doesn't exist
-        self._ensure_bucket_exists()
+        Returns:
+            'exists'، 'created' یا 'forbidden' (bucket وجود دارد ولی اجازه بررسی نیست)
+        """
+        from botocore.exceptions import ClientError
         
-    def _ensure_bucket_exists(self):
-        """Create bucket if it doesn't exist."""
         try:
             self.s3_client.head_bucket(Bucket=self.bucket_name)
             logger.info(f"Bucket {self.bucket_name} already exists")
+            return 'exists'
         except ClientError as e:
             error_code = e.response['Error']['Code']
-            if error_code == '404':
+            if error_code in ('404', 'NoSuchBucket') and create:
                 try:
                     self.s3_client.create_bucket(Bucket=self.bucket_name)
                     logger.info(f"Created bucket: {self.bucket_name}")
+                    return 'created'
                 except Exception as create_error:
                     logger.error(f"Failed to create bucket: {create_error}")
                     raise
             elif error_code == '403':
                 # Bucket exists but we don't have permission to check - that's OK
                 logger.warning(f"Bucket {self.bucket_name} exists but access check forbidden (403) - continuing anyway")
+                return 'forbidden'
             else:
                 logger.error(f"Error checking bucket: {e}")
                 raise
@@ -87,10 +158,7 @@ class S3Service:
                 'bucket_name': 'shared-storage'
             }
         """
-        # تولید کلید یکتا
-        file_id = str(uuid.uuid4())
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        object_key = f"{self.temp_prefix}{user_id}/{timestamp}_{file_id}_{filename}"
+        object_key = self._temp_object_key(filename, user_id)
         
         # محاسبه زمان انقضا (24 ساعت)
         expires_at = datetime.utcnow() + timedelta(hours=24)
@@ -118,10 +186,223 @@ class S3Service:
             logger.error(f"Failed to upload file: {e}")
             raise
     
+    def upload_stream(
+        self,
+        fileobj,
+        filename: str,
+        user_id: str,
+        content_type: str = 'application/octet-stream',
+        callback=None,
+        object_key: str = None
+    ) -> dict:
+        """
+        آپلود تدریجی فایل (مثلاً UploadedFile جنگو) بدون خواندن کامل در حافظه.
+        
+        فایل‌های بزرگ‌تر از S3_MULTIPART_CHUNK_SIZE به صورت multipart و تکه به تکه
+        ارسال می‌شوند؛ حافظه مصرفی هر آپلود حداکثر یک تکه است.
+        
+        Args:
+            fileobj: فایل باز شده (دارای read/seek)
+            filename: نام فایل اصلی
+            user_id: شناسه کاربر
+            content_type: نوع محتوای فایل
+            callback: تابعی که با تعداد بایت‌های ارسال شده در هر مرحله فراخوانی می‌شود
+            object_key: کلید مقصد (پیش‌فرض: کلید یکتای فایل موقت)
+            
+        Returns:
+            مانند upload_file
+        """
+        object_key = object_key or self._temp_object_key(filename, user_id)
+        expires_at = datetime.utcnow() + timedelta(hours=24)
+        uploaded = 0
+        
+        def on_progress(bytes_amount):
+            nonlocal uploaded
+            uploaded += bytes_amount
+            if callback:
+                callback(bytes_amount)
+        
+        try:
+            self.s3_client.upload_fileobj(
+                fileobj,
+                self.bucket_name,
+                object_key,
+                ExtraArgs={'ContentType': content_type},
+                Callback=on_progress,
+                Config=self.stream_config
+            )
+            
+            size = getattr(fileobj, 'size', None) or uploaded
+            logger.info(f"Uploaded file (streaming): {object_key} ({size} bytes)")
+            
+            return {
+                'object_key': object_key,
+                'filename': filename,
+                'size_bytes': size,
+                'content_type': content_type,
+                'expires_at': expires_at.isoformat(),
+                'bucket_name': self.bucket_name
+            }
+        except Exception as e:
+            logger.error(f"Failed to upload file: {e}")
+            raise
+    
+    def upload_fileobj(
+        self,
+        fileobj,
+        object_key: str,
+        content_type: str = 'application/octet-stream'
+    ) -> None:
+        """
+        آپلود فایل باز شده (مثلاً فایل موقت روی دیسک) بدون خواندن کامل در حافظه.
+        
+        boto3 فایل‌های بزرگ را به صورت multipart آپلود می‌کند.
+        """
+        try:
+            self.s3_client.upload_fileobj(
+                fileobj,
+                self.bucket_name,
+                object_key,
+                ExtraArgs={'ContentType': content_type}
+            )
+            logger.info(f"Uploaded file object: {object_key}")
+        except Exception as e:
+            logger.error(f"Failed to upload file object: {e}")
+            raise
+    
+    def download_fileobj(self, object_key: str, fileobj) -> None:
+        """دانلود فایل از MinIO در فایل باز شده (به صورت تکه‌ای)."""
+        try:
+            self.s3_client.download_fileobj(self.bucket_name, object_key, fileobj)
+        except Exception as e:
+            logger.error(f"Failed to download file: {e}")
+            raise
+    
+    def generate_presigned_upload(
+        self,
+        filename: str,
+        user_id: str,
+        content_type: str,
+        size_bytes: int,
+        expiration: int = 900,
+        sha256: str = None
+    ) -> dict:
+        """
+        تولید policy آپلود مستقیم (presigned POST) برای یک فایل موقت.
+        
+        policy نوع محتوا، اندازه دقیق و (در صورت وجود) SHA-256 فایل را اجبار
+        می‌کند؛ MinIO آپلود مغایر را رد می‌کند و checksum را همراه فایل ذخیره می‌کند.
+        
+        Args:
+            filename: نام فایل اصلی
+            user_id: شناسه کاربر
+            content_type: نوع محتوای فایل
+            size_bytes: اندازه فایل (بایت)
+            expiration: زمان انقضای policy به ثانیه
+            sha256: hash اعلام شده فایل (hex)
+            
+        Returns:
+            {
+                'object_key': 'temp_uploads/user123/file.pdf',
+                'url': 'https://s3.../bucket',
+                'fields': {...},  # فیلدهای فرم (قبل از فیلد file)
+                'expires_at': '2024-11-30T12:00:00'
+            }
+        """
+        object_key = self._temp_object_key(filename, user_id)
+        fields = {'Content-Type': content_type}
+        if sha256:
+            fields['x-amz-checksum-algorithm'] = 'SHA256'
+            fields['x-amz-checksum-sha256'] = base64.b64encode(bytes.fromhex(sha256)).decode('ascii')
+        try:
+            post = self.presign_client.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=object_key,
+                Fields=fields,
+                Conditions=[
+                    *({name: value} for name, value in fields.items()),
+                    ['content-length-range', size_bytes, size_bytes],
+                ],
+                ExpiresIn=expiration
+            )
+        except Exception as e:
+            logger.error(f"Failed to generate presigned upload: {e}")
+            raise
+        
+        return {
+            'object_key': object_key,
+            'url': post['url'],
+            'fields': post['fields'],
+            'expires_at': (datetime.utcnow() + timedelta(seconds=expiration)).isoformat()
+        }
+    
+    def head_file(self, object_key: str):
+        """
+        اطلاعات فایل در MinIO (HEAD).
+        
+        Returns:
+            {'size_bytes': ..., 'content_type': ..., 'sha256': ...} یا None اگر فایل
+            وجود نداشته باشد؛ sha256 (hex) فقط اگر هنگام آپلود checksum ثبت شده باشد
+        """
+        from botocore.exceptions import ClientError
+        
+        try:
+            response = self.s3_client.head_object(
+                Bucket=self.bucket_name, Key=object_key, ChecksumMode='ENABLED'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            logger.error(f"Failed to head file: {e}")
+            raise
+        try:
+            sha256 = base64.b64decode(response['ChecksumSHA256'], validate=True).hex()
+        except (KeyError, ValueError):
+            sha256 = None  # بدون checksum یا checksum ترکیبی multipart
+        return {
+            'size_bytes': response['ContentLength'],
+            'content_type': response.get('ContentType', ''),
+            'sha256': sha256
+        }
+    
+    @staticmethod
+    def content_hash(fileobj, chunk_size: int = 1024 * 1024) -> str:
+        """SHA-256 محتوای فایل (خواندن تکه‌ای؛ موقعیت فایل به ابتدا برمی‌گردد)"""
+        digest = hashlib.sha256()
+        fileobj.seek(0)
+        for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+            digest.update(chunk)
+        fileobj.seek(0)
+        return digest.hexdigest()
+    
+    def copy_file(self, source_key: str, object_key: str) -> None:
+        """کپی فایل داخل bucket (سمت سرور MinIO؛ محتوا از این سرور عبور نمی‌کند)"""
+        try:
+            self.s3_client.copy_object(
+                Bucket=self.bucket_name,
+                Key=object_key,
+                CopySource={'Bucket': self.bucket_name, 'Key': source_key}
+            )
+            logger.info(f"Copied file: {source_key} -> {object_key}")
+        except Exception as e:
+            logger.error(f"Failed to copy file: {e}")
+            raise
+    
+    def content_object_key(self, scope: str, sha256: str) -> str:
+        """کلید فایل بر اساس محتوا (یکسان برای محتوای یکسان در یک scope)"""
+        return f"{self.content_prefix}{scope}/{sha256}"
+    
+    def _temp_object_key(self, filename: str, user_id: str) -> str:
+        """کلید یکتا برای فایل موقت کاربر"""
+        file_id = str(uuid.uuid4())
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        return f"{self.temp_prefix}{user_id}/{timestamp}_{file_id}_{filename}"
+    
     def generate_presigned_url(
         self,
         object_key: str,
-        expiration: int = 3600
+        expiration: int = 3600,
+        download_name: str = None
     ) -> str:
         """
         تولید URL امن با زمان انقضا.
@@ -129,17 +410,22 @@ class S3Service:
         Args:
             object_key: کلید فایل در MinIO
             expiration: زمان انقضا به ثانیه (پیش‌فرض 1 ساعت)
+            download_name: نام فایل هنگام دانلود (Content-Disposition)
             
         Returns:
             URL امن برای دانلود فایل
         """
+        params = {
+            'Bucket': self.bucket_name,
+            'Key': object_key
+        }
+        if download_name:
+            params['ResponseContentDisposition'] = f'attachment; filename="{download_name}"'
+        
         try:
             url = self.s3_client.generate_presigned_url(
                 'get_object',
-                Params={
-                    'Bucket': self.bucket_name,
-                    'Key': object_key
-                },
+                Params=params,
                 ExpiresIn=expiration
             )
             return url
@@ -167,7 +453,173 @@ class S3Service:
         except Exception as e:
             logger.error(f"Failed to delete file: {e}")
             return False
+    
+    def delete_files(self, object_keys) -> dict:
+        """
+        حذف گروهی فایل‌ها با delete_objects (حداکثر DELETE_BATCH_SIZE کلید در هر درخواست).
+        
+        Returns:
+            {'deleted': [...], 'errors': [...]} کلیدهای حذف شده و ناموفق
+        """
+        object_keys = list(object_keys)
+        result = {'deleted': [], 'errors': []}
+        for start in range(0, len(object_keys), DELETE_BATCH_SIZE):
+            batch = object_keys[start:start + DELETE_BATCH_SIZE]
+            failed = self._delete_batch(batch)
+            result['deleted'].extend(key for key in batch if key not in failed)
+            result['errors'].extend(failed)
+        return result
+    
+    def _delete_batch(self, object_keys) -> set:
+        """یک درخواست delete_objects؛ کلیدهای ناموفق را برمی‌گرداند"""
+        try:
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in object_keys], 'Quiet': True}
+            )
+        except Exception as e:
+            logger.error(f"Failed to delete {len(object_keys)} files: {e}")
+            return set(object_keys)
+        errors = response.get('Errors') or []
+        for error in errors[:5]:
+            logger.warning(f"Failed to delete {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+        return {error['Key'] for error in errors}
+    
+    def cleanup_prefix(self, prefix: str, older_than: timedelta, concurrency: int = 4) -> dict:
+        """
+        حذف فایل‌های قدیمی‌تر از older_than زیر prefix.
+        
+        فهرست فایل‌ها صفحه به صفحه (list_objects_v2) خوانده می‌شود و هر دسته
+        DELETE_BATCH_SIZE کلیدی به صورت موازی (حداکثر concurrency) با یک
+        delete_objects حذف می‌شود.
+        
+        Returns:
+            {'scanned': ..., 'objects': ..., 'bytes': ..., 'errors': ..., 'batches': ...}
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        from django.utils import timezone
+        
+        cutoff = timezone.now() - older_than
+        result = {'scanned': 0, 'objects': 0, 'bytes': 0, 'errors': 0, 'batches': 0}
+        
+        def collect(future):
+            sizes, failed = future.result()
+            result['batches'] += 1
+            result['errors'] += len(failed)
+            for key, size in sizes.items():
+                if key not in failed:
+                    result['objects'] += 1
+                    result['bytes'] += size
+        
+        def delete(sizes):
+            return sizes, self._delete_batch(list(sizes))
+        
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        pending = set()
+        batch = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                for item in page.get('Contents', []):
+                    result['scanned'] += 1
+                    if item['LastModified'] >= cutoff:
+                        continue
+                    batch[item['Key']] = item['Size']
+                    if len(batch) < DELETE_BATCH_SIZE:
+                        continue
+                    # حداکثر concurrency دسته در حال حذف (حافظه محدود)
+                    if len(pending) >= concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future)
+                    pending.add(executor.submit(delete, batch))
+                    batch = {}
+            if batch:
+                pending.add(executor.submit(delete, batch))
+            for future in pending:
+                collect(future)
+        
+        logger.info(
+            f"Cleaned {prefix}: {result['objects']} objects, {result['bytes']} bytes "
+            f"({result['batches']} batches, {result['errors']} errors)"
+        )
+        return result
+    
+    def ensure_lifecycle_rule(self, prefix: str, days: int, rule_id: str = None) -> None:
+        """
+        نصب (یا به‌روزرسانی) قانون انقضای lifecycle برای prefix؛ MinIO خودش
+        فایل‌های قدیمی‌تر از days روز را حذف می‌کند. قوانین دیگر bucket حفظ می‌شوند.
+        """
+        from botocore.exceptions import ClientError
+        
+        rule_id = rule_id or f"expire-{prefix.strip('/').replace('/', '-')}"
+        try:
+            rules = self.s3_client.get_bucket_lifecycle_configuration(Bucket=self.bucket_name)['Rules']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchLifecycleConfiguration':
+                raise
+            rules = []
+        
+        rules = [rule for rule in rules if rule.get('ID') != rule_id]
+        rules.append({
+            'ID': rule_id,
+            'Filter': {'Prefix': prefix},
+            'Status': 'Enabled',
+            'Expiration': {'Days': days},
+            'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': days},
+        })
+        self.s3_client.put_bucket_lifecycle_configuration(
+            Bucket=self.bucket_name,
+            LifecycleConfiguration={'Rules': rules}
+        )
+        logger.info(f"Lifecycle rule {rule_id}: expire {prefix} after {days} days")
+    
+    # نسخه‌های async (برای consumer ها و view های async): اجرا در thread pool
+    # جداگانه تا حلقه رویداد و thread مشترک ORM مسدود نشوند
+    async def aupload_stream(self, *args, **kwargs) -> dict:
+        return await sync_to_async(self.upload_stream, thread_sensitive=False)(*args, **kwargs)
+    
+    async def ahead_file(self, object_key: str):
+        return await sync_to_async(self.head_file, thread_sensitive=False)(object_key)
+    
+    async def adelete_file(self, object_key: str) -> bool:
+        return await sync_to_async(self.delete_file, thread_sensitive=False)(object_key)
+    
+    async def agenerate_presigned_url(self, *args, **kwargs) -> str:
+        return await sync_to_async(self.generate_presigned_url, thread_sensitive=False)(*args, **kwargs)
+    
+    async def agenerate_presigned_upload(self, *args, **kwargs) -> dict:
+        return await sync_to_async(self.generate_presigned_upload, thread_sensitive=False)(*args, **kwargs)
 
 
-# سرویس سراسری
+# سرویس سراسری (بدون ارتباط شبکه تا اولین استفاده)
 s3_service = S3Service()
+
+
+
+def record_cleanup(result):
+    """ثبت نتیجه یک اجرای پاکسازی (آخرین اجرا و مجموع) برای cleanup_stats"""
+    from django.core.cache import cache
+    from django.utils import timezone
+    
+    try:
+        cache.set(CLEANUP_LAST_RUN_KEY, {**result, 'finished_at': timezone.now().isoformat()}, None)
+        totals = cache.get(CLEANUP_TOTALS_KEY) or {}
+        for key in ('runs', 'objects', 'bytes', 'errors', 'blobs_deleted'):
+            totals[key] = totals.get(key, 0) + (1 if key == 'runs' else result.get(key, 0))
+        cache.set(CLEANUP_TOTALS_KEY, totals, None)
+    except Exception as e:
+        logger.warning(f"Could not record storage cleanup stats: {e}")
+
+
+def cleanup_stats():
+    """آمار پاکسازی فایل‌های موقت: آخرین اجرا و مجموع فایل‌ها/بایت‌های آزاد شده"""
+    from django.core.cache import cache
+    
+    try:
+        return {
+            'last_run': cache.get(CLEANUP_LAST_RUN_KEY),
+            'totals': cache.get(CLEANUP_TOTALS_KEY) or {},
+        }
+    except Exception as e:
+        logger.warning(f"Storage cleanup stats unavailable: {e}")
+        return {'available': False}
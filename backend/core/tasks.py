@@ -100,30 +100,35 @@ def cleanup_tokens_and_sessions():
 
 
 @shared_task(name='core.tasks.cleanup_old_files')
-def cleanup_old_files():
+def cleanup_old_files(hours=None, concurrency=None):
     """
     پاکسازی فایل‌های موقت قدیمی از MinIO
-    فایل‌های قدیمی‌تر از 24 ساعت حذف می‌شوند
+    فایل‌های temp_uploads/ قدیمی‌تر از TEMP_UPLOAD_RETENTION_HOURS (پیش‌فرض 24 ساعت) حذف می‌شوند
+    
+    فهرست فایل‌ها صفحه به صفحه خوانده و در دسته‌های 1000 تایی به صورت موازی حذف
+    می‌شوند (S3Service.cleanup_prefix). فایل‌های ذخیره شده بر اساس محتوا (blobs/)
+    فقط در صورت نداشتن ارجاع و پس از مهلت نگهداری حذف می‌شوند (chat.blobs).
+    آمار هر اجرا در cache ثبت می‌شود (core.storage.cleanup_stats).
     """
-    import subprocess
+    from datetime import timedelta
+    from django.conf import settings
+    from chat.blobs import cleanup_unreferenced
+    from core.storage import s3_service, record_cleanup
     
-    logger.info("Starting cleanup_old_files task")
+    hours = hours or settings.TEMP_UPLOAD_RETENTION_HOURS
+    logger.info(f"Starting cleanup_old_files task (older than {hours}h)")
     
     try:
-        result = subprocess.run(
-            ['python3', '/srv/cleanup_old_files.py', '--hours', '24'],
-            capture_output=True,
-            text=True,
-            timeout=300
+        result = s3_service.cleanup_prefix(
+            s3_service.temp_prefix,
+            older_than=timedelta(hours=hours),
+            concurrency=concurrency or settings.S3_CLEANUP_CONCURRENCY
         )
-        
-        if result.returncode == 0:
-            logger.info(f"cleanup_old_files completed: {result.stdout}")
-        else:
-            logger.error(f"cleanup_old_files failed: {result.stderr}")
-            
-    except FileNotFoundError:
-        logger.warning("cleanup_old_files.py not found, skipping")
+        result['blobs_deleted'] = cleanup_unreferenced()
     except Exception as e:
         logger.error(f"cleanup_old_files failed: {e}")
         raise
+    
+    record_cleanup(result)
+    logger.info(f"cleanup_old_files completed: {result}")
+    return result
@@ -7,10 +7,13 @@ from .timezone_utils import (
     format_datetime_for_user,
     format_datetime_jalali
 )
+from .text_utils import normalize_persian_text, persian_translate_args
 
 __all__ = [
     'convert_to_user_timezone',
     'get_user_timezone_code',
     'format_datetime_for_user',
     'format_datetime_jalali',
+    'normalize_persian_text',
+    'persian_translate_args',
 ]
@@ -0,0 +1,75 @@
+"""
+Text utilities for normalizing Persian/Arabic text
+"""
+import re
+
+
+# حروف عربی -> فارسی و ارقام فارسی/عربی -> لاتین
+_REPLACEMENTS = {
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    '؟': '?',
+    '،': ',',
+    '؛': ';',
+    '\u200c': ' ',  # نیم‌فاصله (ZWNJ)
+    '\u200f': None,  # RLM
+    '\u200e': None,  # LRM
+    '\u0640': None,  # کشیده (tatweel)
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+}
+_CHAR_MAP = str.maketrans(_REPLACEMENTS)
+
+# اعراب (فتحه، کسره، تنوین، تشدید، سکون، ...)
+_DIACRITICS = ''.join(chr(c) for c in range(0x064B, 0x0660)) + '\u0670'
+_DIACRITICS_RE = re.compile(f'[{_DIACRITICS}]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_persian_text(text):
+    """
+    نرمال‌سازی متن فارسی/عربی برای مقایسه و جستجو
+    
+    - تبدیل حروف عربی به معادل فارسی (ي -> ی، ك -> ک، ...)
+    - تبدیل ارقام فارسی و عربی به لاتین
+    - حذف اعراب و کشیده، تبدیل نیم‌فاصله به فاصله
+    - یکسان‌سازی فاصله‌ها و حروف کوچک لاتین
+    
+    Args:
+        text: متن ورودی
+    
+    Returns:
+        str: متن نرمال شده
+    """
+    if not text:
+        return ''
+    
+    text = text.translate(_CHAR_MAP)
+    text = _DIACRITICS_RE.sub('', text)
+    text = _WHITESPACE_RE.sub(' ', text)
+    return text.strip().lower()
+
+
+def persian_translate_args():
+    """
+    آرگومان‌های from/to برای تابع translate() در PostgreSQL
+    
+    معادل SQL نرمال‌سازی حروف normalize_persian_text (بدون یکسان‌سازی فاصله‌ها
+    و حروف کوچک)؛ کاراکترهای اضافه from (اعراب، کشیده، ...) حذف می‌شوند.
+    
+    Returns:
+        tuple: (from_chars, to_chars)
+    """
+    replaced = [(char, value) for char, value in _REPLACEMENTS.items() if value]
+    removed = [char for char, value in _REPLACEMENTS.items() if not value]
+    from_chars = ''.join(char for char, _ in replaced) + ''.join(removed) + _DIACRITICS
+    to_chars = ''.join(value for _, value in replaced)
+    return from_chars, to_chars
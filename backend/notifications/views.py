@@ -19,15 +19,22 @@ from .serializers import (
     MarkAsReadSerializer
 )
 from .services import NotificationService
+from core.pagination import HybridPagination
 
 logger = logging.getLogger(__name__)
 
 
+class NotificationPagination(HybridPagination):
+    """اعلان‌ها از جدیدترین؛ next: اعلان‌های قدیمی‌تر، previous: اعلان‌های جدیدتر"""
+    ordering = '-created_at'
+
+
 class NotificationViewSet(viewsets.ModelViewSet):
     """مدیریت اعلان‌های کاربر"""
     
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationPagination
     
     def get_queryset(self):
         """فیلتر اعلان‌ها بر اساس کاربر جاری"""
@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils import timezone
 from django.http import JsonResponse
 from rest_framework import status
@@ -33,90 +34,156 @@ class SubscriptionMiddleware:
         '/ws/chat/',
     ]
     
+    # قابل اجرا در هر دو حالت sync و async (بدون thread hop برای view های async)
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        error_response, track_usage = self.check_request(request)
+        if error_response is not None:
+            return error_response
+        
+        response = self.get_response(request)
+        
+        if track_usage:
+            self.log_query_usage(request, response)
+        
+        return response
+    
+    async def __acall__(self, request):
+        # مسیرهای معاف نیازی به دسترسی دیتابیس ندارند
+        if self.is_exempt(request.path):
+            return await self.get_response(request)
+        
+        error_response, track_usage = await sync_to_async(self.check_request)(request)
+        if error_response is not None:
+            return error_response
+        
+        response = await self.get_response(request)
+        
+        if track_usage:
+            await sync_to_async(self.log_query_usage)(request, response)
+        
+        return response
+    
+    def is_exempt(self, path):
+        return any(path.startswith(exempt_path) for exempt_path in self.EXEMPT_PATHS)
+    
+    def check_request(self, request):
+        """
+        بررسی اشتراک و سهمیه قبل از اجرای view
+        
+        Returns:
+            tuple: (error_response یا None, آیا مصرف باید ثبت شود)
+        """
         # Skip for exempt paths
-        for path in self.EXEMPT_PATHS:
-            if request.path.startswith(path):
-                return self.get_response(request)
+        if self.is_exempt(request.path):
+            return None, False
         
         # Skip for anonymous users
         if not request.user.is_authenticated:
-            return self.get_response(request)
+            return None, False
         
         # Check if path requires query quota
         is_query_path = any(request.path.startswith(path) for path in self.QUERY_PATHS)
         
         logger.info(f"Middleware check: path={request.path}, is_query_path={is_query_path}, method={request.method}")
         
-        if is_query_path and request.method == 'POST':
-            # Get active subscription
-            subscription = request.user.subscriptions.filter(
-                status__in=['active', 'trial'],
-                end_date__gt=timezone.now()
-            ).first()
-            
-            if not subscription:
-                return JsonResponse(
-                    {
-                        'error': 'اشتراک فعالی ندارید',
-                        'code': 'NO_ACTIVE_SUBSCRIPTION',
-                        'plans_url': '/api/v1/plans/'
-                    },
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            # Check if user can query using UsageService
-            can_query, message, usage_info = UsageService.check_quota(request.user, subscription)
-            if not can_query:
-                return JsonResponse(
-                    {
-                        'error': message,
-                        'code': 'QUOTA_EXCEEDED',
-                        'usage': usage_info
-                    },
-                    status=status.HTTP_429_TOO_MANY_REQUESTS
-                )
-            
-            # Add subscription to request for later use
+        if not (is_query_path and request.method == 'POST'):
+            return None, False
+        
+        # Get active subscription
+        subscription = request.user.subscriptions.filter(
+            status__in=['active', 'trial'],
+            end_date__gt=timezone.now()
+        ).first()
+        
+        if not subscription:
+            return JsonResponse(
+                {
+                    'error': 'اشتراک فعالی ندارید',
+                    'code': 'NO_ACTIVE_SUBSCRIPTION',
+                    'plans_url': '/api/v1/plans/'
+                },
+                status=status.HTTP_403_FORBIDDEN
+            ), False
+        
+        # retry با Idempotency-Key که قبلاً پذیرفته شده: پاسخ ذخیره شده توسط view
+        # برگردانده می‌شود و نباید به دلیل مصرف همان درخواست اول با 429 رد شود
+        if self.is_idempotent_retry(request):
             request.subscription = subscription
+            return None, True
         
-        response = self.get_response(request)
+        # Check if user can query using UsageService
+        can_query, message, usage_info = UsageService.check_quota(request.user, subscription)
+        if not can_query:
+            return JsonResponse(
+                {
+                    'error': message,
+                    'code': 'QUOTA_EXCEEDED',
+                    'usage': usage_info
+                },
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            ), False
         
-        # Log successful query
-        if is_query_path and request.method == 'POST' and response.status_code == 200:
-            logger.info(f"Query success: has_subscription={hasattr(request, 'subscription')}")
-            if hasattr(request, 'subscription'):
-                try:
-                    # Extract tokens from response if available
-                    tokens = 0
-                    model_used = 'unknown'
-                    if hasattr(response, 'data') and isinstance(response.data, dict):
-                        tokens = response.data.get('metadata', {}).get('tokens', 0)
-                        model_used = response.data.get('metadata', {}).get('model_used', 'unknown')
-                    
-                    # Log usage using UsageService
-                    UsageService.log_usage(
-                        user=request.user,
-                        action_type='query',
-                        tokens_used=tokens,
-                        subscription=request.subscription,
-                        metadata={
-                            'path': request.path,
-                            'model': model_used
-                        },
-                        ip_address=self.get_client_ip(request),
-                        user_agent=request.META.get('HTTP_USER_AGENT', '')
-                    )
-                    
-                    logger.info(f"Query logged for user {request.user.phone_number}: {tokens} tokens")
-                    
-                except Exception as e:
-                    logger.error(f"Error logging usage: {e}")
+        # Add subscription to request for later use
+        request.subscription = subscription
+        return None, True
+    
+    def is_idempotent_retry(self, request):
+        """درخواست با Idempotency-Key که برای آن درخواست در حال اجرا یا نتیجه ذخیره شده وجود دارد"""
+        from chat import idempotency
         
-        return response
+        key = request.headers.get(idempotency.IDEMPOTENCY_HEADER)
+        if not key:
+            return False
+        return idempotency.has_record(request.user.id, key)
+    
+    def log_query_usage(self, request, response):
+        """ثبت مصرف برای query موفق"""
+        if response.status_code != 200:
+            return
+        
+        # پاسخ تکراری برای Idempotency-Key (مصرف قبلاً ثبت شده است)
+        if response.has_header('Idempotent-Replayed'):
+            return
+        
+        logger.info(f"Query success: has_subscription={hasattr(request, 'subscription')}")
+        if hasattr(request, 'subscription'):
+            try:
+                # Extract tokens from response if available
+                tokens = 0
+                model_used = 'unknown'
+                if hasattr(response, 'data') and isinstance(response.data, dict):
+                    tokens = response.data.get('metadata', {}).get('tokens', 0)
+                    model_used = response.data.get('metadata', {}).get('model_used', 'unknown')
+                
+                # Log usage using UsageService
+                UsageService.log_usage(
+                    user=request.user,
+                    action_type='query',
+                    tokens_used=tokens,
+                    subscription=request.subscription,
+                    metadata={
+                        'path': request.path,
+                        'model': model_used
+                    },
+                    ip_address=self.get_client_ip(request),
+                    user_agent=request.META.get('HTTP_USER_AGENT', '')
+                )
+                
+                logger.info(f"Query logged for user {request.user.phone_number}: {tokens} tokens")
+                
+            except Exception as e:
+                logger.error(f"Error logging usage: {e}")
     
     def get_client_ip(self, request):
         """Get client IP address"""
@@ -1,7 +1,7 @@
 """
 Signals for automatic subscription management
 """
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -62,6 +62,27 @@ def create_free_subscription(sender, instance, created, **kwargs):
         logger.error(f"Error creating subscription for user {instance.phone_number}: {e}")
 
 
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_core_tokens(sender, instance, **kwargs):
+    """
+    حذف توکن کش شده Core پس از تغییر اشتراک (tier در توکن ذخیره شده است)
+    اعضای سازمان از اشتراک مالک استفاده می‌کنند، پس توکن آن‌ها هم حذف می‌شود
+    """
+    from accounts.tokens import invalidate_core_access_token
+    
+    try:
+        user_ids = [instance.user_id]
+        user_ids.extend(
+            User.objects.filter(
+                organization__owner_id=instance.user_id
+            ).values_list('id', flat=True)
+        )
+        invalidate_core_access_token(*user_ids)
+    except Exception as e:
+        logger.error(f"Error invalidating core tokens for user {instance.user_id}: {e}")
+
+
 @receiver(post_save, sender=User)
 def notify_admins_new_user(sender, instance, created, **kwargs):
     """
@@ -0,0 +1,141 @@
+"""
+تست شرایط استفاده از کش پاسخ (answer_cache) و اشتراک درخواست‌های همزمان (coalescing)
+فقط اولین سوال یک گفتگوی جدید از کش پاسخ داده می‌شود یا با درخواست همزمان یکسان
+مشترک می‌شود؛ سوال بعدی همان گفتگو حتی اگر پاسخ اول از کش آمده باشد (و
+rag_conversation_id خالی باشد) مستقیماً به Core می‌رود.
+
+اجرا:
+    python manage.py test tests.test_answer_cache
+"""
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from chat import answer_cache
+from chat.core_service import CoreAPIService
+from chat.models import Conversation
+
+User = get_user_model()
+
+CORE_RESPONSE = {
+    'answer': 'پاسخ سیستم مرکزی',
+    'sources': [],
+    'tokens_used': 12,
+    'conversation_id': 'rag-conv-1',
+    'message_id': 'rag-msg-1',
+}
+CACHED_RESPONSE = {'answer': 'پاسخ کش شده', 'sources': [], 'cached': True, 'cache_key': 'k'}
+
+
+@override_settings(ANSWER_CACHE_ENABLED=True)
+class AnswerCacheEligibilityTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='cache-test@example.com',
+            phone_number='09120000098',
+            password='test-pass-123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.lookup = self.patch('chat.answer_cache.lookup', return_value=None)
+        self.store = self.patch('chat.answer_cache.store')
+        self.core = self.patch('chat.core_service.core_service.send_query', return_value=CORE_RESPONSE)
+        self.patch('chat.turns.get_core_access_token', return_value='token')
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def ask(self, query, conversation_id=None):
+        data = {'query': query}
+        if conversation_id:
+            data['conversation_id'] = str(conversation_id)
+        response = self.client.post('/api/v1/chat/query/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_new_conversation_is_served_from_cache(self):
+        self.lookup.return_value = dict(CACHED_RESPONSE)
+
+        data = self.ask('ماده ۱۰ قانون مدنی چیست؟')
+
+        self.assertTrue(data['cached'])
+        self.assertEqual(data['answer'], 'پاسخ کش شده')
+        self.core.assert_not_called()
+
+    def test_follow_up_in_cache_hit_conversation_skips_cache(self):
+        self.lookup.return_value = dict(CACHED_RESPONSE)
+        first = self.ask('ماده ۱۰ قانون مدنی چیست؟')
+        conversation = Conversation.objects.get(id=first['conversation_id'])
+        self.assertEqual(conversation.rag_conversation_id, '')
+
+        self.lookup.reset_mock()
+        data = self.ask('بند ۵ آن چطور؟', conversation.id)
+
+        self.assertFalse(data['cached'])
+        self.assertEqual(data['answer'], 'پاسخ سیستم مرکزی')
+        self.lookup.assert_not_called()
+        self.store.assert_not_called()
+        self.core.assert_called_once()
+        self.assertFalse(self.core.call_args.kwargs['coalesce'])
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.rag_conversation_id, 'rag-conv-1')
+
+    def test_cache_miss_of_new_conversation_is_coalesced(self):
+        self.ask('ماده ۱۰ قانون مدنی چیست؟')
+
+        self.core.assert_called_once()
+        self.assertTrue(self.core.call_args.kwargs['coalesce'])
+        self.store.assert_called_once()
+
+    def test_attachments_skip_cache(self):
+        self.assertFalse(answer_cache.is_cacheable(True, [{'filename': 'a.pdf'}]))
+        self.assertTrue(answer_cache.is_cacheable(True, None))
+        self.assertFalse(answer_cache.is_cacheable(False, None))
+
+    def test_key_distinguishes_default_web_search_from_disabled(self):
+        default = answer_cache.make_key('سوال', 'fa', None)
+        disabled = answer_cache.make_key('سوال', 'fa', False)
+        enabled = answer_cache.make_key('سوال', 'fa', True)
+        self.assertEqual(len({default, disabled, enabled}), 3)
+        self.assertEqual(default, answer_cache.make_key('  سوال ', 'fa', None))
+
+    def test_key_uses_resolved_web_search_preference(self):
+        self.user.preferences = {'enable_web_search': False}
+        self.user.save(update_fields=['preferences'])
+
+        self.ask('ماده ۱۰ قانون مدنی چیست؟')
+
+        self.lookup.assert_called_once_with(answer_cache.make_key('ماده ۱۰ قانون مدنی چیست؟', 'fa', False))
+
+
+class CoalescingEligibilityTest(SimpleTestCase):
+    """تصمیم coalescing با فراخواننده است، نه با خالی بودن conversation_id"""
+
+    def setUp(self):
+        self.service = CoreAPIService()
+        self.service.coalesce_queries = True
+        self.service._coalesced_query = mock.AsyncMock(return_value={'coalesced': True})
+        self.service._post_query = mock.AsyncMock(return_value={'coalesced': False})
+
+    def send(self, **kwargs):
+        return async_to_sync(self.service.send_query)(query='سوال', token='token', **kwargs)
+
+    def test_not_coalesced_by_default(self):
+        self.assertFalse(self.send()['coalesced'])
+        self.service._coalesced_query.assert_not_called()
+
+    def test_coalesced_when_caller_allows(self):
+        self.assertTrue(self.send(coalesce=True)['coalesced'])
+
+    def test_never_coalesced_with_context_or_attachments(self):
+        self.assertFalse(self.send(coalesce=True, conversation_id='rag-conv-1')['coalesced'])
+        self.assertFalse(self.send(coalesce=True, file_attachments=[{'filename': 'a.pdf'}])['coalesced'])
+        self.service._coalesced_query.assert_not_called()
@@ -0,0 +1,240 @@
+"""
+تست ذخیره پیوست‌ها بر اساس محتوا (chat.blobs)
+محتوای یکسان در هر scope یک بار ذخیره می‌شود، آپلود مستقیم به کلید محتوا منتقل
+می‌شود (hash توسط MinIO بررسی شده و فایل از سرور عبور نمی‌کند)، پرسش با hash فقط
+فایل‌های خود کاربر را برمی‌گرداند، پیوست کلید فایل دیگران پذیرفته نمی‌شود و
+ref_count با پیوست‌های پیام‌ها به‌روز می‌شود تا پاکسازی فقط فایل‌های بدون ارجاع را
+حذف کند.
+
+اجرا:
+    python manage.py test tests.test_attachment_blobs
+"""
+import hashlib
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Organization
+from chat import blobs
+from chat.models import AttachmentBlob, Conversation
+from chat.serializers import QueryRequestSerializer
+from chat.turns import start_turn
+
+User = get_user_model()
+
+CONTENT = b'%PDF-1.4 test document'
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+def _content_hash(fileobj):
+    fileobj.seek(0)
+    digest = hashlib.sha256(fileobj.read()).hexdigest()
+    fileobj.seek(0)
+    return digest
+
+
+class AttachmentBlobTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='blob-owner@example.com',
+            phone_number='09120000094',
+            password='test-pass-123'
+        )
+        organization = Organization.objects.create(name='سازمان', slug='blob-test-org', owner=self.user)
+        self.member = User.objects.create_user(
+            email='blob-member@example.com',
+            phone_number='09120000093',
+            password='test-pass-123'
+        )
+        User.objects.filter(id__in=[self.user.id, self.member.id]).update(organization=organization)
+        self.user.refresh_from_db()
+        self.member.refresh_from_db()
+
+        self.storage = mock.MagicMock(content_prefix='blobs/', temp_prefix='temp_uploads/', bucket_name='bucket')
+        self.storage.content_hash.side_effect = _content_hash
+        self.storage.content_object_key.side_effect = lambda scope, sha256: f'blobs/{scope}/{sha256}'
+        self.storage.upload_stream.side_effect = lambda fileobj, **kwargs: {'size_bytes': fileobj.size}
+        self.storage.delete_files.side_effect = lambda keys: {'deleted': list(keys), 'failed': []}
+        self.patch('chat.blobs.s3_service', self.storage)
+        self.patch('chat.upload_views.s3_service', self.storage)
+        self.patch('chat.turns.get_core_access_token', return_value='token')
+
+    def patch(self, target, *args, **kwargs):
+        patcher = mock.patch(target, *args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def upload(self, user):
+        file = SimpleUploadedFile('document.pdf', CONTENT, content_type='application/pdf')
+        return blobs.store_upload(file, user)
+
+    def check(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/api/v1/chat/upload/check/', {
+            'sha256': SHA256,
+            'filename': 'document.pdf',
+            'content_type': 'application/pdf',
+            'size_bytes': len(CONTENT),
+        }, format='json').json()
+
+    def test_same_content_is_stored_once_per_organization(self):
+        first = self.upload(self.user)
+        second = self.upload(self.member)
+
+        self.assertFalse(first['deduplicated'])
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(first['object_key'], second['object_key'])
+        self.storage.upload_stream.assert_called_once()
+        blob = AttachmentBlob.objects.get()
+        self.assertEqual(set(blob.uploaders.all()), {self.user, self.member})
+
+    def test_check_only_matches_blobs_uploaded_by_user(self):
+        self.upload(self.user)
+
+        # دانستن hash و اندازه برای دسترسی به فایل عضو دیگر سازمان کافی نیست
+        self.assertEqual(self.check(self.member), {'exists': False})
+        response = self.check(self.user)
+        self.assertTrue(response['exists'])
+        self.assertEqual(response['object_key'], f'blobs/orgs/{self.user.organization_id}/{SHA256}')
+
+    def direct_upload(self, client, temp_key):
+        self.storage.generate_presigned_upload.return_value = {'object_key': temp_key, 'url': 'u', 'fields': {}}
+        presign = client.post('/api/v1/chat/upload/presign/', {
+            'filename': 'document.pdf',
+            'content_type': 'application/pdf',
+            'size_bytes': len(CONTENT),
+            'sha256': SHA256,
+        }, format='json')
+        self.assertEqual(presign.status_code, 200)
+        self.assertEqual(self.storage.generate_presigned_upload.call_args.kwargs['sha256'], SHA256)
+        return client.post('/api/v1/chat/upload/finalize/', {'object_key': temp_key}, format='json')
+
+    def test_finalize_promotes_direct_upload(self):
+        client = APIClient()
+        client.force_authenticate(self.member)
+        # checksum ثبت شده توسط MinIO (فایل برای hash دانلود نمی‌شود)
+        self.storage.head_file.return_value = {
+            'size_bytes': len(CONTENT), 'content_type': 'application/pdf', 'sha256': SHA256
+        }
+
+        results = []
+        for index in range(2):
+            temp_key = f'temp_uploads/{self.member.id}/{index}_document.pdf'
+            response = self.direct_upload(client, temp_key)
+            self.assertEqual(response.status_code, 200)
+            results.append(response.json())
+            self.storage.delete_file.assert_called_with(temp_key)
+
+        content_key = f'blobs/orgs/{self.member.organization_id}/{SHA256}'
+        self.assertEqual([r['object_key'] for r in results], [content_key, content_key])
+        self.assertEqual([r['deduplicated'] for r in results], [False, True])
+        self.storage.copy_file.assert_called_once_with(f'temp_uploads/{self.member.id}/0_document.pdf', content_key)
+        self.assertEqual(list(AttachmentBlob.objects.get().uploaders.all()), [self.member])
+        self.storage.get_object.assert_not_called()
+        self.storage.download_fileobj.assert_not_called()
+
+    def test_finalize_rejects_unverified_checksum(self):
+        client = APIClient()
+        client.force_authenticate(self.member)
+        temp_key = f'temp_uploads/{self.member.id}/document.pdf'
+        self.storage.head_file.return_value = {
+            'size_bytes': len(CONTENT), 'content_type': 'application/pdf', 'sha256': None
+        }
+
+        response = self.direct_upload(client, temp_key)
+
+        self.assertEqual(response.status_code, 400)
+        self.storage.delete_file.assert_called_once_with(temp_key)
+        self.assertFalse(AttachmentBlob.objects.exists())
+
+    def test_attachments_must_belong_to_user(self):
+        own_key = self.upload(self.user)['object_key']
+        outsider = User.objects.create_user(
+            email='blob-outsider@example.com',
+            phone_number='09120000091',
+            password='test-pass-123'
+        )
+
+        def validate(user, object_key):
+            serializer = QueryRequestSerializer(data={
+                'query': 'سوال',
+                'file_attachments': [{'filename': 'a.pdf', 'object_key': object_key, 'file_type': 'application/pdf'}],
+            }, context={'request': SimpleNamespace(user=user)})
+            return serializer.is_valid()
+
+        self.assertTrue(validate(self.member, own_key))
+        self.assertTrue(validate(outsider, f'temp_uploads/{outsider.id}/document.pdf'))
+        # کلید قابل حدس blobs/ سازمان دیگر یا فایل موقت کاربر دیگر
+        self.assertFalse(validate(outsider, own_key))
+        self.assertFalse(validate(outsider, f'temp_uploads/{self.user.id}/document.pdf'))
+        self.assertFalse(validate(outsider, f'blobs/users/{outsider.id}/../../{own_key}'))
+
+    def test_upload_of_concurrently_cleaned_blob_is_stored_again(self):
+        self.upload(self.user)
+        touch = blobs._touch
+
+        def cleaned_then_touch(blob, user=None):
+            # cleanup_unreferenced همزمان ردیف را حذف کرده است
+            AttachmentBlob.objects.filter(id=blob.id).delete()
+            return touch(blob, user)
+
+        with mock.patch('chat.blobs._touch', side_effect=cleaned_then_touch):
+            result = self.upload(self.member)
+
+        self.assertFalse(result['deduplicated'])
+        self.assertEqual(self.storage.upload_stream.call_count, 2)
+        self.assertEqual(AttachmentBlob.objects.get().object_key, result['object_key'])
+
+    def test_references_follow_message_attachments(self):
+        object_key = self.upload(self.user)['object_key']
+        attachment = {
+            'object_key': object_key,
+            'filename': 'document.pdf',
+            'file_type': 'application/pdf',
+            'size_bytes': len(CONTENT),
+        }
+
+        start_turn(self.user, {'query': 'سوال اول', 'file_attachments': [attachment, attachment]})
+        start_turn(self.user, {'query': 'سوال دوم', 'file_attachments': [attachment]})
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 3)
+
+        Conversation.all_objects.filter(title='سوال اول').delete()
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 1)
+
+        Conversation.all_objects.filter(user=self.user).delete()
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 0)
+
+    def test_cleanup_deletes_only_expired_unreferenced_blobs(self):
+        old = timezone.now() - blobs.RETENTION - timedelta(hours=1)
+        for name, ref_count, last_used_at in [
+            ('referenced', 1, old),
+            ('expired', 0, old),
+            ('recent', 0, timezone.now()),
+        ]:
+            AttachmentBlob.objects.create(
+                scope=f'users/{self.user.id}',
+                sha256=hashlib.sha256(name.encode()).hexdigest(),
+                object_key=f'blobs/{name}',
+                size_bytes=1,
+                content_type='text/plain',
+                ref_count=ref_count,
+                last_used_at=last_used_at
+            )
+
+        self.assertEqual(blobs.cleanup_unreferenced(), 1)
+
+        self.storage.delete_files.assert_called_once_with(['blobs/expired'])
+        self.assertEqual(
+            set(AttachmentBlob.objects.values_list('object_key', flat=True)),
+            {'blobs/referenced', 'blobs/recent'}
+        )
@@ -0,0 +1,93 @@
+"""
+تست backpressure حالت streaming در ChatConsumer
+frame های chunk بدون تایید کلاینت (ack) بیش از ack_window پیش‌فرض ارسال نمی‌شوند و
+پس از STREAM_ACK_TIMEOUT درخواست Core بسته و خطای slow_consumer ارسال می‌شود.
+
+اجرا:
+    python manage.py test tests.test_chat_consumer_stream
+"""
+import asyncio
+import json
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from chat.consumers import ChatConsumer
+
+CHUNK = 'x' * ChatConsumer.STREAM_FLUSH_SIZE
+
+
+class ChatConsumerStreamTest(SimpleTestCase):
+
+    def setUp(self):
+        self.core_closed = False
+        self.patch('chat.consumers.core_service.stream_query', side_effect=self.core_stream)
+        self.finish_turn = self.patch('chat.consumers.finish_turn')
+
+        self.consumer = ChatConsumer()
+        self.consumer.scope = {'client': ['127.0.0.1', 0], 'headers': []}
+        self.consumer.STREAM_ACK_TIMEOUT = 0.2
+        self.consumer.acked_seq = 0
+        self.consumer.ack_event = asyncio.Event()
+        self.consumer.send = mock.AsyncMock(side_effect=self.receive_frame)
+        self.consumer.update_message_status = mock.AsyncMock()
+        self.consumer.get_priority = mock.Mock(return_value=None)
+        self.consumer.log_turn_later = mock.Mock()
+        self.consumer.begin_turn = mock.AsyncMock(return_value=self.turn())
+        self.client_acks = False
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    @staticmethod
+    def turn():
+        return {
+            'conversation': SimpleNamespace(id=uuid.uuid4(), rag_conversation_id=''),
+            'user_message': SimpleNamespace(id=uuid.uuid4()),
+            'assistant_message': SimpleNamespace(id=uuid.uuid4(), content=''),
+            'token': 'token',
+            'enable_web_search': None,
+            'priority': {},
+        }
+
+    async def core_stream(self, **kwargs):
+        try:
+            for _ in range(100):
+                yield {'type': 'chunk', 'content': CHUNK}
+            yield {'type': 'done', 'data': {}}
+        finally:
+            self.core_closed = True
+
+    async def receive_frame(self, text_data):
+        frame = json.loads(text_data)
+        if frame['type'] == 'chunk' and self.client_acks:
+            asyncio.get_running_loop().call_soon(self.consumer.handle_ack, {'seq': frame['seq']})
+
+    def frames(self, frame_type):
+        frames = [json.loads(call.kwargs['text_data']) for call in self.consumer.send.call_args_list]
+        return [frame for frame in frames if frame['type'] == frame_type]
+
+    def test_client_without_acks_gets_slow_consumer_error(self):
+        async_to_sync(self.consumer.handle_query)({'query': 'سوال', 'stream': True})
+
+        self.assertEqual(len(self.frames('chunk')), ChatConsumer.STREAM_DEFAULT_ACK_WINDOW)
+        self.assertEqual([frame['code'] for frame in self.frames('error')], ['slow_consumer'])
+        self.assertTrue(self.core_closed)
+        self.finish_turn.assert_not_called()
+        status = self.consumer.update_message_status.call_args.args[1]
+        self.assertEqual(status, 'failed')
+
+    def test_acknowledging_client_receives_full_answer(self):
+        self.client_acks = True
+
+        result = async_to_sync(self.consumer.handle_query)({'query': 'سوال', 'stream': True, 'ack_window': 4})
+
+        self.assertEqual(len(self.frames('chunk')), 100)
+        self.assertEqual(len(result['content']), 100 * len(CHUNK))
+        self.assertFalse(self.frames('error'))
+        self.finish_turn.assert_called_once()
@@ -0,0 +1,100 @@
+"""
+تست دستور cleanup_orphan_conversations
+خطای Core در هر صفحه از گفتگوهای کاربر پایان لیست تعبیر نمی‌شود: گفتگویی از
+لیست ناقص حذف نمی‌شود، کاربر در stats['errors'] و checkpoint ثبت می‌شود و
+--resume او را دوباره پردازش می‌کند.
+
+اجرا:
+    python manage.py test tests.test_cleanup_orphan_conversations
+"""
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from chat.models import Conversation
+
+User = get_user_model()
+
+
+class CleanupOrphanConversationsTest(TestCase):
+
+    def setUp(self):
+        self.flaky = User.objects.create_user(
+            email='orphan-flaky@example.com',
+            phone_number='09120000090',
+            password='test-pass-123'
+        )
+        self.healthy = User.objects.create_user(
+            email='orphan-healthy@example.com',
+            phone_number='09120000089',
+            password='test-pass-123'
+        )
+        Conversation.objects.create(user=self.healthy, title='گفتگو', rag_conversation_id='kept')
+        self.core_fails = True
+
+        self.patch(
+            'chat.management.commands.cleanup_orphan_conversations.get_core_access_token',
+            side_effect=lambda user: str(user.id)
+        )
+        self.patch('chat.core_service.core_service.get_conversations', side_effect=self.get_conversations)
+        self.delete = self.patch(
+            'chat.core_service.core_service.delete_conversation',
+            new_callable=mock.AsyncMock,
+            return_value=True
+        )
+        self.patch('chat.core_service.core_service.aclose', new_callable=mock.AsyncMock)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint.json')
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    async def get_conversations(self, token, limit, offset, raise_errors=False):
+        if token == str(self.healthy.id):
+            return [{'id': 'kept'}, {'id': 'orphan-healthy'}][offset:offset + limit]
+        if offset == 0:
+            return [{'id': 'flaky-1'}, {'id': 'flaky-2'}]
+        if self.core_fails:
+            # مانند core_service.get_conversations: بدون raise_errors لیست خالی
+            if not raise_errors:
+                return []
+            raise httpx.ReadTimeout('timeout')
+        return []
+
+    def run_command(self, *args):
+        call_command(
+            'cleanup_orphan_conversations', '--page-size', '2', '--min-age', '0', '--rate', '0',
+            '--checkpoint', self.checkpoint, *args, stdout=StringIO()
+        )
+
+    def deleted_ids(self):
+        return sorted(call.kwargs['conversation_id'] for call in self.delete.await_args_list)
+
+    def test_failed_page_is_counted_and_retried_on_resume(self):
+        self.run_command()
+
+        # لیست ناقص کاربر ناموفق به حذف گفتگوهای او منجر نمی‌شود
+        self.assertEqual(self.deleted_ids(), ['orphan-healthy'])
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        self.assertEqual(checkpoint['failed_user_ids'], [str(self.flaky.id)])
+        self.assertEqual(checkpoint['stats']['errors'], 1)
+        self.assertEqual(checkpoint['stats']['users'], 1)
+
+        self.core_fails = False
+        self.delete.reset_mock()
+        self.run_command('--resume')
+
+        self.assertEqual(self.deleted_ids(), ['flaky-1', 'flaky-2'])
+        self.assertFalse(os.path.exists(self.checkpoint))
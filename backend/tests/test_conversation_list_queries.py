@@ -0,0 +1,83 @@
+"""
+تست رگرسیون تعداد query در لیست گفتگوها و پوشه‌ها
+تعداد query ها نباید به تعداد گفتگوها/پوشه‌های صفحه وابسته باشد (N+1)
+
+اجرا:
+    python manage.py test tests.test_conversation_list_queries
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from chat.models import Conversation, ConversationFolder
+from chat.turns import finish_turn, start_turn
+
+User = get_user_model()
+
+META = {'action': 'chat_query', 'query_length': 0}
+
+
+class ConversationListQueryCountTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='list-test@example.com',
+            phone_number='09120000099',
+            password='test-pass-123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_conversations(self, count, folder=None):
+        for i in range(count):
+            turn = start_turn(self.user, {'query': f'سوال شماره {i}'})
+            finish_turn(turn, {'answer': 'پاسخ ' * 50, 'tokens_used': 10}, META)
+            if folder is not None:
+                Conversation.objects.filter(id=turn['conversation'].id).update(folder=folder)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context), response.json()
+
+    def test_conversation_list_query_count_is_constant(self):
+        url = '/api/v1/chat/conversations/'
+
+        self.create_conversations(2)
+        small_count, _ = self.count_queries(url)
+
+        self.create_conversations(15)
+        large_count, data = self.count_queries(url)
+
+        self.assertEqual(len(data['results']), 17)
+        self.assertEqual(small_count, large_count)
+
+    def test_last_message_preview(self):
+        self.create_conversations(1)
+        _, data = self.count_queries('/api/v1/chat/conversations/')
+
+        last_message = data['results'][0]['last_message']
+        self.assertEqual(last_message['role'], 'assistant')
+        self.assertEqual(len(last_message['content']), 103)
+        self.assertTrue(last_message['content'].endswith('...'))
+        self.assertEqual(data['results'][0]['message_count'], 1)
+        self.assertEqual(data['results'][0]['token_usage'], 10)
+
+    def test_folder_list_query_count_is_constant(self):
+        url = '/api/v1/chat/folders/'
+
+        folder = ConversationFolder.objects.create(user=self.user, name='پوشه 0')
+        self.create_conversations(2, folder=folder)
+        small_count, _ = self.count_queries(url)
+
+        for i in range(1, 10):
+            ConversationFolder.objects.create(user=self.user, name=f'پوشه {i}')
+        large_count, data = self.count_queries(url)
+
+        self.assertEqual(small_count, large_count)
+        counts = {item['name']: item['conversations_count'] for item in data['results']}
+        self.assertEqual(counts['پوشه 0'], 2)
+        self.assertEqual(counts['پوشه 1'], 0)
@@ -0,0 +1,129 @@
+"""
+تست outbox حذف گفتگوها از RAG Core (chat.deletions)
+tombstone گفتگو را پنهان و ردیف CoreDeletion ثبت می‌کند؛ drain ردیف‌های آماده را
+برمی‌دارد، پس از موفقیت Core گفتگو را نهایی حذف می‌کند و خطاها را با backoff
+دوباره تلاش می‌کند. client هر loop کوتاه‌عمر (asyncio.run) پس از هر دسته بسته می‌شود.
+
+اجرا:
+    python manage.py test tests.test_core_deletions
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from chat import deletions
+from chat.models import Conversation, CoreDeletion
+
+User = get_user_model()
+
+
+class CoreDeletionOutboxTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='core-deletion-test@example.com',
+            phone_number='09120000095',
+            password='test-pass-123'
+        )
+        self.core_delete = self.patch(
+            'chat.deletions.core_service.delete_conversation',
+            new_callable=mock.AsyncMock,
+            return_value=True
+        )
+        self.aclose = self.patch('chat.deletions.core_service.aclose', new_callable=mock.AsyncMock)
+        self.patch('accounts.tokens.get_core_access_token', return_value='token')
+        self.patch('chat.deletions.schedule_drain')
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def tombstone(self, rag_conversation_id='rag-1'):
+        conversation = Conversation.objects.create(
+            user=self.user,
+            title='گفتگو',
+            rag_conversation_id=rag_conversation_id
+        )
+        deletions.tombstone_conversations(Conversation.objects.filter(id=conversation.id))
+        return conversation
+
+    def test_tombstone_hides_conversation_and_queues_deletion(self):
+        conversation = self.tombstone()
+
+        self.assertFalse(Conversation.objects.filter(id=conversation.id).exists())
+        self.assertTrue(Conversation.all_objects.filter(id=conversation.id).exists())
+        deletion = CoreDeletion.objects.get(conversation_id=conversation.id)
+        self.assertEqual(deletion.status, 'pending')
+        self.assertEqual(deletion.rag_conversation_id, 'rag-1')
+
+        # tombstone دوباره ردیف تکراری ثبت نمی‌کند
+        deleted = deletions.tombstone_conversations(Conversation.all_objects.filter(id=conversation.id))
+        self.assertEqual(deleted, 0)
+        self.assertEqual(CoreDeletion.objects.count(), 1)
+
+    def test_claim_batch_skips_rows_not_due_or_leased(self):
+        self.tombstone('rag-due')
+        self.tombstone('rag-later')
+        self.tombstone('rag-stale')
+        now = timezone.now()
+        CoreDeletion.objects.filter(rag_conversation_id='rag-later').update(
+            next_attempt_at=now + timedelta(minutes=5)
+        )
+        CoreDeletion.objects.filter(rag_conversation_id='rag-stale').update(status='processing')
+
+        claimed = deletions.claim_batch(10)
+
+        self.assertEqual([d.rag_conversation_id for d in claimed], ['rag-due'])
+        self.assertEqual(CoreDeletion.objects.get(rag_conversation_id='rag-due').status, 'processing')
+        # ردیف برداشته شده تا پایان lease دوباره برداشته نمی‌شود
+        self.assertEqual(deletions.claim_batch(10), [])
+
+        # lease منقضی شده (worker متوقف شده) دوباره برداشته می‌شود
+        CoreDeletion.objects.filter(rag_conversation_id='rag-stale').update(
+            updated_at=now - deletions.PROCESSING_LEASE - timedelta(minutes=1)
+        )
+        self.assertEqual([d.rag_conversation_id for d in deletions.claim_batch(10)], ['rag-stale'])
+
+    def test_drain_deletes_conversation_after_core_success(self):
+        conversation = self.tombstone()
+        empty = self.tombstone(rag_conversation_id='')
+
+        result = deletions.drain()
+
+        self.assertEqual(result, {'deleted': 2, 'failed': 0})
+        self.assertFalse(Conversation.all_objects.filter(id__in=[conversation.id, empty.id]).exists())
+        self.assertFalse(CoreDeletion.objects.exists())
+        # گفتگوی بدون rag id بدون فراخوانی Core حذف می‌شود
+        self.core_delete.assert_awaited_once_with(conversation_id='rag-1', token='token')
+        self.aclose.assert_awaited_once()
+
+    def test_failure_backs_off_and_eventually_fails(self):
+        conversation = self.tombstone()
+        self.core_delete.return_value = False
+
+        result = deletions.drain()
+
+        self.assertEqual(result, {'deleted': 0, 'failed': 1})
+        deletion = CoreDeletion.objects.get(conversation_id=conversation.id)
+        self.assertEqual(deletion.status, 'pending')
+        self.assertEqual(deletion.attempts, 1)
+        self.assertGreater(deletion.next_attempt_at, timezone.now() + timedelta(seconds=20))
+        self.assertTrue(Conversation.all_objects.filter(id=conversation.id).exists())
+        # تا پایان backoff دوباره تلاش نمی‌شود
+        self.assertEqual(deletions.drain(), {'deleted': 0, 'failed': 0})
+
+        CoreDeletion.objects.filter(id=deletion.id).update(
+            attempts=deletions.MAX_ATTEMPTS - 1,
+            next_attempt_at=timezone.now()
+        )
+        deletions.drain()
+
+        deletion.refresh_from_db()
+        self.assertEqual(deletion.status, 'failed')
+        self.assertEqual(deletion.attempts, deletions.MAX_ATTEMPTS)
+        # client هر دسته پس از پایان آن بسته می‌شود
+        self.assertEqual(self.aclose.await_count, 2)
@@ -0,0 +1,107 @@
+"""
+تست Idempotency-Key برای ارسال سوال
+retry با همان کلید پاسخ ذخیره شده را بدون فراخوانی دوباره Core و بدون کسر
+سهمیه برمی‌گرداند؛ حتی اگر درخواست اول آخرین سهمیه کاربر را مصرف کرده باشد.
+
+اجرا:
+    python manage.py test tests.test_idempotency
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat.models import Conversation
+from subscriptions.models import Plan, Subscription
+from subscriptions.usage import UsageLog
+
+User = get_user_model()
+
+URL = '/api/v1/chat/query/'
+CORE_RESPONSE = {
+    'answer': 'پاسخ سیستم مرکزی',
+    'sources': [],
+    'tokens_used': 12,
+    'conversation_id': 'rag-conv-1',
+    'message_id': 'rag-msg-1',
+}
+
+
+class IdempotentQueryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='idempotency-test@example.com',
+            phone_number='09120000097',
+            password='test-pass-123'
+        )
+        plan = Plan.objects.create(name='یک سوال', price=0, max_queries_per_day=1, max_queries_per_month=10)
+        Subscription.objects.create(
+            user=self.user,
+            plan=plan,
+            status='active',
+            end_date=timezone.now() + timedelta(days=30)
+        )
+        # نشست Django تا SubscriptionMiddleware کاربر را ببیند
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+        self.core = self.patch('chat.core_service.core_service.send_query', return_value=CORE_RESPONSE)
+        self.patch('chat.answer_cache.lookup', return_value=None)
+        self.patch('chat.answer_cache.store')
+        self.patch('chat.turns.get_core_access_token', return_value='token')
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def post(self, query, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post(URL, {'query': query}, format='json', **headers)
+
+    def test_retry_of_last_quota_request_is_replayed(self):
+        first = self.post('ماده ۱۰ قانون مدنی چیست؟', 'key-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(UsageLog.objects.filter(user=self.user).count(), 1)
+
+        retry = self.post('ماده ۱۰ قانون مدنی چیست؟', 'key-1')
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.core.assert_called_once()
+        self.assertEqual(Conversation.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UsageLog.objects.filter(user=self.user).count(), 1)
+
+    def test_new_key_is_still_limited_by_quota(self):
+        self.assertEqual(self.post('سوال اول', 'key-1').status_code, 200)
+
+        response = self.post('سوال دوم', 'key-2')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['code'], 'QUOTA_EXCEEDED')
+        self.core.assert_called_once()
+
+    def test_key_reused_for_different_query_is_rejected(self):
+        self.assertEqual(self.post('سوال اول', 'key-1').status_code, 200)
+
+        response = self.post('سوال دیگر', 'key-1')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['code'], 'idempotency_key_reused')
+
+    def test_failed_request_releases_key(self):
+        self.core.side_effect = [RuntimeError('core down'), CORE_RESPONSE]
+        self.assertEqual(self.post('سوال اول', 'key-1').status_code, 500)
+
+        response = self.post('سوال اول', 'key-1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(self.core.call_count, 2)
@@ -0,0 +1,112 @@
+"""
+تست صفحه‌بندی keyset (cursor) در هر دو جهت
+next -> موارد قدیمی‌تر، previous -> موارد جدیدتر؛ لینک previous صفحه اول برای
+دریافت موارد جدید قابل استفاده مجدد است.
+
+اجرا:
+    python manage.py test tests.test_keyset_pagination
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='keyset-test@example.com',
+            phone_number='09120000096',
+            password='test-pass-123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.base_time = timezone.now() - timedelta(hours=1)
+        self.conversation = Conversation.objects.create(
+            user=self.user,
+            title='صفحه‌بندی',
+            last_message_at=self.base_time
+        )
+        self.url = f'/api/v1/chat/conversations/{self.conversation.id}/messages/'
+        for i in range(7):
+            self.add_message(i)
+
+    def add_message(self, i):
+        message = Message.objects.create(conversation=self.conversation, role='user', content=f'پیام {i}')
+        # زمان‌های متمایز و قطعی برای ترتیب
+        Message.objects.filter(id=message.id).update(created_at=self.base_time + timedelta(minutes=i))
+
+    def get(self, url, params=None, field='content'):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data, [item[field] for item in data['results']]
+
+    def test_next_walks_to_oldest(self):
+        data, contents = self.get(self.url, {'pagination': 'cursor', 'page_size': 3})
+        self.assertEqual(contents, ['پیام 6', 'پیام 5', 'پیام 4'])
+        self.assertNotIn('count', data)
+
+        seen = list(contents)
+        while data['next']:
+            data, contents = self.get(data['next'])
+            seen += contents
+
+        self.assertEqual(seen, [f'پیام {i}' for i in range(6, -1, -1)])
+
+    def test_previous_walks_back_to_newest(self):
+        data, _ = self.get(self.url, {'pagination': 'cursor', 'page_size': 3})
+        pages = [data]
+        while data['next']:
+            data, _ = self.get(data['next'])
+            pages.append(data)
+        self.assertEqual(len(pages), 3)
+
+        # از صفحه آخر (قدیمی‌ترین) با previous به سمت جدیدترین
+        data, contents = self.get(pages[-1]['previous'])
+        self.assertEqual(contents, ['پیام 3', 'پیام 2', 'پیام 1'])
+        data, contents = self.get(data['previous'])
+        self.assertEqual(contents, ['پیام 6', 'پیام 5', 'پیام 4'])
+
+    def test_previous_of_first_page_polls_for_new_items(self):
+        data, _ = self.get(self.url, {'pagination': 'cursor', 'page_size': 3})
+        newer = data['previous']
+        self.assertTrue(newer)
+
+        data, contents = self.get(newer)
+        self.assertEqual(contents, [])
+        self.assertEqual(data['previous'], newer)
+
+        self.add_message(7)
+        self.add_message(8)
+        data, contents = self.get(newer)
+        self.assertEqual(contents, ['پیام 8', 'پیام 7'])
+
+    def test_page_number_mode_is_default(self):
+        data, contents = self.get(self.url)
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(len(contents), 7)
+
+    def test_conversation_list_cursor(self):
+        for i in range(4):
+            Conversation.objects.create(
+                user=self.user,
+                title=f'گفتگو {i}',
+                last_message_at=self.base_time + timedelta(minutes=10 + i)
+            )
+        url = '/api/v1/chat/conversations/'
+
+        data, titles = self.get(url, {'pagination': 'cursor', 'page_size': 2}, 'title')
+        self.assertEqual(titles, ['گفتگو 3', 'گفتگو 2'])
+        data, titles = self.get(data['next'], field='title')
+        self.assertEqual(titles, ['گفتگو 1', 'گفتگو 0'])
+        data, titles = self.get(data['previous'], field='title')
+        self.assertEqual(titles, ['گفتگو 3', 'گفتگو 2'])
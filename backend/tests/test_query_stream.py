@@ -0,0 +1,140 @@
+"""
+تست رله SSE پاسخ Core (chat.stream_views)
+پایان موفق stream در کنترل پذیرش Core (core_admission) به عنوان موفقیت ثبت می‌شود
+تا زمان اولین بایت و افزایش limit از مسیر SSE هم تغذیه شوند. با قطع اتصال کلاینت
+(StreamDisconnectMiddleware) درخواست Core بسته و پاسخ ناقص ذخیره می‌شود.
+
+اجرا:
+    python manage.py test tests.test_query_stream
+"""
+import asyncio
+from unittest import mock
+
+import httpx
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from chat.core_admission import CoreAdmissionController
+from chat.stream_views import _event_stream
+from chat.turns import start_turn
+from core.middleware import StreamDisconnectMiddleware
+
+User = get_user_model()
+
+CORE_STREAM = (
+    'data: {"type": "chunk", "content": "پاسخ "}\n\n'
+    'data: {"type": "chunk", "content": "کامل"}\n\n'
+    'data: {"type": "done", "data": {"conversation_id": "rag-conv-1", "sources": []}}\n\n'
+).encode('utf-8')
+
+
+class HangingCoreStream(httpx.AsyncByteStream):
+    """یک تکه پاسخ و سپس انتظار بدون پایان (Core در حال تولید پاسخ)"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.closed = False
+
+    async def __aiter__(self):
+        yield 'data: {"type": "chunk", "content": "پاسخ ناقص"}\n\n'.encode('utf-8')
+        self.started.set()
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+class QueryStreamAdmissionTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='query-stream-test@example.com',
+            phone_number='09120000092',
+            password='test-pass-123'
+        )
+        self.admission = CoreAdmissionController()
+        self.core_stream = None
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, stream=self.core_stream or httpx.ByteStream(CORE_STREAM))
+        )
+        self.patch('chat.core_service.core_service.admission', self.admission)
+        self.patch('chat.core_service.core_service.priority.enabled', False)
+        self.patch(
+            'chat.core_service.core_service._get_client',
+            return_value=httpx.AsyncClient(transport=transport)
+        )
+        self.patch('chat.turns.get_core_access_token', return_value='token')
+        self.patch('chat.turns.log_turn')
+
+    def patch(self, target, *args, **kwargs):
+        patcher = mock.patch(target, *args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def stream(self, query):
+        turn = start_turn(self.user, {'query': query})
+
+        async def collect():
+            return [event async for event in _event_stream(turn, query, 'fa', self.meta(query))]
+
+        return turn, async_to_sync(collect)()
+
+    @staticmethod
+    def meta(query):
+        return {'action': 'chat_query_stream', 'query_length': len(query)}
+
+    def test_successful_stream_is_recorded_by_admission(self):
+        initial_limit = self.admission._limit
+
+        turn, events = self.stream('ماده ۱۰ قانون مدنی چیست؟')
+
+        self.assertTrue(events[-1].startswith('event: done'))
+        turn['assistant_message'].refresh_from_db()
+        self.assertEqual(turn['assistant_message'].content, 'پاسخ کامل')
+        self.assertEqual(self.admission._counters['succeeded'], 1)
+        self.assertEqual(self.admission._in_flight, 0)
+        self.assertGreater(self.admission._limit, initial_limit)
+        self.assertIsNotNone(self.admission._latency_ewma)
+
+    def test_client_disconnect_closes_core_stream(self):
+        query = 'سوال طولانی'
+        turn = start_turn(self.user, {'query': query})
+        self.core_stream = HangingCoreStream()
+        sent = []
+
+        async def app(scope, receive, send):
+            # معادل ASGIHandler برای StreamingHttpResponse
+            await receive()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            async for event in _event_stream(turn, query, 'fa', self.meta(query)):
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+            await send({'type': 'http.response.body'})
+
+        async def run():
+            messages = asyncio.Queue()
+            await messages.put({'type': 'http.request', 'body': b''})
+
+            async def send(message):
+                sent.append(message)
+
+            request = asyncio.ensure_future(
+                StreamDisconnectMiddleware(app)({'type': 'http', 'path': '/'}, messages.get, send)
+            )
+            await asyncio.wait_for(self.core_stream.started.wait(), 5)
+            await messages.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(request, 5)
+
+        with mock.patch('core.middleware.disconnect_middleware.signals.request_finished.send') as finished:
+            async_to_sync(run)()
+
+        self.assertTrue(self.core_stream.closed)
+        self.assertFalse(any(m['type'] == 'http.response.body' and not m.get('more_body') for m in sent))
+        finished.assert_called_once()
+        self.assertEqual(self.admission._in_flight, 0)
+        self.assertEqual(self.admission._counters['succeeded'], 0)
+        message = turn['assistant_message']
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'failed')
+        self.assertEqual(message.error_message, 'client disconnected')
+        self.assertEqual(message.content, 'پاسخ ناقص')
@@ -60,6 +60,7 @@ class SystemTester:
         
         try:
             s3 = S3Service()
+            s3.ensure_bucket()
             self.print_success("اتصال به MinIO برقرار شد")
             
             test_file = BytesIO(b"Test file content for MinIO")
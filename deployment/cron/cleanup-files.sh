@@ -3,5 +3,5 @@
 # اجرا: هر روز ساعت 2 صبح
 
 echo "$(date): Starting MinIO cleanup..."
-docker exec app_backend python3 /srv/cleanup_old_files.py --hours 24
+docker exec app_backend python manage.py cleanup_storage --hours 24
 echo "$(date): Cleanup completed"
@@ -974,6 +974,14 @@ else
     print_warning "Static file collection failed - you can run it later"
 fi
 
+# Check (and create) MinIO bucket - runs once per deploy, not on every process start
+print_info "Checking MinIO bucket..."
+if docker compose exec -T backend python manage.py check_storage 2>&1; then
+    print_success "MinIO bucket is ready"
+else
+    print_warning "MinIO bucket check failed - run later: docker compose exec backend python manage.py check_storage"
+fi
+
 # Setup initial data (currencies, plans, settings, superuser)
 print_info "Setting up initial data (currencies, plans, payment gateways, settings, superuser)..."
 DJANGO_ADMIN_PASSWORD=$(grep '^DJANGO_ADMIN_PASSWORD=' "$ENV_FILE" | cut -d'=' -f2)
@@ -179,6 +179,6 @@ export interface QueryResponse {
 }
 
 export interface WebSocketMessage {
-  type: 'connection' | 'query' | 'typing' | 'feedback' | 'chunk' | 'sources' | 'error' | 'ping' | 'pong' | 'processing_started' | 'processing_completed' | 'message_received'
+  type: 'connection' | 'query' | 'typing' | 'feedback' | 'chunk' | 'sources' | 'error' | 'ping' | 'pong' | 'processing_started' | 'processing_completed' | 'message_received' | 'queue_position'
   [key: string]: any
 }